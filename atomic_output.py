@@ -0,0 +1,150 @@
+"""Scrittura atomica dei file prodotti dagli script, con manifest e salto dei file invariati.
+
+Ogni fase scrive i propri file in una cartella temporanea (`.tmp-<fase>` nella cartella di
+output, con gli stessi percorsi relativi e gli stessi nomi dei file finali) e solo quando ha
+finito li sposta al loro posto con os.replace: un'interruzione lascia intatti i file
+dell'esecuzione precedente.
+
+Un file identico byte per byte a quello gia' presente non viene sostituito (resta anche la sua
+mtime) e nel manifest risulta `"changed": false`, cosi' chi lo importa puo' saltarlo.
+
+`manifest.json` nella cartella di output contiene per ogni file (percorso relativo): fase che
+l'ha prodotto, righe, sha256, dimensione, mtime, se e' cambiato e quando e' stato verificato.
+
+    with OutputSet(base_dir, 'orario.dipendenti') as outputs:
+        with open(outputs.path(sql_path), 'w') as f:
+            ...
+        outputs.set_rows(sql_path, n)
+    # qui i file sono pubblicati (o scartati se il blocco e' uscito con un'eccezione)
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+
+from code_index import file_sha256
+
+MANIFEST_NAME = 'manifest.json'
+# le fasi di main.py girano su thread diversi e aggiornano lo stesso manifest
+_manifest_lock = threading.Lock()
+
+
+def manifest_path(base_dir):
+    return os.path.join(base_dir, MANIFEST_NAME)
+
+
+def load_manifest(base_dir):
+    try:
+        with open(manifest_path(base_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}}
+
+
+def _write_manifest(base_dir, manifest):
+    path = manifest_path(base_dir)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _known_sha256(path, entry):
+    """sha256 del file esistente: dal manifest se dimensione e mtime coincidono, altrimenti calcolato."""
+    st = os.stat(path)
+    if entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns:
+        return entry.get('sha256')
+    return file_sha256(path)
+
+
+def published_sha256(base_dir, paths):
+    """{percorso: sha256} dei file esistenti tra `paths`, dal manifest se non sono cambiati da allora."""
+    base_dir = os.path.abspath(base_dir)
+    files = load_manifest(base_dir).get('files', {})
+    digests = {}
+    for path in paths:
+        if os.path.exists(path):
+            key = os.path.relpath(os.path.abspath(path), base_dir).replace(os.sep, '/')
+            digests[path] = _known_sha256(path, files.get(key))
+    return digests
+
+
+class OutputSet:
+    """File di output di una fase: scritti in temporaneo e pubblicati insieme da `commit`."""
+
+    def __init__(self, base_dir, stage):
+        self.base_dir = os.path.abspath(base_dir)
+        self.stage = stage
+        self.tmp_dir = os.path.join(self.base_dir, f'.tmp-{stage}')
+        # file temporanei rimasti da un'esecuzione interrotta
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self._pending = {}
+        self.changed = {}
+
+    def _key(self, final_path):
+        return os.path.relpath(os.path.abspath(final_path), self.base_dir).replace(os.sep, '/')
+
+    def path(self, final_path, rows=None):
+        """Percorso temporaneo in cui scrivere `final_path` (stesso nome, dentro la cartella temporanea)."""
+        tmp = os.path.join(self.tmp_dir, self._key(final_path))
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        self._pending[os.path.abspath(final_path)] = [tmp, rows]
+        return tmp
+
+    def set_rows(self, final_path, rows):
+        self._pending[os.path.abspath(final_path)][1] = rows
+
+    def commit(self):
+        """Pubblica i file scritti finora; restituisce {percorso finale: cambiato}."""
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        committed = {}
+        with _manifest_lock:
+            manifest = load_manifest(self.base_dir)
+            files = manifest.setdefault('files', {})
+            for final, (tmp, rows) in self._pending.items():
+                if not os.path.exists(tmp):
+                    # percorso richiesto ma non scritto (es. il TSV quando il formato non e' load)
+                    continue
+                key = self._key(final)
+                sha = file_sha256(tmp)
+                size = os.path.getsize(tmp)
+                entry = files.get(key)
+                unchanged = (
+                    os.path.exists(final) and os.path.getsize(final) == size
+                    and _known_sha256(final, entry) == sha
+                )
+                if unchanged:
+                    os.remove(tmp)
+                else:
+                    os.makedirs(os.path.dirname(final), exist_ok=True)
+                    os.replace(tmp, final)
+                st = os.stat(final)
+                files[key] = {
+                    'stage': self.stage,
+                    'rows': rows,
+                    'sha256': sha,
+                    'size': size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'changed': not unchanged,
+                    'checked_at': now,
+                    'changed_at': now if not unchanged else (entry or {}).get('changed_at'),
+                }
+                committed[final] = not unchanged
+            _write_manifest(self.base_dir, manifest)
+        self._pending = {}
+        self.changed.update(committed)
+        return committed
+
+    def discard(self):
+        self._pending = {}
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        self.discard()
+        return False
@@ -0,0 +1,324 @@
+"""Sorgenti dati intercambiabili per gli script di estrazione.
+
+Con AUTO_BACKEND=live (default) gli script usano il server MSSQL (pyodbc) e l'host MySQL via SSH.
+Con AUTO_BACKEND=local usano invece un database SQLite (AUTO_LOCAL_DB, default ./local.sqlite)
+che imita le tabelle sorgente:
+- Tk_TabDipendenti, tk_Tab_DettDip, Tk_Tab_LivContDip al posto del database MSSQL
+- gestione_utenti al posto del database MySQL raggiunto via SSH
+
+Le query T-SQL degli script passano da `translate_sql`, che converte i pochi costrutti
+specifici di SQL Server usati (tabelle temporanee #, CAST di date letterali, concatenazione
+con +). Il database locale si popola con `bench/generate_data.py`.
+"""
+import io
+import os
+import re
+import shlex
+import sqlite3
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+from dump_reader import tsv_unescape
+
+ROOT = Path(__file__).resolve().parent
+BACKENDS = ('live', 'local')
+
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Tk_TabDipendenti (
+    Codice TEXT PRIMARY KEY,
+    Descrizione TEXT,
+    Nome TEXT,
+    Cognome TEXT,
+    RifCommPref TEXT,
+    Attivo INTEGER,
+    Ore_Sett TEXT,
+    Ore_Lun TEXT,
+    Ore_Mar TEXT,
+    Ore_Mer TEXT,
+    Ore_Gio TEXT,
+    Ore_Ven TEXT,
+    Ore_Sab TEXT,
+    Ore_Dom TEXT
+);
+CREATE TABLE IF NOT EXISTS tk_Tab_DettDip (
+    coddip TEXT,
+    da_data_attivo TEXT,
+    a_data_attivo TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_dettdip_coddip ON tk_Tab_DettDip (coddip);
+CREATE TABLE IF NOT EXISTS Tk_Tab_LivContDip (
+    CodiceDip TEXT PRIMARY KEY,
+    Livello TEXT
+);
+CREATE TABLE IF NOT EXISTS gestione_utenti (
+    id INTEGER PRIMARY KEY,
+    old_id TEXT,
+    nome TEXT,
+    username TEXT,
+    VecchiaPasswd TEXT,
+    NuovaPasswd TEXT,
+    ruolo TEXT,
+    negozio TEXT,
+    AbilitaInsOrari TEXT
+);
+"""
+# nome del database MySQL simulato dallo stand-in SSH
+LOCAL_MYSQL_DATABASES = ('orari',)
+
+_TEMP_DROP_RE = re.compile(r"IF\s+OBJECT_ID\('tempdb\.\.#(\w+)'\)\s+IS\s+NOT\s+NULL\s+DROP\s+TABLE\s+#\w+", re.I)
+_TEMP_CREATE_RE = re.compile(r"CREATE\s+TABLE\s+#(\w+)", re.I)
+_TEMP_NAME_RE = re.compile(r"#(\w+)")
+_CAST_DATE_RE = re.compile(r"CAST\('(\d{4}-\d{2}-\d{2})[^']*'\s+AS\s+DATE\)", re.I)
+_CONCAT_RE = re.compile(r"\+(\s*'[^']*'\s*)\+")
+_COLLATE_RE = re.compile(r"\s+COLLATE\s+DATABASE_DEFAULT", re.I)
+# costrutti MySQL degli script inviati da mysql_load allo stand-in SSH
+_START_TX_RE = re.compile(r"START\s+TRANSACTION\s*$", re.I)
+_CREATE_LIKE_RE = re.compile(r"CREATE\s+TABLE\s+([\w.]+)\s+LIKE\s+([\w.]+)\s*$", re.I)
+_LOAD_STDIN_RE = re.compile(
+    r"LOAD\s+DATA\s+LOCAL\s+INFILE\s+'/dev/stdin'\s+INTO\s+TABLE\s+([\w.]+).*\(([^)]*)\)\s*$", re.I | re.S)
+
+
+def backend_name():
+    name = (os.getenv('AUTO_BACKEND') or 'live').strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"AUTO_BACKEND non valido: {name!r} (ammessi: {', '.join(BACKENDS)})")
+    return name
+
+
+def is_local():
+    return backend_name() == 'local'
+
+
+def local_db_path():
+    return os.getenv('AUTO_LOCAL_DB') or str(ROOT / 'local.sqlite')
+
+
+def translate_sql(sql):
+    """Converte i costrutti T-SQL usati dagli script nell'equivalente SQLite."""
+    sql = _TEMP_DROP_RE.sub(r"DROP TABLE IF EXISTS temp.tmp_\1", sql)
+    sql = _TEMP_CREATE_RE.sub(r"CREATE TEMP TABLE tmp_\1", sql)
+    sql = _TEMP_NAME_RE.sub(r"tmp_\1", sql)
+    sql = _CAST_DATE_RE.sub(r"'\1'", sql)
+    sql = _CONCAT_RE.sub(r"||\1||", sql)
+    sql = _COLLATE_RE.sub('', sql)
+    return sql
+
+
+def create_local_db(path):
+    conn = sqlite3.connect(path)
+    # WAL: la lettura in corso lato "MSSQL" non blocca le scritture dello stand-in MySQL (MYSQL_LOAD)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(LOCAL_SCHEMA)
+    conn.commit()
+    return conn
+
+
+class LocalCursor:
+    """Cursore SQLite con l'interfaccia di pyodbc usata dagli script (righe con accesso per nome)."""
+
+    def __init__(self, cursor):
+        self._cur = cursor
+        self._row_type = None
+        self.fast_executemany = False
+        self.messages = []
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self._cur.execute(translate_sql(sql), params)
+        self._row_type = None
+        if self._cur.description:
+            names = [c[0] for c in self._cur.description]
+            self._row_type = namedtuple('Row', names, rename=True)
+            # come pyodbc.Row: la description del cursore e' raggiungibile da ogni riga
+            self._row_type.cursor_description = self._cur.description
+        return self
+
+    def executemany(self, sql, seq):
+        self._cur.executemany(translate_sql(sql), seq)
+        return self
+
+    def _wrap(self, rows):
+        row_type = self._row_type
+        return [row_type._make(r) for r in rows] if row_type else rows
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        return self._row_type._make(row) if row is not None and self._row_type else row
+
+    def fetchmany(self, size=1):
+        return self._wrap(self._cur.fetchmany(size))
+
+    def fetchall(self):
+        return self._wrap(self._cur.fetchall())
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        self._cur.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class LocalConnection:
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise RuntimeError(f"Database locale non trovato: {path} (generarlo con bench/generate_data.py)")
+        # le fasi della pipeline girano su thread diversi, ognuna con la propria connessione
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return LocalCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+@contextmanager
+def local_connection():
+    conn = LocalConnection(local_db_path())
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+class LocalSshSession:
+    """Stand-in di `ssh_session.SshSession`: esegue i comandi `mysql -B -N` sul database SQLite locale."""
+
+    def __init__(self, host=None, port=None, user=None, **kwargs):
+        self.path = local_db_path()
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        return False
+
+    def _parse(self, remote_cmd):
+        args = shlex.split(remote_cmd)
+        if not args or args[0] != 'mysql':
+            raise subprocess.CalledProcessError(127, remote_cmd, stderr=f"comando non supportato: {remote_cmd}")
+        database = args[args.index('-D') + 1] if '-D' in args else None
+        query = args[args.index('-e') + 1] if '-e' in args else None
+        return database, query
+
+    def _execute(self, remote_cmd, stdin=''):
+        """Esegue lo script mysql (da -e oppure dallo stdin) e restituisce le righe dell'ultimo SELECT."""
+        database, query = self._parse(remote_cmd)
+        if query is None:
+            query, stdin = stdin, ''
+        if query.strip().rstrip(';').upper() == 'SHOW DATABASES':
+            return [(d,) for d in LOCAL_MYSQL_DATABASES]
+        if database not in LOCAL_MYSQL_DATABASES:
+            raise subprocess.CalledProcessError(
+                1, remote_cmd, stderr=f"ERROR 1049 (42000): Unknown database '{database}'")
+        # autocommit: START TRANSACTION / COMMIT dello script decidono cosa viene confermato
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        rows = []
+        try:
+            for stmt in _split_statements(query):
+                load = _LOAD_STDIN_RE.match(stmt)
+                if load:
+                    table, cols = _unqualify(load.group(1), database), load.group(2)
+                    marks = ', '.join('?' * len(cols.split(',')))
+                    conn.executemany(
+                        f"INSERT INTO {table} ({cols}) VALUES ({marks})",
+                        ([tsv_unescape(v) for v in line.split('\t')] for line in stdin.splitlines()),
+                    )
+                    continue
+                cur = conn.execute(_mysql_to_sqlite(stmt, database))
+                if cur.description:
+                    rows = cur.fetchall()
+        except sqlite3.Error as e:
+            raise subprocess.CalledProcessError(1, remote_cmd, stderr=f"ERROR: {e}") from e
+        finally:
+            # come il server MySQL alla disconnessione: la transazione non confermata viene annullata
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+        return rows
+
+    def _lines(self, remote_cmd):
+        for row in self._execute(remote_cmd):
+            yield '\t'.join('NULL' if v is None else str(v) for v in row) + '\n'
+
+    def run(self, remote_cmd):
+        return ''.join(self._lines(remote_cmd))
+
+    @contextmanager
+    def stream(self, remote_cmd):
+        yield self._lines(remote_cmd)
+
+    @contextmanager
+    def pipe(self, remote_cmd):
+        # lo script viene eseguito solo a stdin chiuso correttamente, come un mysql che riceve EOF
+        buf = io.StringIO()
+        yield buf
+        self._execute(remote_cmd, buf.getvalue())
+
+
+def _split_statements(script):
+    """Divide uno script SQL sui `;` fuori dalle stringhe tra apici."""
+    stmt = []
+    quoted = False
+    for part in re.split(r"([';])", script):
+        if part == "'":
+            quoted = not quoted
+        elif part == ';' and not quoted:
+            text = ''.join(stmt).strip()
+            if text:
+                yield text
+            stmt = []
+            continue
+        stmt.append(part)
+    text = ''.join(stmt).strip()
+    if text:
+        yield text
+
+
+def _unqualify(name, database):
+    prefix = f"{database}."
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def _mysql_to_sqlite(stmt, database):
+    """Converte i pochi costrutti MySQL usati dai caricamenti di `mysql_load` nell'equivalente SQLite."""
+    if _START_TX_RE.match(stmt):
+        return 'BEGIN'
+    m = _CREATE_LIKE_RE.match(stmt)
+    if m:
+        return f"CREATE TABLE {_unqualify(m.group(1), database)} AS SELECT * FROM {_unqualify(m.group(2), database)} WHERE 0"
+    # i nomi qualificati col database vanno tolti solo dall'intestazione, non dai valori
+    head, sep, tail = stmt.partition(' VALUES')
+    head = re.sub(rf"\b{re.escape(database)}\.(?=\w)", '', head)
+    return head + sep + tail
+
+
+def ssh_session(host, port, user, **kwargs):
+    """Sessione SSH per i comandi mysql remoti, oppure lo stand-in locale con AUTO_BACKEND=local."""
+    if is_local():
+        return LocalSshSession(host, port, user)
+    from ssh_session import SshSession
+    return SshSession(host, port, user, **kwargs)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Benchmark di column_codecs.RowCodec contro i convertitori generici per valore.
+
+Uso: python bench/bench_column_codecs.py [--rows 200000]
+
+Genera `--rows` righe con le colonne e i tipi che pyodbc restituisce per la query di
+orario.dipendenti.py (testo, Decimal, int, date, qualche NULL) e misura il costo per riga di
+letterale SQL, riga CSV e riga TSV:
+- generico: copia della riga con try/except per indice e controllo del tipo di ogni valore
+  (`sql_literal`, `csv_value`, `tsv_value`), come prima dei convertitori per colonna
+- codec: copia della riga con islice e convertitori scelti una volta dal cursor.description
+Verifica che i due percorsi producano lo stesso testo.
+"""
+import argparse
+import decimal
+import os
+import random
+import sys
+import time
+from datetime import date
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from column_codecs import RowCodec, csv_value, sql_literal, tsv_value  # noqa: E402
+
+COLUMNS = [
+    ("Neg", str), ("NOME", str), ("Ore_Sett", decimal.Decimal), ("CODICEPERSONALE", str), ("Livello", int),
+    ("DATA_ASSUNZIONE", date), ("DATA_FINE_CONTRATTO", date),
+] + [(day, decimal.Decimal) for day in ("Lunedi", "Martedi", "Mercoledi", "Giovedi", "Venerdi", "Sabato", "Domenica")]
+# come cursor.description di pyodbc: (nome, classe Python, ...)
+DESCRIPTION = [(name, kind, None, None, None, None, True) for name, kind in COLUMNS]
+NAMES = ["ROSSI MARIO", "D'ANGELO ANNA", "BIANCHI, LUCA", "DE LUCA MARIA GRAZIA", "O'NEIL\tPAOLO"]
+
+
+def generate(rows):
+    rnd = random.Random(42)
+    hours = [decimal.Decimal(f"{h}.00") for h in (0, 4, 6, 8)]
+    return [
+        (
+            f"N{i % 300:03d}", rnd.choice(NAMES), decimal.Decimal("30.00"), str(100000 + i), rnd.randint(1, 7),
+            date(2099, 12, 31), date(2020, 1, 1) if i % 5 else None,
+            *(rnd.choice(hours) for _ in range(7)),
+        )
+        for i in range(rows)
+    ]
+
+
+def generic(rows):
+    count = len(COLUMNS)
+    out = []
+    for row in rows:
+        values = []
+        for i in range(count):
+            try:
+                val = row[i]
+            except Exception:
+                val = None
+            values.append(val)
+        out.append((
+            ', '.join([sql_literal(v) for v in values]),
+            [csv_value(v) for v in values],
+            '\t'.join([tsv_value(v) for v in values]) + '\n',
+        ))
+    return out
+
+
+def with_codec(rows):
+    count = len(COLUMNS)
+    codec = RowCodec.from_description(DESCRIPTION, count)
+    sql_values, csv_row, tsv_line = codec.sql_values, codec.csv_row, codec.tsv_line
+    out = []
+    for row in rows:
+        values = list(islice(row, count))
+        out.append((sql_values(values), csv_row(values), tsv_line(values)))
+    return out
+
+
+def measure(func, rows):
+    start = time.perf_counter()
+    result = func(rows)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    args = parser.parse_args()
+
+    rows = generate(args.rows)
+    expected, before = measure(generic, rows)
+    actual, after = measure(with_codec, rows)
+    assert actual == expected, 'i convertitori per colonna producono un risultato diverso'
+    print(f"righe: {args.rows}, colonne: {len(COLUMNS)}")
+    print(f"generico: {before:.3f}s ({before / args.rows * 1e6:.2f} us/riga)")
+    print(f"codec:    {after:.3f}s ({after / args.rows * 1e6:.2f} us/riga, {before / after:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark di dump_reader.iter_records su un dump sintetico.
+
+Uso: python bench/bench_dump_reader.py [--rows 2000000] [--format single|multi|load]
+
+Genera in una cartella temporanea un dump `dipendenti` con `--rows` righe (stesse colonne di
+orario.dipendenti.py, nomi con apici e virgole inclusi) e misura le righe al secondo lette
+con e senza mmap.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dump_reader import iter_records  # noqa: E402
+from dump_writer import SqlDumpWriter  # noqa: E402
+
+COLUMNS = [
+    "Neg", "NOME", "Ore_Sett", "CODICEPERSONALE", "Livello", "DATA_ASSUNZIONE", "DATA_FINE_CONTRATTO",
+    "Lunedi", "Martedi", "Mercoledi", "Giovedi", "Venerdi", "Sabato", "Domenica",
+]
+NAMES = ["ROSSI MARIO", "D'ANGELO ANNA", "BIANCHI, LUCA", "DE LUCA MARIA GRAZIA", "O'NEIL (JR) PAOLO"]
+
+
+def sql_literal(value):
+    if value is None:
+        return "NULL"
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def generate(path, rows, fmt):
+    rnd = random.Random(42)
+    with open(path, 'w', encoding='utf-8') as f, \
+            SqlDumpWriter(f, 'dipendenti', COLUMNS, sql_literal, fmt=fmt, tsv_path=path[:-4] + '.tsv') as dump:
+        for i in range(rows):
+            dump.write_row([
+                f"N{i % 300:03d}", rnd.choice(NAMES), '30.00', str(100000 + i), '4', '2025-01-31', None,
+                '6.00', '6.00', '6.00', '6.00', '6.00', '0.00', '0.00',
+            ])
+
+
+def measure(path, use_mmap):
+    start = time.perf_counter()
+    count = 0
+    for _ in iter_records(path, 'dipendenti', use_mmap=use_mmap):
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--format', default='single', choices=['single', 'multi', 'load'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dipendenti.sql')
+        start = time.perf_counter()
+        generate(path, args.rows, args.format)
+        size = os.path.getsize(path)
+        if args.format == 'load':
+            size += os.path.getsize(path[:-4] + '.tsv')
+        print(f"dump generato: {args.rows} righe, {size / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s")
+        for use_mmap in (False, True):
+            count, elapsed = measure(path, use_mmap)
+            label = 'mmap' if use_mmap else 'file'
+            print(f"{label:5s} {count} righe in {elapsed:.2f}s -> {count / elapsed:,.0f} righe/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark di store_rollup.StoreRollup su righe sintetiche.
+
+Uso: python bench/bench_store_rollup.py [--rows 300000] [--stores 500]
+
+Genera `--rows` righe con le colonne di orario.dipendenti.py (ore come stringhe, come arrivano
+dal cursore, con qualche valore mancante e qualche riga incoerente), le passa a `write_row` e
+misura separatamente la raccolta e il calcolo vettoriale del riepilogo; verifica i totali di
+un negozio con un calcolo riga per riga.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store_rollup import DAYS, StoreRollup  # noqa: E402
+
+COLUMNS = [
+    "Neg", "NOME", "Ore_Sett", "CODICEPERSONALE", "Livello", "DATA_ASSUNZIONE", "DATA_FINE_CONTRATTO",
+    *DAYS,
+]
+SHIFTS = {40: [0, 8, 8, 8, 8, 8, 0], 30: [0, 6, 6, 6, 6, 6, 0], 20: [4, 4, 4, 0, 4, 4, 0]}
+
+
+def generate(rows, stores):
+    rnd = random.Random(42)
+    negs = [f"N{i:04d}" for i in range(stores)]
+    out = []
+    for i in range(rows):
+        ore = rnd.choice(list(SHIFTS))
+        days = [f"{h:.2f}" for h in SHIFTS[ore]]
+        if i % 997 == 0:
+            days[1] = '9.00'
+        if i % 1999 == 0:
+            days[2] = None
+        out.append([
+            rnd.choice(negs), f"DIPENDENTE {i}", f"{ore:.2f}", str(100000 + i), str(rnd.randint(1, 7)),
+            '2020-01-01', '2099-12-31', *days,
+        ])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--stores', type=int, default=500)
+    args = parser.parse_args()
+
+    rows = generate(args.rows, args.stores)
+    rollup = StoreRollup(COLUMNS)
+    start = time.perf_counter()
+    for row in rows:
+        rollup.write_row(row)
+    collected = time.perf_counter()
+    summary = rollup.compute()
+    computed = time.perf_counter()
+
+    first = summary['stores'][0]
+    expected = sum(float(r[2]) for r in rows if r[0] == first['Neg'])
+    assert abs(expected - first['Ore_Sett']) < 0.01, (expected, first['Ore_Sett'])
+    print(f"righe: {args.rows}, negozi: {len(summary['stores'])}, incoerenti: {len(summary['mismatches'])}, "
+          f"valori mancanti: {summary['invalid_values']}")
+    print(f"raccolta: {collected - start:.3f}s, calcolo: {computed - collected:.3f}s "
+          f"({args.rows / (computed - collected):,.0f} righe/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Genera un database SQLite sintetico per AUTO_BACKEND=local.
+
+Uso: python bench/generate_data.py --employees 100000 [--output local.sqlite] [--seed 42]
+
+Popola le tabelle di `backends.LOCAL_SCHEMA` in modo simile ai dati reali: negozi con codici
+di tre lettere (piu' qualche WEB/vuoto da escludere), dipendenti non attivi, piu' periodi per
+dipendente in tk_Tab_DettDip (alcuni aperti con a_data_attivo 1900-01-01), nomi con spazi
+doppi e circa meta' dei dipendenti gia' presenti in gestione_utenti.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import create_local_db  # noqa: E402
+
+FIRST_NAMES = ['MARIO', 'ANNA', 'LUCA', 'MARIA GRAZIA', 'PAOLO', 'GIULIA', 'ROSSANA', "D'ARTAGNAN", 'SARA', 'ELENA']
+LAST_NAMES = ['ROSSI', 'BIANCHI', "D'ANGELO", 'DE LUCA', 'ESPOSITO', 'COLOMBO', 'RICCI', 'MARINO', 'GRECO', 'BRUNO']
+HOURS = {
+    40: ('0.00', '8.00', '8.00', '8.00', '8.00', '8.00', '0.00'),
+    30: ('0.00', '6.00', '6.00', '6.00', '6.00', '6.00', '0.00'),
+    20: ('4.00', '4.00', '4.00', '0.00', '4.00', '4.00', '0.00'),
+}
+CHUNK = 10000
+
+
+def store_codes(count, rnd):
+    letters = 'ABCDEFGHILMNOPRSTUVZ'
+    codes = set()
+    while len(codes) < count:
+        codes.add(''.join(rnd.choice(letters) for _ in range(3)))
+    return sorted(codes - {'WEB', 'AAA'})
+
+
+def rows(employees, rnd):
+    stores = store_codes(max(1, employees // 15), rnd) + ['WEB', '', None]
+    base = date(2010, 1, 1)
+    for i in range(employees):
+        code = str(100000 + i)
+        nome = rnd.choice(FIRST_NAMES)
+        cognome = rnd.choice(LAST_NAMES)
+        if rnd.random() < 0.05:
+            nome = ' ' + nome.replace(' ', '  ') + ' '
+        ore = rnd.choice(list(HOURS))
+        dip = (
+            code, f"{cognome} {nome}", nome, cognome,
+            rnd.choice(stores) if rnd.random() < 0.02 else rnd.choice(stores[:-3]),
+            1 if rnd.random() < 0.9 else 0, f"{ore}.00", *HOURS[ore],
+        )
+        periods = []
+        start = base + timedelta(days=rnd.randrange(5000))
+        for _ in range(rnd.randint(1, 3)):
+            end = start + timedelta(days=rnd.randrange(30, 900))
+            periods.append((code, start.isoformat(), end.isoformat()))
+            start = end + timedelta(days=1)
+        if rnd.random() < 0.2:
+            periods.append((code, start.isoformat(), '1900-01-01'))
+        level = (code, str(rnd.randint(1, 7)))
+        user = None
+        if rnd.random() < 0.5:
+            user = (code, f"{cognome} {nome.strip()}", f"{nome.strip()} {cognome}", 'AAA123', None, 'Dipendente', dip[4], None)
+        yield dip, periods, level, user
+
+
+def generate(path, employees, seed=42):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = create_local_db(path)
+    rnd = random.Random(seed)
+    batch = ([], [], [], [])
+    def flush():
+        conn.executemany("INSERT INTO Tk_TabDipendenti VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", batch[0])
+        conn.executemany("INSERT INTO tk_Tab_DettDip VALUES (?,?,?)", batch[1])
+        conn.executemany("INSERT INTO Tk_Tab_LivContDip VALUES (?,?)", batch[2])
+        conn.executemany(
+            "INSERT INTO gestione_utenti (old_id, nome, username, VecchiaPasswd, NuovaPasswd, ruolo, negozio, "
+            "AbilitaInsOrari) VALUES (?,?,?,?,?,?,?,?)", batch[3])
+        for b in batch:
+            b.clear()
+    for dip, periods, level, user in rows(employees, rnd):
+        batch[0].append(dip)
+        batch[1].extend(periods)
+        batch[2].append(level)
+        if user:
+            batch[3].append(user)
+        if len(batch[0]) >= CHUNK:
+            flush()
+    flush()
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=10000)
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'local.sqlite'))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    generate(args.output, args.employees, args.seed)
+    print(f"{args.output}: {args.employees} dipendenti")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Benchmark di scalabilita' delle fasi di estrazione sul backend locale (SQLite).
+
+Uso: python bench/run_benchmarks.py [--sizes 1000,10000,100000,1000000] [--keep DIR]
+
+Per ogni dimensione genera un database sintetico (bench/generate_data.py), poi esegue in un
+processo separato ogni fase (`nuovi.utenti.py`, `orario.dipendenti.py`,
+`orario.gestione_utenti.py`) e infine `main.py` per intero, con AUTO_BACKEND=local e le
+uscite in una cartella temporanea. Per ogni esecuzione riporta tempo, righe scritte,
+righe al secondo e picco di memoria residente (RSS) del processo.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_data import generate  # noqa: E402
+
+# (fase, script, CSV da cui contare le righe prodotte)
+STAGES = [
+    ('nuovi.utenti', 'nuovi.utenti.py', 'nuovi.utenti.csv'),
+    ('orario.dipendenti', 'orario.dipendenti.py', 'orari.dipendenti.csv'),
+    ('orario.gestione_utenti', 'orario.gestione_utenti.py', 'orari.gestione_utenti.csv'),
+    ('main (end-to-end)', 'main.py', None),
+]
+
+
+def run_measured(cmd, env):
+    """Esegue `cmd` e restituisce (returncode, secondi, picco RSS in MB o None, stderr)."""
+    # stderr in un file temporaneo e non in una pipe: un figlio che scrive piu' del buffer della
+    # pipe (~64 KiB di log) resterebbe bloccato mentre qui si aspetta la sua fine con wait4
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=err)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss e' in KB su Linux
+            peak = usage.ru_maxrss / 1024
+        else:
+            proc.wait()
+            peak = None
+        elapsed = time.perf_counter() - start
+        err.seek(0)
+        stderr = err.read().decode('utf-8', errors='replace')
+    return proc.returncode, elapsed, peak, stderr
+
+
+def count_rows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def bench_size(size, workdir):
+    db = os.path.join(workdir, f'local-{size}.sqlite')
+    start = time.perf_counter()
+    generate(db, size)
+    print(f"\n== {size} dipendenti (database generato in {time.perf_counter() - start:.1f}s)")
+    env = dict(
+        os.environ,
+        AUTO_BACKEND='local', AUTO_LOCAL_DB=db,
+        SSH_HOST='local', SSH_USER='local', DB_USER='local', DB_NAME='orari',
+    )
+    print(f"{'fase':24s} {'tempo s':>9s} {'righe':>9s} {'righe/s':>11s} {'RSS MB':>8s}")
+    for label, script, output in STAGES:
+        out_dir = os.path.join(workdir, f'out-{size}')
+        if script == 'main.py':
+            shutil.rmtree(out_dir, ignore_errors=True)
+        env['AUTO_OUTPUT_DIR'] = out_dir
+        rc, elapsed, peak, stderr = run_measured([sys.executable, os.path.join(ROOT, script)], env)
+        if rc != 0:
+            print(f"{label:24s} ERRORE (exit {rc})\n{stderr[-2000:]}")
+            continue
+        if output:
+            rows = count_rows(os.path.join(out_dir, 'csv', output))
+        else:
+            rows = sum(count_rows(os.path.join(out_dir, 'csv', o)) for _, _, o in STAGES if o)
+        peak_s = f"{peak:8.1f}" if peak is not None else f"{'n/d':>8s}"
+        print(f"{label:24s} {elapsed:9.2f} {rows:9d} {rows / elapsed:11,.0f} {peak_s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--keep', help='cartella in cui lasciare database e uscite (default: temporanea)')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        for size in sizes:
+            bench_size(size, args.keep)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in sizes:
+                bench_size(size, workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Indice dei codici (chiavi) contenuti in un dump, salvato accanto al dump stesso.
+
+Il file `<dump>.codes` contiene una riga di intestazione con mtime, dimensione e sha256 del
+dump da cui e' stato generato, seguita dai codici ordinati, uno per riga:
+
+    # mtime_ns=1700000000000000000 size=12345 sha256=...
+    102909
+    888119
+
+`load_index` restituisce i codici solo se l'indice corrisponde ancora al dump; altrimenti
+None, e chi lo usa deve ricavare i codici dal dump.
+"""
+import hashlib
+import os
+
+SUFFIX = '.codes'
+
+
+def index_path(dump_path):
+    return dump_path + SUFFIX
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dump_stamp(dump_path):
+    """Impronta del dump (mtime, dimensione, sha256) scritta nell'intestazione dei file derivati."""
+    st = os.stat(dump_path)
+    return {
+        'mtime_ns': str(st.st_mtime_ns),
+        'size': str(st.st_size),
+        'sha256': file_sha256(dump_path),
+    }
+
+
+def stamp_header(stamp):
+    return '# ' + ' '.join(f"{k}={v}" for k, v in stamp.items()) + '\n'
+
+
+def stamp_matches(header, dump_path):
+    """True se l'intestazione `header` (vedi `stamp_header`) corrisponde ancora al dump."""
+    if not header.startswith('# ') or not os.path.exists(dump_path):
+        return False
+    stamp = dict(item.split('=', 1) for item in header[2:].split() if '=' in item)
+    st = os.stat(dump_path)
+    if stamp.get('size') != str(st.st_size):
+        return False
+    if stamp.get('mtime_ns') != str(st.st_mtime_ns):
+        # dump toccato o copiato: il file derivato vale ancora se il contenuto e' identico
+        return stamp.get('sha256') == file_sha256(dump_path)
+    return True
+
+
+def write_index(dump_path, codes, path=None, stamp=None):
+    """Scrive l'indice dei `codes` per il dump (gia' chiuso) in `dump_path`.
+
+    `path` permette di scrivere l'indice altrove (es. nella cartella temporanea di atomic_output);
+    `stamp` evita di ricalcolare l'impronta del dump se e' gia' nota.
+    """
+    stamp = stamp or dump_stamp(dump_path)
+    path = path or index_path(dump_path)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        f.write(stamp_header(stamp))
+        for code in sorted(codes):
+            f.write(f"{code}\n")
+    os.replace(tmp, path)
+    return path
+
+
+def load_index(dump_path):
+    """Restituisce il set dei codici se l'indice e' aggiornato rispetto al dump, altrimenti None."""
+    path = index_path(dump_path)
+    if not os.path.exists(path) or not os.path.exists(dump_path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        if not stamp_matches(f.readline(), dump_path):
+            return None
+        return set(f.read().split())
@@ -0,0 +1,161 @@
+"""Conversione dei valori delle righe nei formati di output (letterale SQL, CSV, TSV), per colonna.
+
+I convertitori generici (`sql_literal`, `csv_value`, `tsv_value`) controllano il tipo di ogni
+valore. Con un `RowCodec` il tipo si decide una volta per colonna, prima del ciclo sulle righe,
+dal `cursor.description` della query (pyodbc riporta la classe Python di ogni colonna) e ogni
+colonna ha il suo convertitore gia' scelto:
+- string: testo (e gli altri tipi resi con str), tra apici nel letterale SQL; l'escape TSV solo
+  se il valore contiene caratteri da proteggere
+- decimal: Decimal, tra apici ma senza escape (solo cifre, segno e punto)
+- number: int, float e bool, senza apici
+- date: date e datetime come AAAA-MM-GG; le date si ripetono molto, quindi ogni data viene
+  formattata una sola volta (strftime costa piu' di tutto il resto della riga)
+- any: tipo non noto (es. SQLite con AUTO_BACKEND=local), convertitori generici
+
+Il risultato e' identico a quello dei convertitori generici.
+"""
+import decimal
+import re
+from datetime import date, datetime
+
+KINDS = ('string', 'decimal', 'number', 'date', 'any')
+# classe Python della colonna (type_code di pyodbc) -> tipo del convertitore
+TYPE_KINDS = {
+    str: 'string',
+    decimal.Decimal: 'decimal',
+    int: 'number',
+    float: 'number',
+    bool: 'number',
+    date: 'date',
+    datetime: 'date',
+}
+
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+_TSV_SPECIAL = re.compile('[\\\\\t\n\r\0]')
+
+
+def sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return "'{}'".format(value.strftime('%Y-%m-%d'))
+    s = str(value).replace("'", "''")
+    return f"'{s}'"
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def tsv_value(value):
+    """Valore nel formato di default di LOAD DATA: \\N per NULL, escape con backslash."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value).translate(TSV_ESCAPES)
+
+
+def _sql_string(value):
+    return 'NULL' if value is None else "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_decimal(value):
+    return 'NULL' if value is None else "'" + str(value) + "'"
+
+
+def _sql_number(value):
+    return 'NULL' if value is None else str(value)
+
+
+def _csv_string(value):
+    return '' if value is None else str(value)
+
+
+def _tsv_string(value, special=_TSV_SPECIAL.search):
+    if value is None:
+        return '\\N'
+    value = str(value)
+    return value.translate(TSV_ESCAPES) if special(value) else value
+
+
+def _tsv_number(value):
+    return '\\N' if value is None else str(value)
+
+
+class _Formatted(dict):
+    """Data -> testo con `fmt`, calcolato alla prima occorrenza; None -> `null`."""
+
+    def __init__(self, null, fmt):
+        super().__init__({None: null})
+        self.fmt = fmt
+
+    def __missing__(self, value):
+        self[value] = text = value.strftime(self.fmt)
+        return text
+
+
+# tipo -> (letterale SQL, valore CSV, valore TSV); le date hanno convertitori propri per ogni RowCodec
+ENCODERS = {
+    'string': (_sql_string, _csv_string, _tsv_string),
+    'decimal': (_sql_decimal, _csv_string, _tsv_number),
+    'number': (_sql_number, _csv_string, _tsv_number),
+    'any': (sql_literal, csv_value, tsv_value),
+}
+
+
+def _encoders(kind):
+    if kind == 'date':
+        return tuple(_Formatted(null, fmt).__getitem__
+                     for null, fmt in (('NULL', "'%Y-%m-%d'"), ('', '%Y-%m-%d'), ('\\N', '%Y-%m-%d')))
+    return ENCODERS[kind]
+
+
+def column_kinds(description, count=None):
+    """Tipo del convertitore di ognuna delle prime `count` colonne di un `cursor.description`."""
+    description = list(description or ())[:count]
+    kinds = [TYPE_KINDS.get(column[1], 'any') for column in description]
+    if count is not None:
+        kinds += ['any'] * (count - len(kinds))
+    return kinds
+
+
+class RowCodec:
+    """Convertitori di una riga, uno per colonna e per formato, scelti prima del ciclo sulle righe."""
+
+    def __init__(self, kinds):
+        for kind in kinds:
+            if kind not in KINDS:
+                raise ValueError(f"tipo di colonna non valido: {kind!r} (ammessi: {', '.join(KINDS)})")
+        self.kinds = list(kinds)
+        encoders = [_encoders(k) for k in self.kinds]
+        self.sql = [e[0] for e in encoders]
+        self.csv = [e[1] for e in encoders]
+        self.tsv = [e[2] for e in encoders]
+
+    @classmethod
+    def from_description(cls, description, count=None):
+        return cls(column_kinds(description, count))
+
+    @classmethod
+    def generic(cls, count, literal=sql_literal):
+        """Convertitori generici per `count` colonne, con `literal` per il letterale SQL."""
+        codec = cls(['any'] * count)
+        codec.sql = [literal] * count
+        return codec
+
+    def sql_values(self, values):
+        """Valori della riga come letterali SQL separati da virgola."""
+        return ', '.join([encode(v) for encode, v in zip(self.sql, values)])
+
+    def csv_row(self, values):
+        return [encode(v) for encode, v in zip(self.csv, values)]
+
+    def tsv_line(self, values):
+        return '\t'.join([encode(v) for encode, v in zip(self.tsv, values)]) + '\n'
@@ -0,0 +1,165 @@
+"""Modalita' demone della pipeline: `python main.py --daemon`.
+
+Il processo resta attivo e tiene "calde" le risorse che una normale esecuzione ricrea ogni volta:
+- gli script e i moduli (pyodbc, .env, driver ODBC in cache) vengono caricati una sola volta
+- le connessioni MSSQL restano nel pool di `mssql` tra un'esecuzione e l'altra
+- il master SSH (ControlMaster) resta aperto per tutta la vita del demone: nuovi.utenti.py e
+  MYSQL_LOAD lo riusano invece di ripetere l'handshake
+
+Ogni DAEMON_INTERVAL secondi (default 60) il demone interroga le sorgenti con query leggere
+(numero di righe e ultima scrittura di Tk_TabDipendenti, tk_Tab_DettDip e Tk_Tab_LivContDip dai
+metadati del server, senza leggere le tabelle; numero di righe e id massimo di gestione_utenti
+sul MySQL remoto; vedi source_probe.py) ed esegue la pipeline solo se qualcosa e'
+cambiato rispetto all'ultima esecuzione riuscita. Con DAEMON_PROBE=0 la pipeline gira a ogni
+intervallo; con DAEMON_MAX_AGE (secondi) gira comunque se l'ultima esecuzione riuscita e' piu'
+vecchia. Con AUTO_BACKEND=local la sonda usa numero di righe e rowid massimo.
+Se la sonda non riesce (ad esempio un login senza VIEW SERVER STATE / VIEW DATABASE STATE) il
+demone lo segnala una volta e si comporta come con DAEMON_PROBE=0 finche' la sonda non torna a
+rispondere.
+
+Ogni esecuzione scrive il report come main.py, con in piu' la sezione `daemon` (ciclo, motivo,
+esito della sonda). SIGTERM e SIGINT fermano il demone alla fine dell'esecuzione in corso.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+import main as pipeline
+import mssql
+import mysql_load
+from backends import ssh_session
+from source_probe import probe_mssql, probe_mysql
+
+log = logging.getLogger('daemon')
+
+
+def interval():
+    return float(os.getenv('DAEMON_INTERVAL') or 60)
+
+
+def probe_enabled():
+    return (os.getenv('DAEMON_PROBE') or '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def max_age():
+    return float(os.getenv('DAEMON_MAX_AGE') or 0)
+
+
+class SyncDaemon:
+
+    def __init__(self, stages, workers=None):
+        self.stages = stages
+        self.workers = workers
+        self.stop_event = threading.Event()
+        self.signature = None
+        self.last_ok = None
+        self.cycles = 0
+        self._ssh = None
+        self._ssh_cfg = None
+        self._probe_failed = False
+
+    def warm_up(self):
+        """Carica gli script e apre il master SSH che resta attivo per tutta la vita del demone."""
+        for script, _ in self.stages:
+            pipeline.load_stage(script)
+        try:
+            self._ssh_cfg = mysql_load.settings()
+        except RuntimeError:
+            log.warning('Parametri SSH/MySQL mancanti: nessuna connessione SSH persistente ne\' sonda MySQL')
+            return
+        cfg = self._ssh_cfg
+        self._ssh = ssh_session(cfg['ssh_host'], cfg['ssh_port'], cfg['ssh_user'], persist='yes').open()
+
+    def probe_mysql(self):
+        # riapre il master se e' caduto (rete, riavvio del server)
+        self._ssh.open()
+        return probe_mysql(self._ssh, self._ssh_cfg)
+
+    def _signature(self):
+        """Firma corrente delle sorgenti; una connessione MSSQL del pool caduta viene scartata e si riprova."""
+        try:
+            signature = {'mssql': probe_mssql()}
+        except Exception:
+            if not self._probe_failed:
+                log.warning('Sonda MSSQL non riuscita: chiudo le connessioni inattive e riprovo')
+            mssql.get_pool().close()
+            signature = {'mssql': probe_mssql()}
+        if self._ssh is not None:
+            signature['mysql'] = self.probe_mysql()
+        return signature
+
+    def probe(self):
+        """Firma corrente delle sorgenti, oppure None (sconosciuta) se la sonda non riesce."""
+        try:
+            signature = self._signature()
+        except Exception as e:
+            # ad esempio permessi mancanti: ripeterlo a ogni ciclo non aggiunge nulla
+            if not self._probe_failed:
+                log.warning('Sonda delle sorgenti non riuscita (%s): la pipeline gira a ogni intervallo', e)
+            self._probe_failed = True
+            return None
+        if self._probe_failed:
+            log.info('Sonda delle sorgenti di nuovo disponibile')
+            self._probe_failed = False
+        return signature
+
+    def trigger(self, signature, now):
+        """Motivo per eseguire la pipeline in questo ciclo, oppure None."""
+        if self.last_ok is None:
+            return 'avvio'
+        if not probe_enabled() or signature is None:
+            return 'intervallo'
+        if signature != self.signature:
+            return 'modifica'
+        if max_age() and now - self.last_ok >= max_age():
+            return 'scadenza'
+        return None
+
+    def run_cycle(self):
+        """Un ciclo: sonda ed eventuale esecuzione; restituisce True/False (esito) o None se saltata."""
+        now = time.monotonic()
+        signature = self.probe() if probe_enabled() else None
+        reason = self.trigger(signature, now)
+        if reason is None:
+            log.info('Sorgenti invariate: esecuzione saltata')
+            return None
+        self.cycles += 1
+        log.info('Esecuzione %d (%s)', self.cycles, reason)
+        metrics = {}
+        results = pipeline.run_pipeline(self.stages, max_workers=self.workers, metrics=metrics)
+        ok = all(r is True for r in results.values())
+        pipeline.write_reports([metrics[script] for script, _ in self.stages], extra={
+            'daemon': {'cycle': self.cycles, 'reason': reason, 'probe': signature},
+        })
+        if ok:
+            # firma presa prima dell'esecuzione: le modifiche arrivate nel frattempo si vedono al ciclo dopo
+            self.signature = signature
+            self.last_ok = now
+        return ok
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def serve_forever(self):
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        mssql.check_settings()
+        self.warm_up()
+        log.info('Demone avviato (intervallo %ss, sonda %s)', interval(), 'attiva' if probe_enabled() else 'disattivata')
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.run_cycle()
+                except Exception:
+                    # sorgente irraggiungibile: si riprova al prossimo intervallo
+                    log.exception('Ciclo non riuscito')
+                self.stop_event.wait(interval())
+        finally:
+            if self._ssh is not None:
+                self._ssh.close()
+            mssql.get_pool().close()
+            log.info('Demone fermato')
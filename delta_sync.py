@@ -0,0 +1,186 @@
+"""Sincronizzazione incrementale di una tabella a partire dallo snapshot dell'estrazione precedente.
+
+Lo snapshot e' un file di testo `<chiave>\\t<hash>` per riga, dove l'hash copre il contenuto
+dell'intera riga. Ad ogni estrazione il `DeltaWriter` confronta le righe con lo snapshot e
+scrive nel dump delta solo:
+- `INSERT ... ON DUPLICATE KEY UPDATE` per le righe nuove o modificate
+- `DELETE FROM ... WHERE <chiave> IN (...)` per le chiavi non piu' presenti
+
+Lo snapshot viene aggiornato solo se l'estrazione termina senza errori.
+
+Il delta e' calcolato rispetto alla base `<snapshot>.applied`, lo stato dell'ultimo delta di cui
+e' stata confermata l'applicazione, non rispetto all'ultima estrazione: se un delta non viene
+applicato le sue modifiche restano anche nel delta successivo (INSERT ... ON DUPLICATE KEY UPDATE
+e DELETE si possono riapplicare). Ogni delta termina con l'impronta dello snapshot che descrive
+(`-- snapshot: <sha256>`). Dopo averlo applicato si conferma con
+
+    python delta_sync.py [--dir CARTELLA]
+
+che copia lo snapshot nella base, solo se il delta e' ancora quello dell'ultima estrazione. Con
+MYSQL_LOAD la tabella di destinazione viene ricaricata per intero nella stessa esecuzione e la
+base viene aggiornata automaticamente. Alla prima esecuzione senza base, la base e' lo snapshot
+esistente.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+
+from column_codecs import tsv_value
+from dump_writer import SqlDumpWriter, dump_format
+
+# chiavi per ogni DELETE ... WHERE ... IN (...)
+DELETE_CHUNK = 1000
+APPLIED_SUFFIX = '.applied'
+SNAPSHOT_MARK = '-- snapshot: '
+
+
+def delta_enabled():
+    return (os.getenv('DIPENDENTI_DELTA') or '').strip().lower() in ('1', 'true', 'yes', 'si')
+
+
+def row_hash(values):
+    h = hashlib.blake2b(digest_size=16)
+    h.update('\t'.join([tsv_value(v) for v in values]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_snapshot(path):
+    snapshot = {}
+    if not os.path.exists(path):
+        return snapshot
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, sep, digest = line.rstrip('\n').partition('\t')
+            if sep:
+                snapshot[key] = digest
+    return snapshot
+
+
+def save_snapshot(path, snapshot):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        for key in sorted(snapshot):
+            f.write(f"{key}\t{snapshot[key]}\n")
+    os.replace(tmp, path)
+
+
+def applied_path(snapshot_path):
+    """Base dei delta: lo snapshot dell'ultimo delta applicato."""
+    return snapshot_path + APPLIED_SUFFIX
+
+
+def baseline_path(snapshot_path):
+    """File da cui leggere la base: quella confermata, oppure lo snapshot se non ce n'e' ancora una."""
+    applied = applied_path(snapshot_path)
+    return applied if os.path.exists(applied) else snapshot_path
+
+
+def snapshot_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def delta_snapshot(delta_path):
+    """Impronta dello snapshot scritta in fondo al delta, oppure None."""
+    digest = None
+    with open(delta_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(SNAPSHOT_MARK):
+                digest = line[len(SNAPSHOT_MARK):].strip()
+    return digest
+
+
+def mark_applied(snapshot_path, delta_path=None):
+    """Conferma che il delta dell'ultima estrazione e' stato applicato: lo snapshot diventa la base.
+
+    Con `delta_path` solleva ValueError se quel delta non e' quello dello snapshot corrente (nel
+    frattempo c'e' stata un'altra estrazione, il cui delta comprende anche le sue modifiche).
+    """
+    if delta_path is not None and delta_snapshot(delta_path) != snapshot_digest(snapshot_path):
+        raise ValueError(f"{delta_path} non corrisponde all'ultima estrazione: applicare il delta piu' recente")
+    tmp = applied_path(snapshot_path) + '.tmp'
+    shutil.copyfile(snapshot_path, tmp)
+    os.replace(tmp, applied_path(snapshot_path))
+
+
+class DeltaWriter:
+    """Scrive in `sql_path` le differenze rispetto alla base dello snapshot in `snapshot_path`.
+
+    Il nuovo snapshot viene salvato in `save_path` (default: `snapshot_path`); `codec` come in SqlDumpWriter.
+    `previous` e' la base letta; `baseline_missing` dice se la base confermata non esiste ancora.
+    """
+
+    def __init__(self, sql_path, snapshot_path, table, columns, key, literal, save_path=None, codec=None):
+        self.sql_path = sql_path
+        self.snapshot_path = snapshot_path
+        self.save_path = save_path or snapshot_path
+        self.table = table
+        self.key = key
+        self.key_index = list(columns).index(key)
+        self.literal = literal
+        self.baseline_missing = not os.path.exists(applied_path(snapshot_path))
+        self.previous = load_snapshot(baseline_path(snapshot_path))
+        self.current = {}
+        self.changed = 0
+        self.deleted = 0
+        # il delta non ha senso in formato load: in quel caso si usa il multi-riga
+        fmt = 'single' if dump_format() == 'single' else 'multi'
+        self._f = open(sql_path, 'w', encoding='utf-8')
+        self._f.write(f"-- Delta rispetto all'ultimo delta applicato ({len(self.previous)} righe)\n")
+        self._dump = SqlDumpWriter(self._f, table, columns, literal, fmt=fmt, upsert=True, codec=codec)
+
+    def write_row(self, values):
+        key = values[self.key_index]
+        if key is None:
+            return
+        key = str(key)
+        digest = row_hash(values)
+        self.current[key] = digest
+        if self.previous.get(key) != digest:
+            self._dump.write_row(values)
+            self.changed += 1
+
+    def close(self, save=True):
+        """Chiude il delta; con `save=False` (estrazione interrotta) non scrive DELETE ne' snapshot."""
+        self._dump.close()
+        if save:
+            removed = sorted(self.previous.keys() - self.current.keys())
+            for i in range(0, len(removed), DELETE_CHUNK):
+                keys_sql = ', '.join([self.literal(k) for k in removed[i:i + DELETE_CHUNK]])
+                self._f.write(f"DELETE FROM {self.table} WHERE {self.key} IN ({keys_sql});\n")
+            self.deleted = len(removed)
+            save_snapshot(self.save_path, self.current)
+            self._f.write(f"{SNAPSHOT_MARK}{snapshot_digest(self.save_path)}\n")
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(save=exc_type is None)
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conferma che l'ultimo delta dei dipendenti e' stato applicato")
+    parser.add_argument('--dir', default=os.getenv('AUTO_OUTPUT_DIR') or os.path.dirname(os.path.abspath(__file__)),
+                        help='cartella che contiene dump/')
+    args = parser.parse_args(argv)
+    dump_dir = os.path.join(args.dir, 'dump')
+    snapshot = os.path.join(dump_dir, 'orari.dipendenti.snapshot')
+    try:
+        mark_applied(snapshot, os.path.join(dump_dir, 'orari.dipendenti.delta.sql'))
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}")
+        return 1
+    print(f"Base aggiornata: {applied_path(snapshot)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
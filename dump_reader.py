@@ -0,0 +1,151 @@
+"""Lettore in streaming dei dump SQL scritti da `dump_writer`.
+
+`iter_records(path, table)` restituisce un dict {colonna: valore} per ogni riga della tabella,
+qualunque sia il formato del dump (DUMP_FORMAT):
+- single / multi: le tuple di `INSERT INTO t (...) VALUES (...)[,(...)];` vengono tokenizzate
+  con una regex precompilata; le stringhe tra apici (con l'escape `''`) diventano str,
+  NULL diventa None e i numeri non quotati int/float
+- load: lo statement `LOAD DATA ... INFILE '<file>'` viene seguito e il TSV indicato (relativo
+  alla cartella del dump) letto riga per riga
+
+Con `use_mmap=True` il file viene letto tramite mmap, utile sui dump molto grandi.
+I dump compressi (.gz / .zst, vedi OUTPUT_COMPRESSION) vengono decompressi in streaming.
+"""
+import mmap
+import os
+import re
+
+from output_codecs import is_compressed, open_binary, resolve_path
+
+_HEADER_RE = re.compile(r"\s*INSERT\s+INTO\s+([\w.`]+)\s*\(([^)]*)\)\s*VALUES\s*", re.IGNORECASE)
+# una tupla intera (le parentesi dentro le stringhe non contano) e i singoli valori al suo interno.
+# Ogni pezzo (stringa o testo senza apici/parentesi) e' atomico: catturato nel lookahead e consumato
+# con il backreference, senza backtracking, cosi' una tupla non chiusa fallisce in tempo lineare
+# invece che esponenziale (equivale a un gruppo atomico, che re supporta solo da Python 3.11)
+_TUPLE_RE = re.compile(r"\(((?:(?=('[^']*(?:''[^']*)*'|[^'()]+))\2)*)\)")
+_TOKEN_RE = re.compile(r"'[^']*(?:''[^']*)*'|[^,\s]+")
+_LOAD_RE = re.compile(
+    r"\s*LOAD\s+DATA\s+(?:LOCAL\s+)?INFILE\s+'([^']*)'\s+INTO\s+TABLE\s+([\w.`]+).*\(([^)]*)\)\s*;",
+    re.IGNORECASE,
+)
+_TSV_UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r', '0': '\0'}
+_TSV_ESCAPE_RE = re.compile(r"\\(.)")
+
+
+class DumpParseError(ValueError):
+    pass
+
+
+def _table_matches(name, table):
+    if table is None:
+        return True
+    name = name.replace('`', '').lower()
+    table = table.lower()
+    return name == table or name.rsplit('.', 1)[-1] == table
+
+
+def _columns(spec):
+    return [c.strip().strip('`') for c in spec.split(',')]
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _value(token):
+    if token[0] == "'":
+        s = token[1:-1]
+        return s.replace("''", "'") if "''" in s else s
+    if token.upper() == 'NULL':
+        return None
+    try:
+        return _number(token)
+    except ValueError:
+        raise DumpParseError(f"valore non riconosciuto: {token!r}") from None
+
+
+def parse_tuples(text, pos=0):
+    """Tokenizza le tuple `(v, v, ...)` consecutive in `text` a partire da `pos`.
+
+    Restituisce (lista di tuple, chiuso) dove `chiuso` indica che lo statement termina con `;`.
+    """
+    rows = []
+    n = len(text)
+    while True:
+        while pos < n and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= n:
+            return rows, False
+        m = _TUPLE_RE.match(text, pos)
+        if m is None:
+            if text[pos] == '(':
+                raise DumpParseError(f"tupla non riconosciuta alla posizione {pos}: {text[pos:pos + 40]!r}")
+            # `;` oppure una clausola finale (es. ON DUPLICATE KEY UPDATE ...;)
+            return rows, text.rstrip().endswith(';')
+        rows.append([_value(t) for t in _TOKEN_RE.findall(m.group(1))])
+        pos = m.end()
+
+
+def tsv_unescape(value):
+    if value == '\\N':
+        return None
+    if '\\' not in value:
+        return value
+    return _TSV_ESCAPE_RE.sub(lambda m: _TSV_UNESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _iter_lines(path, use_mmap=False):
+    if is_compressed(path):
+        with open_binary(path) as f:
+            for raw in f:
+                yield raw.decode('utf-8')
+        return
+    with open(path, 'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for raw in iter(mm.readline, b''):
+                    yield raw.decode('utf-8')
+        else:
+            for raw in f:
+                yield raw.decode('utf-8')
+
+
+def _iter_tsv(path, columns, use_mmap=False):
+    for line in _iter_lines(path, use_mmap):
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        yield dict(zip(columns, [tsv_unescape(v) for v in line.split('\t')]))
+
+
+def iter_records(path, table=None, use_mmap=False):
+    """Legge in streaming le righe della tabella `table` (None = tutte) dal dump in `path`."""
+    header = None
+    columns = None
+    wanted = False
+    in_statement = False
+    for line in _iter_lines(path, use_mmap):
+        if in_statement and line.startswith('('):
+            rows, closed = parse_tuples(line)
+        else:
+            in_statement = False
+            m = _HEADER_RE.match(line)
+            if m is None:
+                load = _LOAD_RE.match(line)
+                if load and _table_matches(load.group(2), table):
+                    tsv = resolve_path(os.path.join(os.path.dirname(os.path.abspath(path)), load.group(1)))
+                    yield from _iter_tsv(tsv, _columns(load.group(3)), use_mmap)
+                continue
+            # nel formato single l'intestazione si ripete identica su ogni riga
+            if m.group(1, 2) != header:
+                header = m.group(1, 2)
+                wanted = _table_matches(header[0], table)
+                columns = _columns(header[1])
+            rows, closed = parse_tuples(line, m.end())
+        in_statement = not closed
+        if wanted:
+            for values in rows:
+                yield dict(zip(columns, values))
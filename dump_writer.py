@@ -0,0 +1,110 @@
+"""Writer per i dump SQL prodotti dagli exporter.
+
+Formati supportati (variabile DUMP_FORMAT nel .env):
+- single: una `INSERT INTO ... VALUES (...);` per riga (formato storico)
+- multi:  `INSERT INTO ... VALUES (...),(...),...;` a blocchi, ogni statement al massimo
+          DUMP_MAX_STATEMENT_BYTES byte (da tenere sotto `max_allowed_packet` di MySQL)
+- load:   un file TSV accanto al dump e uno script con `LOAD DATA LOCAL INFILE` che lo importa
+"""
+import os
+
+from column_codecs import RowCodec
+from output_codecs import open_text, strip_compression
+
+FORMATS = ('single', 'multi', 'load')
+DEFAULT_FORMAT = 'single'
+DEFAULT_MAX_STATEMENT_BYTES = 1024 * 1024
+
+
+def dump_format():
+    fmt = (os.getenv('DUMP_FORMAT') or DEFAULT_FORMAT).strip().lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"DUMP_FORMAT non valido: {fmt!r} (ammessi: {', '.join(FORMATS)})")
+    return fmt
+
+
+def max_statement_bytes():
+    return int(os.getenv('DUMP_MAX_STATEMENT_BYTES') or DEFAULT_MAX_STATEMENT_BYTES)
+
+
+class SqlDumpWriter:
+    """Scrive le righe di una tabella nel dump `f` secondo il formato scelto.
+
+    `literal` converte un valore Python nel letterale SQL usato dai formati single/multi;
+    per il formato load le righe finiscono in `tsv_path` e nel dump viene scritto solo lo
+    statement LOAD DATA (con il percorso relativo alla cartella del dump).
+    Con `upsert=True` ogni INSERT termina con `ON DUPLICATE KEY UPDATE` su tutte le colonne.
+    `codec` (column_codecs.RowCodec) converte le righe con i convertitori gia' scelti per colonna;
+    senza, ogni valore passa da `literal` (o da `tsv_value` nel formato load).
+    """
+
+    def __init__(self, f, table, columns, literal, fmt=None, max_bytes=None, tsv_path=None, upsert=False,
+                 codec=None):
+        self.f = f
+        self.table = table
+        self.columns = list(columns)
+        self.literal = literal
+        self.codec = codec or RowCodec.generic(len(self.columns), literal)
+        self.fmt = fmt or dump_format()
+        self.max_bytes = max_bytes or max_statement_bytes()
+        self.cols_sql = ', '.join(self.columns)
+        self.rows = 0
+        self._header = f"INSERT INTO {table} ({self.cols_sql}) VALUES\n"
+        self._suffix = ''
+        if upsert:
+            if self.fmt == 'load':
+                raise ValueError('Il formato load non supporta upsert')
+            updates = ', '.join(f"{c} = VALUES({c})" for c in self.columns)
+            self._suffix = f" ON DUPLICATE KEY UPDATE {updates}"
+        self._pending = []
+        self._pending_bytes = len(self._header) + len(self._suffix)
+        self._tsv = None
+        if self.fmt == 'load':
+            if not tsv_path:
+                raise ValueError('Il formato load richiede tsv_path')
+            self._tsv = open_text(tsv_path, 'w', encoding='utf-8', newline='')
+            # con OUTPUT_COMPRESSION il nome citato e' quello del TSV decompresso
+            f.write(
+                f"LOAD DATA LOCAL INFILE '{os.path.basename(strip_compression(tsv_path))}' INTO TABLE {table} "
+                "CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                f"({self.cols_sql});\n"
+            )
+
+    def write_row(self, values):
+        self.rows += 1
+        if self.fmt == 'load':
+            self._tsv.write(self.codec.tsv_line(values))
+            return
+        vals_sql = self.codec.sql_values(values)
+        if self.fmt == 'single':
+            self.f.write(f"INSERT INTO {self.table} ({self.cols_sql}) VALUES ({vals_sql}){self._suffix};\n")
+            return
+        tuple_sql = f"({vals_sql})"
+        size = len(tuple_sql.encode('utf-8')) + 2
+        if self._pending and self._pending_bytes + size > self.max_bytes:
+            self._flush()
+        self._pending.append(tuple_sql)
+        self._pending_bytes += size
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self.f.write(self._header)
+        self.f.write(',\n'.join(self._pending))
+        self.f.write(self._suffix + ';\n')
+        self._pending = []
+        self._pending_bytes = len(self._header) + len(self._suffix)
+
+    def close(self):
+        self._flush()
+        if self._tsv is not None:
+            self._tsv.close()
+            self._tsv = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
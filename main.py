@@ -1,65 +1,171 @@
-import os
-import sys
-import pyodbc
-from dotenv import load_dotenv
-import csv
-from datetime import datetime, date
-
-# Carica .env dalla directory corrente (se presente)
-load_dotenv()
-
-# Contratto (input/output):
 #!/usr/bin/env python3
-"""Orchestratore: esegue `orario.dipendenti.py` e poi `orario.gestione_utenti.py` in cascata.
+"""Orchestratore: esegue le fasi della pipeline nello stesso processo, rispettando le dipendenze.
 
 Comportamento:
-- Esegue `orario.dipendenti.py` con lo stesso interprete Python; se nel suo stdout appare "$$$" stampa
-  "orario.dipendenti.py creato correttamente" e procede con `orario.gestione_utenti.py`.
-- Se invece non appare "$$$" stampa "Errore in orario.dipendenti.py" e si ferma.
-- Per `orario.gestione_utenti.py` analogo comportamento e messaggi.
+- Ogni script (`nuovi.utenti.py`, `orario.dipendenti.py`, `orario.gestione_utenti.py`) viene importato
+  una sola volta e la sua funzione `run()` viene eseguita su un pool di thread.
+- Le fasi indipendenti (fetch via SSH e estrazione MSSQL dei dipendenti) girano in parallelo;
+  `orario.gestione_utenti.py` parte solo quando entrambe sono terminate, perche' legge
+  `csv/nuovi.utenti.csv` e `dump/orari.dipendenti.sql`.
+- Per ogni fase stampa "<script> creato correttamente" oppure "Errore in <script>"; se una fase fallisce
+  le fasi che dipendono da essa non vengono eseguite.
+- Alla fine scrive `report/run.json` (o RUN_REPORT) con tempi, righe, file scritti, memoria ed
+  eventuale errore di ogni fase; con METRICS_PROM_FILE scrive anche le metriche per Prometheus.
+- Ogni fase riuscita viene registrata nella cache delle fasi (vedi stage_cache.py); con `--resume`
+  le fasi i cui ingressi (ambiente, codice, sorgenti, file delle fasi precedenti) non sono
+  cambiati e il cui risultato non e' scaduto (STAGE_CACHE_TTL) non vengono rieseguite.
+- Con `--daemon` resta attivo e riesegue la pipeline a intervalli o quando le tabelle sorgente
+  cambiano, con le connessioni gia' aperte (vedi daemon.py).
 """
-import sys
-import subprocess
+import argparse
+import importlib.util
 import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import StageMetrics, report_path, write_json_report, write_prometheus
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SCRIPTS = [
-    ('nuovi.utenti.py', 'nuovi.utenti.py creato correttamente', 'Errore in nuovi.utenti.py'),
-    ('orario.dipendenti.py', 'orario.dipendenti.py creato correttamente', 'Errore in orario.dipendenti.py'),
-    ('orario.gestione_utenti.py', 'orario.gestione_utenti.py creato correttamente', 'Errore in orario.gestione_utenti.py'),
+
+# (script, dipendenze): le dipendenze sono altri script della stessa lista
+STAGES = [
+    ('nuovi.utenti.py', ()),
+    ('orario.dipendenti.py', ()),
+    ('orario.gestione_utenti.py', ('nuovi.utenti.py', 'orario.dipendenti.py')),
 ]
 
-def run_script(script_name):
+# sorgenti lette da ogni fase (sonde di source_probe.py), per la cache delle fasi
+STAGE_SOURCES = {
+    'nuovi.utenti.py': ('mysql',),
+    'orario.dipendenti.py': ('mssql',),
+    'orario.gestione_utenti.py': ('mssql',),
+}
+
+
+# script gia' importati: nel demone ogni esecuzione riusa i moduli caricati alla prima
+_loaded = {}
+
+
+def load_stage(script_name):
+    """Importa uno script (il nome contiene punti, quindi via importlib) e restituisce la sua `run`."""
+    if script_name in _loaded:
+        return _loaded[script_name]
     path = os.path.join(BASE_DIR, script_name)
     if not os.path.exists(path):
-        print(f"{script_name} non trovato")
-        return False
-    # usa lo stesso interprete Python usato per main
-    cmd = [sys.executable, path]
+        raise FileNotFoundError(f"{script_name} non trovato")
+    module_name = script_name[:-3].replace('.', '_')
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _loaded[script_name] = module.run
+    return module.run
+
+
+def run_stage(script_name, metrics, requires=(), cache=None, resume=False):
+    """Esegue una fase; con `cache` la registra se riuscita e, con `resume`, riusa il risultato in cache."""
+    metrics.start()
+    inputs = None
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-    except Exception as e:
-        print(f"Errore esecuzione {script_name}: {e}")
+        run = load_stage(script_name)
+        if cache is not None:
+            inputs = cache.inputs(script_name, requires)
+            entry = cache.lookup(script_name, inputs) if resume and inputs is not None else None
+            if entry is not None:
+                metrics.reuse(entry['outputs'])
+                return True
+        run(metrics=metrics)
+    except (Exception, SystemExit) as e:
+        traceback.print_exc()
+        metrics.finish(error=e)
+        if cache is not None:
+            cache.drop(script_name)
         return False
+    metrics.finish()
+    if cache is not None:
+        if inputs is not None:
+            cache.store(script_name, inputs, list(metrics.outputs))
+        else:
+            # la voce precedente non descrive piu' i file appena scritti
+            cache.drop(script_name)
+    return True
+
+
+def run_pipeline(stages, max_workers=None, metrics=None, cache=None, resume=False):
+    """Esegue le fasi in ordine topologico; restituisce {script: True/False/None} (None = saltata).
+
+    Se `metrics` e' un dict {script: StageMetrics}, ogni fase vi registra le proprie metriche.
+    Con `cache` (StageCache) le fasi riuscite vengono registrate e, con `resume`, riusate.
+    """
+    deps = dict(stages)
+    metrics = metrics if metrics is not None else {}
+    for script, _ in stages:
+        metrics.setdefault(script, StageMetrics(script[:-3]))
+    results = {}
+    running = {}
+    max_workers = max_workers or len(stages)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(results) < len(deps):
+            for script, requires in stages:
+                if script in results or script in running.values():
+                    continue
+                if any(results.get(d) is not True for d in requires if d in results):
+                    # una dipendenza e' fallita o e' stata saltata
+                    results[script] = None
+                    metrics[script].status = 'skipped'
+                    print(f"{script} non eseguito (dipendenze non riuscite)")
+                    continue
+                if all(results.get(d) is True for d in requires):
+                    running[pool.submit(run_stage, script, metrics[script], requires, cache, resume)] = script
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                script = running.pop(fut)
+                ok = fut.result()
+                results[script] = ok
+                if ok and metrics[script].status == 'cached':
+                    print(f"{script} riusato dall'esecuzione precedente")
+                elif ok:
+                    print(f"{script} creato correttamente")
+                else:
+                    print(f"Errore in {script}")
+    return results
+
+
+def write_reports(metrics, extra=None):
+    """Report JSON dell'esecuzione e, se configurato, file per il textfile collector di Prometheus."""
+    write_json_report(report_path(), metrics, extra)
+    prom_path = os.getenv('METRICS_PROM_FILE')
+    if prom_path:
+        write_prometheus(prom_path, metrics)
 
-    stdout = proc.stdout or ''
-    stderr = proc.stderr or ''
-    # debug prints (short)
-    if '$$$' in stdout:
-        return True
-    else:
-        # se stderr o stdout contengono info utili, le mostriamo brevi
-        return False
 
 def main():
-    for script, success_msg, err_msg in SCRIPTS:
-        ok = run_script(script)
-        if ok:
-            print(success_msg)
-        else:
-            print(err_msg)
-            break
+    parser = argparse.ArgumentParser(description='Esegue la pipeline di estrazione.')
+    parser.add_argument('--daemon', action='store_true',
+                        help='resta attivo e riesegue la pipeline a intervalli o quando i dati cambiano')
+    parser.add_argument('--resume', action='store_true',
+                        help='non riesegue le fasi con risultato in cache ancora valido (vedi STAGE_CACHE_TTL)')
+    args = parser.parse_args()
+    workers = int(os.getenv('PIPELINE_WORKERS', '0') or 0) or None
+    if args.daemon:
+        from daemon import SyncDaemon
+        SyncDaemon(STAGES, workers=workers).serve_forever()
+        return
+    from stage_cache import StageCache
+    cache = StageCache(STAGE_SOURCES)
+    metrics = {}
+    try:
+        # firma delle sorgenti prima che le fasi le leggano, registrata anche senza --resume
+        cache.probe_all()
+        results = run_pipeline(STAGES, max_workers=workers, metrics=metrics, cache=cache, resume=args.resume)
+    finally:
+        cache.close()
+    write_reports([metrics[script] for script, _ in STAGES])
+    if not all(ok is True for ok in results.values()):
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
-    
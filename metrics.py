@@ -0,0 +1,185 @@
+"""Metriche per fase della pipeline e report dell'esecuzione.
+
+Ogni script riceve (o crea) uno `StageMetrics` e vi registra tempi per fase (query, fetch,
+write...), righe lette e file scritti. main.py raccoglie le metriche di tutte le fasi in un
+report JSON (`report/run.json`) e, se METRICS_PROM_FILE e' impostato, in un file di testo nel
+formato Prometheus (textfile collector di node_exporter).
+
+Il picco di memoria e' il massimo RSS del processo alla fine della fase: quando le fasi girano
+in parallelo dentro main.py e' un valore di processo, non della singola fase.
+"""
+import json
+import os
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    # non disponibile su Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss e' in KB su Linux, in byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# stati di una fase riuscita: eseguita, oppure risultato riusato dalla cache (main.py --resume)
+OK_STATUSES = ('ok', 'cached')
+
+
+def report_path():
+    """Percorso del report JSON dell'esecuzione: RUN_REPORT oppure <AUTO_OUTPUT_DIR>/report/run.json."""
+    output_dir = os.getenv('AUTO_OUTPUT_DIR') or os.path.dirname(os.path.abspath(__file__))
+    return os.getenv('RUN_REPORT') or os.path.join(output_dir, 'report', 'run.json')
+
+
+class StageMetrics:
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.status = 'pending'
+        self.error = None
+        self.started_at = None
+        self.duration = None
+        self.timings = {}
+        self.rows = 0
+        self.counters = {}
+        self.outputs = {}
+        self.peak_rss = None
+        self._start = None
+
+    def start(self):
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        self.status = 'running'
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_rows(self, count):
+        self.rows += count
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counter(self, name, value):
+        """Valore istantaneo (es. una velocita') al posto di un conteggio."""
+        self.counters[name] = value
+
+    def add_output(self, path):
+        """Registra un file prodotto dalla fase; la dimensione viene letta a fine fase."""
+        self.outputs[str(path)] = None
+
+    def finish(self, error=None):
+        if self._start is not None:
+            self.duration = time.perf_counter() - self._start
+        for path in self.outputs:
+            self.outputs[path] = os.path.getsize(path) if os.path.exists(path) else None
+        self.peak_rss = peak_rss_bytes()
+        if error is not None:
+            self.status = 'error'
+            self.error = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        else:
+            self.status = 'ok'
+
+    def reuse(self, paths):
+        """Fase non eseguita: i file `paths` di un'esecuzione precedente sono ancora validi."""
+        for path in paths:
+            self.add_output(path)
+        self.finish()
+        self.status = 'cached'
+
+    @property
+    def rows_per_second(self):
+        busy = self.timings.get('fetch') or self.duration
+        return self.rows / busy if busy else None
+
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_s': self.duration,
+            'timings_s': self.timings,
+            'rows': self.rows,
+            'rows_per_s': self.rows_per_second,
+            'counters': self.counters,
+            'outputs_bytes': self.outputs,
+            'peak_rss_bytes': self.peak_rss,
+            'error': self.error,
+        }
+
+
+def write_json_report(path, stages, extra=None):
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'ok': all(m.status in OK_STATUSES for m in stages),
+        'stages': [m.to_dict() for m in stages],
+    }
+    if extra:
+        report.update(extra)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, path)
+    return report
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_prometheus(path, stages):
+    """Scrive le metriche nel formato testuale di Prometheus (file sostituito in modo atomico)."""
+    lines = [
+        '# HELP auto_stage_success 1 se la fase e\' terminata correttamente.',
+        '# TYPE auto_stage_success gauge',
+    ]
+    for m in stages:
+        lines.append(f'auto_stage_success{{stage="{_label(m.stage)}"}} {1 if m.status in OK_STATUSES else 0}')
+    lines += ['# HELP auto_stage_duration_seconds Durata della fase.', '# TYPE auto_stage_duration_seconds gauge']
+    for m in stages:
+        if m.duration is not None:
+            lines.append(f'auto_stage_duration_seconds{{stage="{_label(m.stage)}"}} {m.duration:.6f}')
+    lines += ['# HELP auto_stage_phase_seconds Tempo per sotto-fase (query, fetch, write...).',
+              '# TYPE auto_stage_phase_seconds gauge']
+    for m in stages:
+        for phase, seconds in sorted(m.timings.items()):
+            lines.append(f'auto_stage_phase_seconds{{stage="{_label(m.stage)}",phase="{_label(phase)}"}} {seconds:.6f}')
+    lines += ['# HELP auto_stage_rows Righe lette dalla sorgente.', '# TYPE auto_stage_rows gauge']
+    for m in stages:
+        lines.append(f'auto_stage_rows{{stage="{_label(m.stage)}"}} {m.rows}')
+    lines += ['# HELP auto_stage_output_bytes Dimensione dei file scritti.', '# TYPE auto_stage_output_bytes gauge']
+    for m in stages:
+        for out, size in sorted(m.outputs.items()):
+            if size is not None:
+                lines.append(f'auto_stage_output_bytes{{stage="{_label(m.stage)}",file="{_label(os.path.basename(out))}"}} {size}')
+    lines += ['# HELP auto_stage_peak_rss_bytes Picco di memoria del processo a fine fase.',
+              '# TYPE auto_stage_peak_rss_bytes gauge']
+    for m in stages:
+        if m.peak_rss is not None:
+            lines.append(f'auto_stage_peak_rss_bytes{{stage="{_label(m.stage)}"}} {m.peak_rss}')
+    lines += ['# HELP auto_run_timestamp_seconds Fine dell\'ultima esecuzione.', '# TYPE auto_run_timestamp_seconds gauge',
+              f'auto_run_timestamp_seconds {time.time():.0f}']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
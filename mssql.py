@@ -0,0 +1,241 @@
+"""Connessioni MSSQL condivise da tutti gli script.
+
+- I parametri arrivano dal .env: MSSQL_HOST, MSSQL_PORT (default 1433), MSSQL_USER, MSSQL_PASS,
+  MSSQL_DB, MSSQL_DRIVER (opzionale), MSSQL_ENCRYPT (default "no").
+- Alla prima esecuzione i driver ODBC candidati vengono provati in parallelo; il driver che si
+  connette viene salvato in `.mssql_driver.json` insieme a un'impronta dei parametri di
+  connessione (senza password), cosi' le esecuzioni successive lo usano direttamente.
+  Se il driver in cache smette di funzionare la ricerca viene ripetuta.
+- `connection()` restituisce una connessione dal pool del processo: dentro la pipeline di
+  main.py le fasi che girano una dopo l'altra riusano la stessa connessione.
+  Con AUTO_BACKEND=local restituisce invece una connessione al database SQLite di `backends`.
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+
+import backends
+
+try:
+    from dotenv import load_dotenv
+except Exception:
+    load_dotenv = None
+
+ROOT = Path(__file__).resolve().parent
+CACHE_PATH = ROOT / '.mssql_driver.json'
+
+DRIVER_CANDIDATES = [
+    'ODBC Driver 18 for SQL Server',
+    'ODBC Driver 17 for SQL Server',
+    'ODBC Driver 13 for SQL Server',
+    'FreeTDS',
+    'SQL Server',
+]
+CONNECT_TIMEOUT = 10
+
+if load_dotenv:
+    load_dotenv(dotenv_path=str(ROOT / '.env'))
+
+
+def settings():
+    """Parametri di connessione dal .env; solleva RuntimeError se mancano quelli obbligatori."""
+    cfg = {
+        'host': os.getenv('MSSQL_HOST'),
+        'port': os.getenv('MSSQL_PORT') or '1433',
+        'user': os.getenv('MSSQL_USER'),
+        'password': os.getenv('MSSQL_PASS'),
+        'database': os.getenv('MSSQL_DB'),
+        'driver': os.getenv('MSSQL_DRIVER'),
+        'encrypt': os.getenv('MSSQL_ENCRYPT') or 'no',
+    }
+    if not cfg['host'] or not cfg['database']:
+        raise RuntimeError('Mancano variabili richieste in .env (MSSQL_HOST/MSSQL_DB)')
+    return cfg
+
+
+def check_settings():
+    """Verifica i parametri di connessione prima di iniziare (non servono con AUTO_BACKEND=local)."""
+    if not backends.is_local():
+        settings()
+
+
+def connection_string(driver, cfg):
+    conn_str = (
+        f"DRIVER={{{driver}}};SERVER={cfg['host']},{cfg['port']};DATABASE={cfg['database']};"
+        f"Encrypt={cfg['encrypt']};"
+    )
+    if cfg['user']:
+        conn_str += f"UID={cfg['user']};PWD={cfg['password'] or ''};"
+    else:
+        conn_str += "Trusted_Connection=yes;"
+    return conn_str
+
+
+def _fingerprint(cfg):
+    key = '|'.join(str(cfg[k]) for k in ('host', 'port', 'database', 'user', 'driver', 'encrypt'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _read_cache(cfg):
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if data.get('fingerprint') != _fingerprint(cfg):
+        return None
+    return data.get('driver')
+
+
+def _write_cache(cfg, driver):
+    tmp = CACHE_PATH.with_suffix('.tmp')
+    tmp.write_text(json.dumps({'fingerprint': _fingerprint(cfg), 'driver': driver}), encoding='utf-8')
+    os.replace(tmp, CACHE_PATH)
+
+
+def candidate_drivers(cfg):
+    import pyodbc
+    candidates = [cfg['driver']] if cfg['driver'] else []
+    candidates += [d for d in DRIVER_CANDIDATES if d not in candidates]
+    installed = set(pyodbc.drivers())
+    # i driver non installati falliscono subito, ma non serve nemmeno provarli
+    return [d for d in candidates if d in installed] or candidates
+
+
+def _close_result(fut):
+    if not fut.cancelled() and fut.exception() is None:
+        try:
+            fut.result().close()
+        except Exception:
+            pass
+
+
+def probe_driver(cfg):
+    """Prova i driver candidati in parallelo; restituisce (driver, connessione) del primo che risponde.
+
+    Non aspetta i candidati lenti o in timeout; tra quelli riusciti nello stesso momento vince il
+    primo nell'ordine dei candidati. Le connessioni che arrivano dopo vengono chiuse.
+    """
+    import pyodbc
+    candidates = candidate_drivers(cfg)
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {
+        pool.submit(pyodbc.connect, connection_string(drv, cfg), timeout=CONNECT_TIMEOUT): i
+        for i, drv in enumerate(candidates)
+    }
+    pending = set(futures)
+    winner = None
+    last_err = None
+    try:
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in sorted(done, key=futures.get):
+                try:
+                    conn = fut.result()
+                except Exception as e:
+                    last_err = e
+                    continue
+                if winner is None:
+                    winner = (candidates[futures[fut]], conn)
+                else:
+                    conn.close()
+    finally:
+        for fut in pending:
+            fut.add_done_callback(_close_result)
+        pool.shutdown(wait=False, cancel_futures=True)
+    if winner is None:
+        raise RuntimeError(f'Connessione MSSQL non riuscita con nessun driver: {last_err}')
+    return winner
+
+
+class ConnectionPool:
+    """Pool minimale di connessioni pyodbc verso lo stesso server."""
+
+    def __init__(self, max_idle=4):
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self._conn_str = None
+
+    def _discover(self):
+        """Stringa di connessione (driver in cache o provato) e prima connessione aperta."""
+        import pyodbc
+        cfg = settings()
+        driver = _read_cache(cfg)
+        if driver:
+            conn_str = connection_string(driver, cfg)
+            try:
+                return conn_str, pyodbc.connect(conn_str, timeout=CONNECT_TIMEOUT)
+            except Exception:
+                pass
+        driver, conn = probe_driver(cfg)
+        _write_cache(cfg, driver)
+        return connection_string(driver, cfg), conn
+
+    def _connect(self):
+        import pyodbc
+        if self._conn_str is None:
+            with self._lock:
+                # solo la scelta del driver e' serializzata: avviene una volta, gli altri thread la aspettano
+                if self._conn_str is None:
+                    self._conn_str, conn = self._discover()
+                    return conn
+        # le connessioni successive (es. i worker delle partizioni) si aprono in parallelo, senza lock
+        return pyodbc.connect(self._conn_str, timeout=CONNECT_TIMEOUT)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                conn.rollback()
+                self._idle.put_nowait(conn)
+                return
+            except Exception:
+                pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # dopo un errore lo stato della sessione non e' noto: la connessione non torna nel pool
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+
+_pool = ConnectionPool()
+
+
+def get_pool():
+    return _pool
+
+
+def connection():
+    """Context manager che presta una connessione del pool condiviso (o del backend locale)."""
+    if backends.is_local():
+        return backends.local_connection()
+    return _pool.connection()
@@ -0,0 +1,167 @@
+"""Caricamento diretto delle righe estratte nel MySQL di destinazione, via SSH.
+
+Con MYSQL_LOAD impostato gli script, oltre a scrivere i dump in dump/, inviano le righe man mano
+che le leggono dal cursore MSSQL al server MySQL raggiunto con le stesse credenziali di
+`nuovi.utenti.py` (SSH_HOST, SSH_PORT, SSH_USER, DB_USER, DB_PASSWORD, DB_NAME):
+- off (default): nessun caricamento, i dump vanno importati a mano come prima
+- load: le righe viaggiano come TSV sullo stdin di `mysql --local-infile=1` e finiscono in una
+  tabella di appoggio `<tabella>__load` con `LOAD DATA LOCAL INFILE '/dev/stdin'`; solo se lo
+  stream e' terminato correttamente e il numero di righe coincide, la tabella di destinazione
+  viene aggiornata dalla tabella di appoggio in un'unica transazione
+- insert: le righe viaggiano come INSERT multi-riga (stessi limiti di DUMP_FORMAT=multi) dentro
+  uno script `START TRANSACTION; ... COMMIT;` sullo stdin di `mysql`; se lo stream si interrompe
+  il COMMIT non arriva e il server annulla la transazione
+
+In entrambi i casi ogni tabella viene caricata in una sola transazione: con `replace=True` il
+contenuto precedente viene cancellato nella stessa transazione, altrimenti le righe si aggiungono.
+"""
+import os
+import time
+
+from backends import ssh_session
+from column_codecs import RowCodec
+from dump_writer import SqlDumpWriter
+from ssh_session import mysql_command
+
+MODES = ('off', 'load', 'insert')
+STAGING_SUFFIX = '__load'
+
+
+def load_mode():
+    mode = (os.getenv('MYSQL_LOAD') or 'off').strip().lower()
+    if mode not in MODES:
+        raise ValueError(f"MYSQL_LOAD non valido: {mode!r} (ammessi: {', '.join(MODES)})")
+    return mode
+
+
+def load_enabled():
+    return load_mode() != 'off'
+
+
+def settings():
+    """Parametri SSH/MySQL dal .env (gli stessi di nuovi.utenti.py); solleva RuntimeError se mancano."""
+    cfg = {
+        'ssh_host': os.getenv('SSH_HOST'),
+        'ssh_port': os.getenv('SSH_PORT', '22'),
+        'ssh_user': os.getenv('SSH_USER'),
+        'db_user': os.getenv('DB_USER'),
+        'db_password': os.getenv('DB_PASSWORD'),
+        'db_name': os.getenv('DB_NAME'),
+    }
+    if not all([cfg['ssh_host'], cfg['ssh_user'], cfg['db_user'], cfg['db_name']]):
+        raise RuntimeError('Mancano variabili richieste in .env per MYSQL_LOAD (SSH_HOST/SSH_USER/DB_USER/DB_NAME)')
+    return cfg
+
+
+class RemoteTableLoader:
+    """Invia le righe di una tabella al MySQL remoto mentre vengono estratte.
+
+    Si usa come context manager: le righe passate a `write_row` vengono confermate sul server
+    solo se il blocco termina senza eccezioni. `create_sql` (opzionale) viene eseguito prima
+    del caricamento, fuori dalla transazione (in MySQL le DDL fanno commit implicito).
+    `codec` (column_codecs.RowCodec) come in SqlDumpWriter.
+    """
+
+    def __init__(self, table, columns, literal, replace=False, create_sql=None, mode=None, metrics=None, codec=None):
+        self.table = table
+        self.columns = list(columns)
+        self.literal = literal
+        self.codec = codec or RowCodec.generic(len(self.columns), literal)
+        self.replace = replace
+        self.create_sql = create_sql.strip().rstrip(';') if create_sql else None
+        self.mode = mode or load_mode()
+        self.metrics = metrics
+        self.cfg = settings()
+        self.cols_sql = ', '.join(self.columns)
+        self.staging = table + STAGING_SUFFIX
+        self.rows = 0
+        self._ssh = None
+        self._pipe = None
+        self._stdin = None
+        self._dump = None
+
+    def _command(self, query=None, local_infile=False):
+        cfg = self.cfg
+        return mysql_command(cfg['db_user'], cfg['db_password'], query, cfg['db_name'], local_infile=local_infile)
+
+    def _run(self, sql):
+        return self._ssh.run(self._command(sql))
+
+    def open(self):
+        cfg = self.cfg
+        self._ssh = ssh_session(cfg['ssh_host'], cfg['ssh_port'], cfg['ssh_user']).open()
+        try:
+            if self.create_sql:
+                self._run(self.create_sql + ';')
+            if self.mode == 'load':
+                self._run(f"DROP TABLE IF EXISTS {self.staging}; CREATE TABLE {self.staging} LIKE {self.table};")
+                load_sql = (
+                    f"LOAD DATA LOCAL INFILE '/dev/stdin' INTO TABLE {self.staging} "
+                    "CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                    f"({self.cols_sql});"
+                )
+                self._pipe = self._ssh.pipe(self._command(load_sql, local_infile=True))
+                self._stdin = self._pipe.__enter__()
+            else:
+                self._pipe = self._ssh.pipe(self._command())
+                self._stdin = self._pipe.__enter__()
+                self._stdin.write('START TRANSACTION;\n')
+                if self.replace:
+                    self._stdin.write(f"DELETE FROM {self.table};\n")
+                self._dump = SqlDumpWriter(self._stdin, self.table, self.columns, self.literal, fmt='multi',
+                                           codec=self.codec)
+        except BaseException:
+            self._ssh.close()
+            raise
+        return self
+
+    def write_row(self, values):
+        self.rows += 1
+        if self._dump is not None:
+            self._dump.write_row(values)
+        else:
+            self._stdin.write(self.codec.tsv_line(values))
+
+    def _finish_stream(self, exc_info):
+        """Chiude lo stdin remoto: con un errore il processo viene terminato senza COMMIT."""
+        if exc_info[0] is None:
+            if self._dump is not None:
+                self._dump.close()
+                self._stdin.write('COMMIT;\n')
+        return self._pipe.__exit__(*exc_info)
+
+    def _swap(self):
+        """Con MYSQL_LOAD=load porta le righe dalla tabella di appoggio a quella di destinazione."""
+        loaded = int((self._run(f"SELECT COUNT(*) FROM {self.staging};").split() or ['0'])[0])
+        if loaded != self.rows:
+            raise RuntimeError(
+                f"{self.table}: caricate {loaded} righe su {self.rows}, tabella di destinazione non modificata")
+        script = 'START TRANSACTION; '
+        if self.replace:
+            script += f"DELETE FROM {self.table}; "
+        script += (
+            f"INSERT INTO {self.table} ({self.cols_sql}) SELECT {self.cols_sql} FROM {self.staging}; "
+            f"COMMIT; DROP TABLE {self.staging};"
+        )
+        self._run(script)
+
+    def close(self, exc_info=(None, None, None)):
+        start = time.perf_counter()
+        try:
+            self._finish_stream(exc_info)
+            if exc_info[0] is None and self.mode == 'load':
+                self._swap()
+        finally:
+            self._ssh.close()
+            if self.metrics is not None:
+                self.metrics.add_time('mysql_load', time.perf_counter() - start)
+        if self.metrics is not None and exc_info[0] is None:
+            self.metrics.count('mysql_loaded', self.rows)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close(exc_info)
+        return False
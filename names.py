@@ -0,0 +1,70 @@
+"""Normalizzazione dei nomi dei dipendenti, unica per tutti gli script.
+
+- `normalize_name`: toglie gli spazi iniziali/finali e riduce a uno solo ogni sequenza di spazi
+  (anche tab e a capo), qualunque sia la sua lunghezza
+- `display_name` / `username`: "COGNOME NOME" e "NOME COGNOME" costruiti dai valori normalizzati
+- `unique_usernames`: rende univoci gli username di un blocco di nuovi utenti, anche rispetto a
+  quelli gia' presenti in gestione_utenti
+
+orario.dipendenti.py normalizza NOME, orario.gestione_utenti.py riceve Nome e Cognome grezzi dal
+server e ne ricava nome e username, check_names.py verifica i file prodotti con la stessa funzione.
+"""
+
+
+def normalize_name(value):
+    """Nome normalizzato; None resta None. `str.split()` senza argomenti separa su ogni spazio bianco."""
+    if value is None:
+        return None
+    return ' '.join(str(value).split())
+
+
+def display_name(nome, cognome):
+    """Colonna `nome` di gestione_utenti, "COGNOME NOME"; None se manca una delle due parti."""
+    if nome is None or cognome is None:
+        return None
+    return f"{cognome} {nome}"
+
+
+def username(nome, cognome):
+    """Colonna `username` di gestione_utenti, "NOME COGNOME"; None se manca una delle due parti."""
+    if nome is None or cognome is None:
+        return None
+    return f"{nome} {cognome}"
+
+
+# suffisso per gli omonimi: "MARIO ROSSI", "MARIO ROSSI 2", "MARIO ROSSI 3"...
+COLLISION_SUFFIX = ' {}'
+
+
+def username_key(value):
+    """Chiave di confronto: MySQL confronta gli username senza distinguere maiuscole e spazi finali."""
+    return normalize_name(value).casefold()
+
+
+def unique_usernames(usernames, existing=()):
+    """Username univoci per `usernames` (nell'ordine dato), senza collisioni con `existing`.
+
+    Il primo di ogni nome resta invariato, gli omonimi successivi ricevono il primo suffisso
+    libero (" 2", " 3"...). Un indice hash delle chiavi gia' usate e un contatore per nome
+    rendono la risoluzione lineare. None resta None. Restituisce (username, numero di collisioni).
+    """
+    taken = {username_key(u) for u in existing if u is not None}
+    next_suffix = {}
+    resolved = []
+    collisions = 0
+    for name in usernames:
+        if name is None:
+            resolved.append(None)
+            continue
+        base = username_key(name)
+        candidate = name
+        if base in taken:
+            collisions += 1
+            n = next_suffix.get(base, 2)
+            while username_key(name + COLLISION_SUFFIX.format(n)) in taken:
+                n += 1
+            candidate = name + COLLISION_SUFFIX.format(n)
+            next_suffix[base] = n + 1
+        taken.add(username_key(candidate))
+        resolved.append(candidate)
+    return resolved, collisions
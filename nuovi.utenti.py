@@ -4,15 +4,24 @@
 Si aspetta variabili nel file .env nella stessa cartella:
 SSH_HOST, SSH_PORT, SSH_USER, DB_USER, DB_PASSWORD, DB_NAME
 
-Scrive il file: ./csv/nuovi.utenti.csv
+Scrive i file:
+- ./csv/nuovi.utenti.csv con gli old_id gia' presenti in gestione_utenti
+- ./csv/nuovi.utenti.usernames.csv con gli username gia' assegnati, letti con la stessa query:
+  orario.gestione_utenti.py li usa per non assegnare username duplicati (names.unique_usernames)
 """
+import csv
 import os
-import shlex
 import subprocess
 import logging
 import sys
 from pathlib import Path
 
+from backends import ssh_session
+from dump_reader import tsv_unescape
+from ssh_session import mysql_command
+from metrics import StageMetrics
+from atomic_output import OutputSet
+
 try:
     from dotenv import load_dotenv
 except Exception:
@@ -21,8 +30,6 @@ except Exception:
 
 ROOT = Path(__file__).resolve().parent
 ENV_PATH = ROOT / '.env'
-CSV_DIR = ROOT / 'csv'
-CSV_OUT = CSV_DIR / 'nuovi.utenti.csv'
 
 
 def load_env():
@@ -42,8 +49,66 @@ def load_env():
                     os.environ.setdefault(k, v)
 
 
-def main():
+def output_paths():
+    """(cartella di output, CSV dei codici, CSV degli username); da chiamare dopo load_env().
+
+    AUTO_OUTPUT_DIR permette di scrivere csv/ e dump/ altrove (es. nei benchmark): si legge a
+    ogni esecuzione, cosi' vale anche se impostato solo nel .env e con lo script importato da main.py.
+    """
+    output_dir = Path(os.getenv('AUTO_OUTPUT_DIR') or ROOT)
+    csv_dir = output_dir / 'csv'
+    return output_dir, csv_dir / 'nuovi.utenti.csv', csv_dir / 'nuovi.utenti.usernames.csv'
+
+
+def write_csv(ssh, mysql_cmd, metrics, outputs, csv_out, usernames_out):
+    """Esegue il comando mysql remoto e scrive le righe nel CSV (temporaneo di `outputs`) man mano che arrivano."""
+    # Assicuriamoci che la cartella CSV esista
+    csv_out.parent.mkdir(parents=True, exist_ok=True)
+
+    # mysql -B -N produce righe separate, tab separated columns: old_id e username
+    # Creiamo un CSV con header "old_id" e salviamo LOCALMENTE (lo stdout proviene dal server remoto ma lo scriviamo qui)
+    logging.info(f'Salvo i risultati localmente in: {csv_out}')
+    # si scrive su un file temporaneo: se il comando fallisce il CSV precedente resta intatto
+    tmp = Path(outputs.path(csv_out))
+    tmp_usernames = Path(outputs.path(usernames_out))
+    rows = 0
+    usernames = set()
+    try:
+        with metrics.timer('fetch'), ssh.stream(mysql_cmd) as lines, tmp.open('w', encoding='utf-8') as f:
+            f.write('old_id\n')
+            for line in lines:
+                fields = line.rstrip('\n').split('\t')
+                val = fields[0].strip()
+                if len(fields) > 1:
+                    username = tsv_unescape(fields[1])
+                    if username and username != 'NULL':
+                        usernames.add(username)
+                if val:
+                    rows += 1
+                    if ',' in val or '"' in val or '\n' in val:
+                        val = '"' + val.replace('"', '""') + '"'
+                    f.write(val + '\n')
+        with tmp_usernames.open('w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['username'])
+            writer.writerows([u] for u in sorted(usernames))
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        tmp_usernames.unlink(missing_ok=True)
+        raise
+    outputs.set_rows(csv_out, rows)
+    outputs.set_rows(usernames_out, len(usernames))
+    metrics.add_rows(rows)
+    metrics.add_output(csv_out)
+    metrics.add_output(usernames_out)
+    logging.info('Comando remoto eseguito con successo; ricevuti risultati dal DB')
+
+
+def run(metrics=None):
+    """Esegue la query remota e scrive il CSV; solleva un'eccezione in caso di errore."""
+    metrics = metrics or StageMetrics('nuovi.utenti')
     load_env()
+    output_dir, csv_out, usernames_out = output_paths()
 
     ssh_host = os.getenv('SSH_HOST')
     ssh_port = os.getenv('SSH_PORT', '22')
@@ -63,47 +128,28 @@ def main():
     logging.info(f"Preparando connessione SSH a {ssh_user}@{ssh_host}:{ssh_port}")
 
     # Costruisci la query. -B per output tab-separated, -N per no headers
-    query = "SELECT old_id FROM gestione_utenti;"
-
-
-    # Comando mysql da eseguire sul server remoto via ssh
-    # Proteggiamo la password con quoting
-    mysql_cmd = f"mysql -u{shlex.quote(db_user)} -p{shlex.quote(db_password)} -D {shlex.quote(db_name)} -B -N -e {shlex.quote(query)}"
-
-    ssh_command = [
-        'ssh',
-        '-o', 'BatchMode=yes',
-        '-o', 'ConnectTimeout=15',
-        '-p', str(ssh_port),
-        f"{ssh_user}@{ssh_host}",
-        mysql_cmd,
-    ]
-
-    logging.info('Connessione SSH: avvio comando remoto per eseguire la query MySQL')
-    try:
-        proc = subprocess.run(ssh_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        logging.info('Comando remoto eseguito con successo; ricevuti risultati dal DB')
-        output = proc.stdout
-    except subprocess.CalledProcessError as e:
-        stderr = (e.stderr or '').strip()
-        logging.error('Errore eseguendo il comando remoto via SSH')
-        if stderr:
-            logging.error(stderr)
-
-        # Se il DB non esiste, proviamo a listare i database disponibili e cercare 'orari'
-        if 'Unknown database' in stderr or 'ERROR 1049' in stderr:
+    query = "SELECT old_id, username FROM gestione_utenti;"
+
+    # Una sola connessione SSH (ControlMaster) per query, elenco dei database ed eventuale retry
+    # il CSV viene pubblicato solo a fine fase, e lasciato intatto se non e' cambiato
+    with OutputSet(output_dir, 'nuovi.utenti') as outputs, ssh_session(ssh_host, ssh_port, ssh_user) as ssh:
+        logging.info('Connessione SSH: avvio comando remoto per eseguire la query MySQL')
+        try:
+            write_csv(ssh, mysql_command(db_user, db_password, query, db_name), metrics, outputs,
+                      csv_out, usernames_out)
+        except subprocess.CalledProcessError as e:
+            stderr = (e.stderr or '').strip()
+            logging.error('Errore eseguendo il comando remoto via SSH')
+            if stderr:
+                logging.error(stderr)
+
+            # Se il DB non esiste, proviamo a listare i database disponibili e cercare 'orari'
+            if 'Unknown database' not in stderr and 'ERROR 1049' not in stderr:
+                raise
             logging.info('Database sconosciuto: provo a elencare i database remoti per trovare un candidato')
-            show_cmd = [
-                'ssh',
-                '-o', 'BatchMode=yes',
-                '-o', 'ConnectTimeout=15',
-                '-p', str(ssh_port),
-                f"{ssh_user}@{ssh_host}",
-                f"mysql -u{shlex.quote(db_user)} -p{shlex.quote(db_password)} -B -N -e 'SHOW DATABASES;'",
-            ]
             try:
-                show_proc = subprocess.run(show_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                dbs = [d.strip() for d in show_proc.stdout.splitlines() if d.strip()]
+                show_out = ssh.run(mysql_command(db_user, db_password, 'SHOW DATABASES;'))
+                dbs = [d.strip() for d in show_out.splitlines() if d.strip()]
                 logging.info(f'Database remoti trovati: {dbs}')
                 # preferiamo esattamente 'orari' se presente, altrimenti proviamo a trovare nome simile
                 candidate = None
@@ -116,46 +162,25 @@ def main():
                         if env_db and env_db in d:
                             candidate = d
                             break
-                if candidate:
-                    logging.info(f'Riprovo la query usando il database: {candidate}')
-                    # ricostruisci il comando mysql con DB scelto
-                    mysql_cmd2 = f"mysql -u{shlex.quote(db_user)} -p{shlex.quote(db_password)} -D {shlex.quote(candidate)} -B -N -e {shlex.quote(query)}"
-                    ssh_command2 = ['ssh', '-p', str(ssh_port), f"{ssh_user}@{ssh_host}", mysql_cmd2]
-                    proc2 = subprocess.run(ssh_command2, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                    output = proc2.stdout
-                else:
+                if not candidate:
                     logging.error('Nessun database candidato trovato per il fallback.')
                     raise
+                logging.info(f'Riprovo la query usando il database: {candidate}')
+                write_csv(ssh, mysql_command(db_user, db_password, query, candidate), metrics, outputs,
+                          csv_out, usernames_out)
             except subprocess.CalledProcessError as e2:
                 logging.error('Errore durante l\'elenco dei database remoti o nel retry')
                 if e2.stderr:
                     logging.error(e2.stderr.strip())
                 raise
-        else:
-            raise
-
-    # Assicuriamoci che la cartella CSV esista
-    CSV_DIR.mkdir(parents=True, exist_ok=True)
-
-    # mysql -B -N produce righe separate, tab separated columns; qui abbiamo una sola colonna
-    # Creiamo un CSV con header "old_id" e salviamo LOCALMENTE (lo stdout proviene dal server remoto ma lo scriviamo qui)
-    logging.info(f'Salvo i risultati localmente in: {CSV_OUT}')
-    with CSV_OUT.open('w', encoding='utf-8') as f:
-        f.write('old_id\n')
-        for line in output.splitlines():
-            val = line.strip()
-            if val:
-                val = val.split('\t')[0]
-                if ',' in val or '"' in val or '\n' in val:
-                    val = '"' + val.replace('"', '""') + '"'
-                f.write(val + '\n')
 
+    metrics.count('outputs_unchanged', sum(1 for changed in outputs.changed.values() if not changed))
     logging.info('CSV scritto correttamente sul filesystem locale')
 
 
-if __name__ == '__main__':
+def main():
     try:
-        main()
+        run()
     except Exception:
         logging.exception('Errore non gestito durante l\'esecuzione')
         # stampo marker di errore richiesto
@@ -165,3 +190,7 @@ if __name__ == '__main__':
         # stampo marker di successo richiesto
         print('$$$')
         sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,51 @@
 #!/usr/bin/env python3
 import os
 import sys
-import pyodbc
+import time
+import traceback
 from dotenv import load_dotenv
 import csv
-from datetime import datetime, date
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from contextlib import nullcontext
+from dump_writer import SqlDumpWriter
+from delta_sync import DeltaWriter, applied_path, delta_enabled, mark_applied, save_snapshot
+from code_index import dump_stamp, index_path, write_index
+from atomic_output import OutputSet
+from mysql_load import RemoteTableLoader, load_enabled
+from output_codecs import ColumnarWriter, columnar_enabled, columnar_path, compressed_path, open_text
+import mssql
+from metrics import StageMetrics
+from query_stats import QueryStats, execute_query, stats_enabled
+from names import normalize_name
+import source_snapshot
+from source_snapshot import SourceSnapshot
+from store_rollup import StoreRollup, rollup_enabled
+from column_codecs import RowCodec, sql_literal
 
 load_dotenv()
 
-HOST = os.getenv("MSSQL_HOST")
-PORT = os.getenv("MSSQL_PORT")
-USER = os.getenv("MSSQL_USER")
-PASSWORD = os.getenv("MSSQL_PASS")
-DATABASE = os.getenv("MSSQL_DB")
-DRIVER = os.getenv("MSSQL_DRIVER", "ODBC Driver 18 for SQL Server")
-
-def sql_literal(value):
-    if value is None:
-        return "NULL"
-    if isinstance(value, (int, float)):
-        return str(value)
-    if isinstance(value, (datetime, date)):
-        return "'{}'".format(value.strftime('%Y-%m-%d'))
-    s = str(value).replace("'", "''")
-    return f"'{s}'"
-
-QUERY = """
+# righe lette dal cursore per ogni fetchmany
+BATCH_SIZE = int(os.getenv("DIPENDENTI_BATCH_SIZE", "1000"))
+# connessioni parallele per l'estrazione partizionata per negozio (0/1 = una sola query)
+PARTITION_WORKERS = int(os.getenv("DIPENDENTI_PARTITIONS", "0") or 0)
+# intervalli di negozi per connessione: i negozi hanno dimensioni diverse, cosi' il carico si bilancia
+PARTITIONS_PER_WORKER = 4
+
+def iter_rows(cur, batch_size, metrics=None):
+    """Legge il cursore a blocchi di `batch_size` righe, senza tenere in memoria tutto il risultato."""
+    while True:
+        start = time.perf_counter()
+        batch = cur.fetchmany(batch_size)
+        if metrics is not None:
+            metrics.add_time('fetch', time.perf_counter() - start)
+            metrics.add_rows(len(batch))
+        if not batch:
+            break
+        yield from batch
+
+QUERY_TEMPLATE = """
 SELECT 
     D.RifCommPref AS Neg,
     D.Descrizione AS NOME,
@@ -44,7 +64,10 @@ SELECT
     D.Ore_Gio AS Giovedi,
     D.Ore_Ven AS Venerdi,
     D.Ore_Sab AS Sabato,
-    D.Ore_Dom AS Domenica
+    D.Ore_Dom AS Domenica,
+    D.Nome,
+    D.Cognome,
+    O.Posizione
 FROM Tk_TabDipendenti AS D
 INNER JOIN (
     SELECT 
@@ -52,11 +75,34 @@ INNER JOIN (
         MIN(da_data_attivo) AS Min_da_data_attivo,
         MAX(a_data_attivo) AS Max_a_data_attivo
     FROM tk_Tab_DettDip
-    GROUP BY coddip
+{dett_filter}    GROUP BY coddip
 ) AS Agg
     ON D.Codice = Agg.coddip
 INNER JOIN Tk_Tab_LivContDip AS L
     ON D.Codice = L.CodiceDip
+INNER JOIN (
+    SELECT Codice, ROW_NUMBER() OVER (ORDER BY Codice) AS Posizione
+    FROM Tk_TabDipendenti
+) AS O
+    ON D.Codice = O.Codice
+WHERE D.Attivo = 1
+  AND D.RifCommPref IS NOT NULL
+  AND D.RifCommPref <> ''
+  AND D.RifCommPref NOT IN ('WEB','AAA','AAAAA')
+{store_filter}ORDER BY D.RifCommPref ASC;
+"""
+
+QUERY = QUERY_TEMPLATE.format(dett_filter="", store_filter="")
+
+# stessa query ristretta a un intervallo di negozi (primo, ultimo), anche nell'aggregato su tk_Tab_DettDip
+PARTITION_QUERY = QUERY_TEMPLATE.format(
+    dett_filter="    WHERE coddip IN (SELECT Codice FROM Tk_TabDipendenti WHERE RifCommPref BETWEEN ? AND ?)\n",
+    store_filter="  AND D.RifCommPref BETWEEN ? AND ?\n",
+)
+
+STORES_QUERY = """
+SELECT DISTINCT D.RifCommPref
+FROM Tk_TabDipendenti AS D
 WHERE D.Attivo = 1
   AND D.RifCommPref IS NOT NULL
   AND D.RifCommPref <> ''
@@ -64,6 +110,56 @@ WHERE D.Attivo = 1
 ORDER BY D.RifCommPref ASC;
 """
 
+def store_ranges(stores, parts):
+    """Divide l'elenco ordinato dei negozi in al massimo `parts` intervalli contigui (primo, ultimo)."""
+    if not stores:
+        return []
+    size = -(-len(stores) // max(parts, 1))
+    return [(stores[i], stores[min(i + size, len(stores)) - 1]) for i in range(0, len(stores), size)]
+
+def fetch_partition(first, last, stats=None):
+    """Esegue la query su un intervallo di negozi con una connessione propria; restituisce (righe, secondi)."""
+    start = time.perf_counter()
+    with mssql.connection() as conn:
+        cur = conn.cursor()
+        capture = execute_query(cur, PARTITION_QUERY, first, last, first, last,
+                                stats=stats, label=f"partizione {first}-{last}")
+        rows = cur.fetchall()
+        if capture is not None:
+            capture.finish(len(rows))
+        cur.close()
+    return rows, time.perf_counter() - start
+
+def iter_partitioned_rows(cur, workers, metrics, stats=None):
+    """Estrae i dipendenti per intervalli di negozi su `workers` connessioni, nell'ordine dei negozi.
+
+    Gli intervalli sono contigui nell'ordinamento del server, quindi restituirli in sequenza
+    riproduce l'ORDER BY della query unica. Restano in memoria al piu' 2 * workers partizioni.
+    """
+    with metrics.timer('query'):
+        capture = execute_query(cur, STORES_QUERY, stats=stats, label="negozi")
+        stores = [r[0] for r in cur.fetchall()]
+        if capture is not None:
+            capture.finish(len(stores))
+    ranges = iter(store_ranges(stores, workers * PARTITIONS_PER_WORKER))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(fetch_partition, *r, stats) for r in islice(ranges, workers * 2))
+        try:
+            while pending:
+                start = time.perf_counter()
+                rows, busy = pending.popleft().result()
+                metrics.add_time('fetch', time.perf_counter() - start)
+                for r in islice(ranges, 1):
+                    pending.append(pool.submit(fetch_partition, *r, stats))
+                metrics.add_time('partition_query', busy)
+                metrics.add_rows(len(rows))
+                metrics.count('partitions')
+                yield from rows
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
 COLUMNS = [
     "Neg",
     "NOME",
@@ -80,30 +176,58 @@ COLUMNS = [
     "Sabato",
     "Domenica",
 ]
+KEY_INDEX = COLUMNS.index("CODICEPERSONALE")
+NOME_INDEX = COLUMNS.index("NOME")
+NEG_INDEX = COLUMNS.index("Neg")
+# Nome e Cognome grezzi, dopo le colonne del dump: servono solo allo snapshot per orario.gestione_utenti.py
+SOURCE_NOME_INDEX = len(COLUMNS)
+SOURCE_COGNOME_INDEX = len(COLUMNS) + 1
+# posizione del Codice in ORDER BY Codice sull'intera tabella, con la collation del server
+SOURCE_POSITION_INDEX = len(COLUMNS) + 2
 
-def main():
-    try:
-        if not HOST or not PORT:
-            print('XXX')
-            sys.exit(1)
-
-        server = f"{HOST},{PORT}"
-        if USER and PASSWORD:
-            conn_str = (
-                f"DRIVER={{{DRIVER}}};SERVER={server};DATABASE={DATABASE or ''};UID={USER};PWD={PASSWORD};Encrypt=no;"
-            )
-        else:
-            conn_str = (
-                f"DRIVER={{{DRIVER}}};SERVER={server};DATABASE={DATABASE or ''};Trusted_Connection=yes;Encrypt=no;"
-            )
+# tipi delle colonne nel file colonnare (OUTPUT_COLUMNAR): date vere e ore come decimali
+COLUMNAR_FIELDS = [
+    ("Neg", "string"),
+    ("NOME", "string"),
+    ("Ore_Sett", "decimal"),
+    ("CODICEPERSONALE", "string"),
+    ("Livello", "int"),
+    ("DATA_ASSUNZIONE", "date"),
+    ("DATA_FINE_CONTRATTO", "date"),
+] + [(day, "decimal") for day in COLUMNS[7:]]
+
+def normalize_row(row):
+    """Restituisce i valori della riga nell'ordine di COLUMNS, con NOME normalizzato."""
+    values = list(islice(row, len(COLUMNS)))
+    if len(values) < len(COLUMNS):
+        values += [None] * (len(COLUMNS) - len(values))
+    values[NOME_INDEX] = normalize_name(values[NOME_INDEX])
+    return values
 
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        DUMP_DIR = os.path.join(BASE_DIR, "dump")
-        CSV_DIR = os.path.join(BASE_DIR, "csv")
-        SQL_FILENAME = os.path.join(DUMP_DIR, "orari.dipendenti.sql")
-        CSV_FILENAME = os.path.join(CSV_DIR, "orari.dipendenti.csv")
+def row_codec(row):
+    """Convertitori per colonna (vedi column_codecs.py) dalla description del cursore di `row`."""
+    return RowCodec.from_description(getattr(row, "cursor_description", None), len(COLUMNS))
 
-        CREATE_TABLE_SQL = """
+def run(batch_size=None, metrics=None, workers=None):
+    """Estrae i dipendenti attivi e scrive dump SQL e CSV; solleva un'eccezione in caso di errore."""
+    metrics = metrics or StageMetrics("orario.dipendenti")
+    # verifica subito i parametri di connessione (solleva RuntimeError se mancano)
+    mssql.check_settings()
+
+    BASE_DIR = os.getenv("AUTO_OUTPUT_DIR") or os.path.dirname(os.path.abspath(__file__))
+    DUMP_DIR = os.path.join(BASE_DIR, "dump")
+    CSV_DIR = os.path.join(BASE_DIR, "csv")
+    # con OUTPUT_COMPRESSION i file esportati hanno il suffisso .gz / .zst
+    SQL_FILENAME = compressed_path(os.path.join(DUMP_DIR, "orari.dipendenti.sql"))
+    TSV_FILENAME = compressed_path(os.path.join(DUMP_DIR, "orari.dipendenti.tsv"))
+    COLUMNAR_FILENAME = columnar_path(os.path.join(DUMP_DIR, "orari.dipendenti")) if columnar_enabled() else None
+    DELTA_FILENAME = os.path.join(DUMP_DIR, "orari.dipendenti.delta.sql")
+    SNAPSHOT_FILENAME = os.path.join(DUMP_DIR, "orari.dipendenti.snapshot")
+    CSV_FILENAME = compressed_path(os.path.join(CSV_DIR, "orari.dipendenti.csv"))
+    ROLLUP_CSV = os.path.join(CSV_DIR, "orari.dipendenti.negozi.csv")
+    ROLLUP_JSON = os.path.join(CSV_DIR, "orari.dipendenti.negozi.json")
+
+    CREATE_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS dipendenti (
   Neg varchar(10) DEFAULT NULL,
   NOME varchar(100) DEFAULT NULL,
@@ -123,62 +247,141 @@ CREATE TABLE IF NOT EXISTS dipendenti (
 )
 """
 
-        os.makedirs(DUMP_DIR, exist_ok=True)
-        os.makedirs(CSV_DIR, exist_ok=True)
+    os.makedirs(DUMP_DIR, exist_ok=True)
+    os.makedirs(CSV_DIR, exist_ok=True)
+    # con QUERY_STATS le query vengono eseguite con STATISTICS IO/TIME/XML (vedi query_stats.py)
+    stats = QueryStats("orario.dipendenti", metrics) if stats_enabled() else None
 
-        with pyodbc.connect(conn_str, timeout=10) as conn:
+    # tutti i file vengono scritti in temporaneo e pubblicati solo a estrazione completata;
+    # quelli identici all'esecuzione precedente restano intatti (vedi atomic_output.py)
+    with OutputSet(BASE_DIR, "orario.dipendenti") as outputs:
+        with mssql.connection() as conn, \
+                open_text(outputs.path(SQL_FILENAME), "w", encoding="utf-8") as fsql, \
+                open_text(outputs.path(CSV_FILENAME), "w", encoding="utf-8-sig", newline="") as fcsv:
             cur = conn.cursor()
-            cur.execute(QUERY)
-            rows = cur.fetchall()
+            workers = PARTITION_WORKERS if workers is None else workers
+            capture = None
+            if workers > 1:
+                rows = iter_partitioned_rows(cur, workers, metrics, stats)
+            else:
+                with metrics.timer('query'):
+                    capture = execute_query(cur, QUERY, stats=stats, label="dipendenti")
+                rows = iter_rows(cur, batch_size or BATCH_SIZE, metrics)
+            loop_start = time.perf_counter()
+            # i tipi delle colonne si leggono dalla prima riga: i convertitori di CSV, dump e TSV
+            # vengono scelti una volta sola invece di controllare il tipo di ogni valore
+            first = next(rows, None)
+            codec = row_codec(first)
+            rows = chain([first], rows) if first is not None else iter(())
 
-        # write SQL dump
-        with open(SQL_FILENAME, "w", encoding="utf-8") as fsql:
             fsql.write(CREATE_TABLE_SQL)
             fsql.write('\n\n')
             fsql.write('DELETE FROM dipendenti;\n\n')
-            for row in rows:
-                values = []
-                for i, col in enumerate(COLUMNS):
-                    try:
-                        val = row[i]
-                    except Exception:
-                        val = None
-                    if col == "NOME" and val is not None:
-                        try:
-                            val = ' '.join(str(val).split())
-                        except Exception:
-                            pass
-                    values.append(sql_literal(val))
-                cols_sql = ", ".join(COLUMNS)
-                vals_sql = ", ".join(values)
-                fsql.write(f"INSERT INTO dipendenti ({cols_sql}) VALUES ({vals_sql});\n")
-
-        # write CSV
-        with open(CSV_FILENAME, "w", encoding="utf-8-sig", newline="") as fcsv:
             writer = csv.writer(fcsv)
             writer.writerow(COLUMNS)
-            for row in rows:
-                row_vals = []
-                for i, col in enumerate(COLUMNS):
-                    try:
-                        v = row[i]
-                    except Exception:
-                        v = None
-                    if col == "NOME" and v is not None:
-                        try:
-                            v = ' '.join(str(v).split())
-                        except Exception:
-                            pass
-                    if isinstance(v, (datetime, date)):
-                        row_vals.append(v.strftime('%Y-%m-%d'))
-                    elif v is None:
-                        row_vals.append("")
-                    else:
-                        row_vals.append(str(v))
-                writer.writerow(row_vals)
 
+            codes = set()
+            # Codice, Nome, Cognome e negozio per orario.gestione_utenti.py (vedi source_snapshot.py)
+            snapshot = SourceSnapshot()
+            # un solo passaggio: ogni riga viene normalizzata una volta e inviata a entrambi i writer
+            # con DIPENDENTI_DELTA attivo si scrive anche il delta rispetto all'estrazione precedente
+            delta = (
+                DeltaWriter(outputs.path(DELTA_FILENAME), SNAPSHOT_FILENAME, "dipendenti", COLUMNS,
+                            "CODICEPERSONALE", sql_literal, save_path=outputs.path(SNAPSHOT_FILENAME),
+                            codec=codec)
+                if delta_enabled() else nullcontext()
+            )
+            # con MYSQL_LOAD le righe vanno anche direttamente nella tabella MySQL di destinazione
+            remote = (
+                RemoteTableLoader("dipendenti", COLUMNS, sql_literal, replace=True,
+                                  create_sql=CREATE_TABLE_SQL, metrics=metrics, codec=codec)
+                if load_enabled() else nullcontext()
+            )
+            columnar = (
+                ColumnarWriter(outputs.path(COLUMNAR_FILENAME), COLUMNAR_FIELDS)
+                if COLUMNAR_FILENAME else nullcontext()
+            )
+            # con DIPENDENTI_ROLLUP le righe vengono anche riepilogate per negozio (vedi store_rollup.py)
+            rollup = StoreRollup(COLUMNS) if rollup_enabled() else nullcontext()
+            with SqlDumpWriter(fsql, "dipendenti", COLUMNS, sql_literal, tsv_path=outputs.path(TSV_FILENAME),
+                               codec=codec) as dump, \
+                    delta as delta_writer, remote as loader, columnar as columnar_writer, rollup as rollup_writer:
+                csv_row = codec.csv_row
+                for row in rows:
+                    values = normalize_row(row)
+                    dump.write_row(values)
+                    if values[KEY_INDEX] is not None:
+                        codes.add(str(values[KEY_INDEX]))
+                        snapshot.add((values[KEY_INDEX], row[SOURCE_NOME_INDEX], row[SOURCE_COGNOME_INDEX],
+                                      values[NEG_INDEX]), row[SOURCE_POSITION_INDEX])
+                    if delta_writer is not None:
+                        delta_writer.write_row(values)
+                    if loader is not None:
+                        loader.write_row(values)
+                    if columnar_writer is not None:
+                        columnar_writer.write_row(values)
+                    if rollup_writer is not None:
+                        rollup_writer.write_row(values)
+                    writer.writerow(csv_row(values))
+            metrics.add_time('write', time.perf_counter() - loop_start - metrics.timings.get('fetch', 0.0))
+            if capture is not None:
+                # dopo l'ultima riga: piano di esecuzione e statistiche del server
+                capture.finish(dump.rows)
+
+        if rollup_writer is not None:
+            with metrics.timer('rollup'):
+                summary = rollup_writer.write(outputs.path(ROLLUP_CSV), outputs.path(ROLLUP_JSON))
+            outputs.set_rows(ROLLUP_CSV, len(summary['stores']))
+            outputs.set_rows(ROLLUP_JSON, len(summary['stores']))
+            metrics.count('rollup_mismatches', len(summary['mismatches']))
+
+        for path in (SQL_FILENAME, CSV_FILENAME, TSV_FILENAME, COLUMNAR_FILENAME):
+            if path:
+                outputs.set_rows(path, dump.rows)
+        if delta_enabled():
+            outputs.set_rows(DELTA_FILENAME, delta.changed + delta.deleted)
+            outputs.set_rows(SNAPSHOT_FILENAME, len(delta.current))
+            if delta.baseline_missing:
+                # prima estrazione con la base separata: la base e' lo snapshot da cui e' partito il delta
+                save_snapshot(outputs.path(applied_path(SNAPSHOT_FILENAME), rows=len(delta.previous)), delta.previous)
+        outputs.commit()
+        if delta_enabled() and load_enabled():
+            # MYSQL_LOAD ha appena ricaricato l'intera tabella: lo snapshot e' lo stato della destinazione
+            mark_applied(SNAPSHOT_FILENAME)
+
+        # indice dei codici e snapshot accanto al dump (gia' pubblicato), letti da
+        # orario.gestione_utenti.py senza riparsare l'SQL ne' interrogare di nuovo il server
+        with metrics.timer('index'):
+            stamp = dump_stamp(SQL_FILENAME)
+            write_index(SQL_FILENAME, codes, stamp=stamp,
+                        path=outputs.path(index_path(SQL_FILENAME), rows=len(codes)))
+            source_snapshot.save(SQL_FILENAME, snapshot, stamp=stamp,
+                                 path=outputs.path(source_snapshot.snapshot_path(SQL_FILENAME), rows=len(snapshot)))
+    source_snapshot.publish(SQL_FILENAME, snapshot)
+
+    for path in (SQL_FILENAME, CSV_FILENAME, index_path(SQL_FILENAME)):
+        metrics.add_output(path)
+    if dump.fmt == 'load':
+        metrics.add_output(TSV_FILENAME)
+    if COLUMNAR_FILENAME:
+        metrics.add_output(COLUMNAR_FILENAME)
+    if rollup_writer is not None:
+        metrics.add_output(ROLLUP_CSV)
+        metrics.add_output(ROLLUP_JSON)
+    if delta_enabled():
+        metrics.add_output(DELTA_FILENAME)
+        metrics.count('delta_changed', delta.changed)
+        metrics.count('delta_deleted', delta.deleted)
+    metrics.count('outputs_unchanged', sum(1 for changed in outputs.changed.values() if not changed))
+    if stats is not None:
+        stats.save()
+
+def main():
+    try:
+        run()
         print('$$$')
     except Exception:
+        traceback.print_exc()
         print('XXX')
         sys.exit(1)
 
@@ -2,236 +2,267 @@
 import os
 import csv
 import sys
-from datetime import datetime
+import time
+import traceback
+from contextlib import nullcontext
 from dotenv import load_dotenv
+from column_codecs import RowCodec
+from dump_writer import SqlDumpWriter
+from atomic_output import OutputSet
+from code_index import load_index
+from dump_reader import iter_records
+from mysql_load import RemoteTableLoader, load_enabled
+from output_codecs import ColumnarWriter, columnar_enabled, columnar_path, compressed_path, open_text, resolve_path
+import mssql
+from metrics import StageMetrics
+import source_snapshot
+from query_stats import QueryStats, execute_query, stats_enabled
+import names
+import passwords
 
 load_dotenv()
 
-MSSQL_HOST = os.getenv('MSSQL_HOST')
-MSSQL_PORT = os.getenv('MSSQL_PORT', '1433')
-MSSQL_USER = os.getenv('MSSQL_USER')
-MSSQL_PASS = os.getenv('MSSQL_PASS')
-MSSQL_DB = os.getenv('MSSQL_DB')
-MSSQL_DRIVER = os.getenv('MSSQL_DRIVER')
+SQL_COLUMNS = ['id', 'old_id', 'nome', 'username', 'VecchiaPasswd', 'NuovaPasswd', 'ruolo', 'negozio', 'AbilitaInsOrari']
+# nel caricamento diretto (MYSQL_LOAD) l'id resta all'AUTO_INCREMENT della tabella di destinazione
+LOAD_COLUMNS = SQL_COLUMNS[1:]
+# tipi delle colonne nel file colonnare (OUTPUT_COLUMNAR)
+COLUMNAR_FIELDS = [('id', 'int')] + [(c, 'string') for c in SQL_COLUMNS[1:]]
+# tutti i valori sono testo tra apici (come sql_quote) o NULL: convertitori scelti una volta per colonna
+CODEC = RowCodec(['string'] * len(SQL_COLUMNS))
+LOAD_CODEC = RowCodec(['string'] * len(LOAD_COLUMNS))
 
-def main():
-    try:
-        if not MSSQL_HOST or not MSSQL_DB:
-            print('XXX')
-            sys.exit(1)
+def sql_quote(val):
+    if val is None:
+        return 'NULL'
+    s = str(val)
+    s = s.replace("'", "''")
+    return f"'{s}'"
 
-        try:
-            import pyodbc
-        except Exception:
-            print('XXX')
-            sys.exit(1)
+def user_values(row):
+    """(old_id, nome, username, negozio) di una riga: Nome e Cognome normalizzati una sola volta."""
+    old_id, nome, cognome, negozio = row[0], names.normalize_name(row[1]), names.normalize_name(row[2]), row[3]
+    return old_id, names.display_name(nome, cognome), names.username(nome, cognome), negozio
 
-        SELECT_BASE = """
+def load_codes(cur, table, codes):
+    """Crea la tabella temporanea `table` e la popola con i codici (bulk insert con fast_executemany)."""
+    cur.execute(f"IF OBJECT_ID('tempdb..{table}') IS NOT NULL DROP TABLE {table}")
+    cur.execute(f"CREATE TABLE {table} (cod nvarchar(50) COLLATE DATABASE_DEFAULT NOT NULL PRIMARY KEY)")
+    cur.executemany(f"INSERT INTO {table} (cod) VALUES (?)", [(c,) for c in codes])
+
+# Nome e Cognome arrivano grezzi: nome e username si ricavano in Python (vedi names.py)
+SELECT_BASE = """
 SELECT
     Codice AS old_id,
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Nome)), '  ', ' '), '  ', ' '), '  ', ' ') AS Nome,
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Cognome)), '  ', ' '), '  ', ' '), '  ', ' ') AS Cognome,
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Cognome)), '  ', ' '), '  ', ' '), '  ', ' ')
-        + ' '
-        +
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Nome)), '  ', ' '), '  ', ' '), '  ', ' ') AS nome,
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Nome)), '  ', ' '), '  ', ' '), '  ', ' ')
-        + ' '
-        +
-    REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(Cognome)), '  ', ' '), '  ', ' '), '  ', ' ') AS username,
-    'AAA123' AS VecchiaPasswd,
-    NULL AS NuovaPasswd,
+    Nome,
+    Cognome,
     RifCommPref AS negozio
 FROM TK_TabDipendenti
 """
 
-        # Build a set of codes to exclude from the INSERTs by reading the
-        # existing new-users CSV and (optionally) the older dump. The goal is
-        # to only INSERT users whose Codice (old_id) is NOT present in that list.
-        exclude_codes = set()
-
-        # Read existing new users CSV to exclude them: csv/nuovi.utenti.csv
-        new_users_file = os.path.join(os.path.dirname(__file__), 'csv', 'nuovi.utenti.csv')
-        if os.path.exists(new_users_file):
-            try:
-                with open(new_users_file, newline='', encoding='utf-8') as nf:
-                    reader = csv.reader(nf)
-                    first = next(reader, None)
-                    if first:
-                        if not (len(first) == 1 and first[0].strip().lower() == 'old_id'):
-                            # first row is data
-                            exclude_codes.add(first[0].strip())
-                    for row in reader:
-                        if not row:
-                            continue
-                        val = row[0].strip()
-                        if val:
-                            exclude_codes.add(val)
-            except Exception:
-                exclude_codes = set()
-
-        # Optionally also read older dump to build a whitelist (IN list)
-        dump_codes = None
-        dump_file = os.path.join(os.path.dirname(__file__), 'dump', 'orari.dipendenti.sql')
-        if os.path.exists(dump_file):
-            try:
-                with open(dump_file, 'r', encoding='utf-8') as df:
-                    codes = set()
-                    for line in df:
-                        line = line.strip()
-                        if not line.upper().startswith('INSERT INTO DIPENDENTI'):
-                            continue
-                        idx = line.find('VALUES')
-                        if idx == -1:
-                            continue
-                        vals_part = line[idx+6:].strip()
-                        if vals_part.startswith('(') and vals_part.endswith(');'):
-                            vals_part = vals_part[1:-2]
-                        elif vals_part.startswith('(') and vals_part.endswith(')'):
-                            vals_part = vals_part[1:-1]
-                        parts = []
-                        cur = ''
-                        in_quote = False
-                        escape = False
-                        for ch in vals_part:
-                            if ch == "'" and not escape:
-                                in_quote = not in_quote
-                                cur += ch
-                                continue
-                            if ch == ',' and not in_quote:
-                                parts.append(cur.strip())
-                                cur = ''
-                                continue
-                            if ch == '\\' and in_quote:
-                                escape = True
-                                cur += ch
-                                continue
-                            cur += ch
-                            escape = False
-                        if cur:
-                            parts.append(cur.strip())
-                        if len(parts) >= 4:
-                            codice_raw = parts[3]
-                            codice = codice_raw.strip()
-                            if codice.startswith("'") and codice.endswith("'"):
-                                codice = codice[1:-1]
-                            if codice and codice.upper() != 'NULL':
-                                codes.add(codice)
-                    if codes:
-                        dump_codes = sorted(codes)
-            except Exception:
-                dump_codes = None
-
-        # Build SELECT_SQL combining old whitelist (dump_codes) and CSV exclusion
-        if dump_codes and exclude_codes:
-            quoted_in = ", ".join([f"'{c.replace("'","''")}'" for c in dump_codes])
-            quoted_not = ", ".join([f"'{c.replace("'","''")}'" for c in sorted(exclude_codes)])
-            SELECT_SQL = SELECT_BASE + f"\nWHERE Codice IN ({quoted_in}) AND Codice NOT IN ({quoted_not})\n"
-        elif dump_codes:
-            quoted_in = ", ".join([f"'{c.replace("'","''")}'" for c in dump_codes])
-            SELECT_SQL = SELECT_BASE + f"\nWHERE Codice IN ({quoted_in})\n"
-        elif exclude_codes:
-            quoted_not = ", ".join([f"'{c.replace("'","''")}'" for c in sorted(exclude_codes)])
-            SELECT_SQL = SELECT_BASE + f"\nWHERE Codice NOT IN ({quoted_not})\n"
-        else:
-            SELECT_SQL = SELECT_BASE
-
-        candidates = []
-        if MSSQL_DRIVER:
-            candidates.append(MSSQL_DRIVER)
-        candidates.extend(['ODBC Driver 17 for SQL Server', 'ODBC Driver 13 for SQL Server', 'FreeTDS', 'SQL Server'])
-
-        conn = None
-        last_err = None
-        for drv in candidates:
-            try:
-                conn_str = f"DRIVER={{{drv}}};SERVER={MSSQL_HOST},{MSSQL_PORT};DATABASE={MSSQL_DB};"
-                if MSSQL_USER:
-                    conn_str += f"UID={MSSQL_USER};PWD={MSSQL_PASS};"
-                else:
-                    conn_str += "Trusted_Connection=yes;"
-                conn = pyodbc.connect(conn_str, timeout=10)
-                break
-            except Exception as e:
-                last_err = e
-
-        if conn is None:
-            print('XXX')
-            sys.exit(1)
+def load_usernames(path):
+    """Username gia' presenti in gestione_utenti, dal file scritto da nuovi.utenti.py (set vuoto se manca)."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return {row[0] for row in reader if row and row[0]}
+
+def resolve_usernames(users, existing, metrics):
+    """Sostituisce gli username dei nuovi utenti con quelli resi univoci da names.unique_usernames."""
+    with metrics.timer('usernames'):
+        usernames, collisions = names.unique_usernames([u[2] for u in users], existing)
+    metrics.count('username_collisions', collisions)
+    return [(old_id, nome, username, negozio) for (old_id, nome, _, negozio), username in zip(users, usernames)]
 
+def fetch_rows(dump_file, exclude_codes, metrics, stats=None):
+    """Righe (old_id, Nome, Cognome, negozio) lette dal server, limitate ai codici del dump dei dipendenti."""
+    # Optionally also read older dump to build a whitelist (IN list)
+    dump_codes = None
+    # prima l'indice scritto da orario.dipendenti.py; il parsing del dump solo se manca o non e' aggiornato
+    indexed = load_index(dump_file)
+    if indexed is not None:
+        dump_codes = sorted(indexed) or None
+    elif os.path.exists(dump_file):
+        try:
+            codes = set()
+            for rec in iter_records(dump_file, 'dipendenti'):
+                codice = rec.get('CODICEPERSONALE')
+                if codice is not None and str(codice).strip():
+                    codes.add(str(codice).strip())
+            if codes:
+                dump_codes = sorted(codes)
+        except Exception:
+            dump_codes = None
+
+    # Build SELECT_SQL combining old whitelist (dump_codes) and CSV exclusion.
+    # The code lists are bulk-loaded into session temp tables and joined, so the
+    # statement text stays the same on every run regardless of how many codes.
+    SELECT_SQL = SELECT_BASE
+    if dump_codes:
+        SELECT_SQL += "INNER JOIN #codici_dump AS W ON W.cod = TK_TabDipendenti.Codice\n"
+    if exclude_codes:
+        SELECT_SQL += "WHERE NOT EXISTS (SELECT 1 FROM #codici_esclusi AS E WHERE E.cod = TK_TabDipendenti.Codice)\n"
+    # stesso ordine delle righe dello snapshot: gli username degli omonimi non dipendono dal piano
+    SELECT_SQL += "ORDER BY TK_TabDipendenti.Codice\n"
+
+    with mssql.connection() as conn:
         cur = conn.cursor()
-        cur.execute(SELECT_SQL)
-        rows = cur.fetchall()
-        colnames = [c[0] for c in cur.description]
-
-        out_csv_dir = os.path.join(os.path.dirname(__file__), 'csv')
-        out_dump_dir = os.path.join(os.path.dirname(__file__), 'dump')
-        os.makedirs(out_csv_dir, exist_ok=True)
-        os.makedirs(out_dump_dir, exist_ok=True)
-
-        csv_path = os.path.join(out_csv_dir, 'orari.gestione_utenti.csv')
-        sql_path = os.path.join(out_dump_dir, 'orari.gestione_utenti.sql')
-
-        # CSV headers as requested
-        csv_headers = ['id', 'old_id', 'nome', 'username', 'VecchiaPasswd', 'NuovaPasswd', 'ruolo', 'negozio', 'AbilitaInsOrari']
-
-        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=csv_headers)
-            writer.writeheader()
-            for r in rows:
-                old_id = getattr(r, 'old_id') if 'old_id' in colnames else r[0]
-                nome = getattr(r, 'nome') if 'nome' in colnames else ''
-                username = getattr(r, 'username') if 'username' in colnames else ''
-                negozio = getattr(r, 'negozio') if 'negozio' in colnames else None
-                writer.writerow({
-                    'id': '',
-                    'old_id': old_id if old_id is not None else '',
-                    'nome': nome if nome is not None else '',
-                    'username': username if username is not None else '',
-                    'VecchiaPasswd': 'AAA123',
-                    'NuovaPasswd': '',
-                    'ruolo': 'Dipendente',
-                    'negozio': negozio if negozio is not None else '',
-                    'AbilitaInsOrari': ''
-                })
-
-        with open(sql_path, 'w', encoding='utf-8') as f:
+        cur.fast_executemany = True
+        temp_tables = []
+        with metrics.timer('load_codes'):
+            if dump_codes:
+                load_codes(cur, '#codici_dump', dump_codes)
+                temp_tables.append('#codici_dump')
+            if exclude_codes:
+                load_codes(cur, '#codici_esclusi', sorted(exclude_codes))
+                temp_tables.append('#codici_esclusi')
+        with metrics.timer('query'):
+            capture = execute_query(cur, SELECT_SQL, stats=stats, label='gestione_utenti')
+        with metrics.timer('fetch'):
+            rows = cur.fetchall()
+        metrics.add_rows(len(rows))
+        if capture is not None:
+            capture.finish(len(rows))
+        for name in temp_tables:
+            cur.execute(f"DROP TABLE {name}")
+        cur.close()
+    return rows
+
+def run(metrics=None):
+    """Estrae i nuovi utenti e scrive CSV e dump SQL; solleva un'eccezione in caso di errore."""
+    metrics = metrics or StageMetrics('orario.gestione_utenti')
+    # verifica subito i parametri di connessione (solleva RuntimeError se mancano)
+    mssql.check_settings()
+    base_dir = os.getenv('AUTO_OUTPUT_DIR') or os.path.dirname(os.path.abspath(__file__))
+
+    # Build a set of codes to exclude from the INSERTs by reading the
+    # existing new-users CSV and (optionally) the older dump. The goal is
+    # to only INSERT users whose Codice (old_id) is NOT present in that list.
+    exclude_codes = set()
+
+    # Read existing new users CSV to exclude them: csv/nuovi.utenti.csv
+    new_users_file = os.path.join(base_dir, 'csv', 'nuovi.utenti.csv')
+    if os.path.exists(new_users_file):
+        try:
+            with open(new_users_file, newline='', encoding='utf-8') as nf:
+                reader = csv.reader(nf)
+                first = next(reader, None)
+                if first:
+                    if not (len(first) == 1 and first[0].strip().lower() == 'old_id'):
+                        # first row is data
+                        exclude_codes.add(first[0].strip())
+                for row in reader:
+                    if not row:
+                        continue
+                    val = row[0].strip()
+                    if val:
+                        exclude_codes.add(val)
+        except Exception:
+            exclude_codes = set()
+
+    # il dump puo' essere compresso (OUTPUT_COMPRESSION): si prende quello scritto per ultimo
+    dump_file = resolve_path(os.path.join(base_dir, 'dump', 'orari.dipendenti.sql'))
+    # con QUERY_STATS la SELECT viene eseguita con STATISTICS IO/TIME/XML (vedi query_stats.py)
+    stats = QueryStats('orario.gestione_utenti', metrics) if stats_enabled() else None
+    # lo snapshot scritto da orario.dipendenti.py ha gia' Nome, Cognome e negozio di tutti i codici
+    # del dump: se corrisponde al dump non serve interrogare di nuovo il server (vedi source_snapshot.py)
+    snapshot = source_snapshot.load(dump_file)
+    if snapshot:
+        with metrics.timer('snapshot'):
+            rows = snapshot.rows(exclude=exclude_codes)
+        metrics.add_rows(len(rows))
+        metrics.count('source_snapshot')
+    else:
+        rows = fetch_rows(dump_file, exclude_codes, metrics, stats)
+
+    out_csv_dir = os.path.join(base_dir, 'csv')
+    out_dump_dir = os.path.join(base_dir, 'dump')
+    os.makedirs(out_csv_dir, exist_ok=True)
+    os.makedirs(out_dump_dir, exist_ok=True)
+
+    csv_path = compressed_path(os.path.join(out_csv_dir, 'orari.gestione_utenti.csv'))
+    sql_path = compressed_path(os.path.join(out_dump_dir, 'orari.gestione_utenti.sql'))
+    tsv_path = compressed_path(os.path.join(out_dump_dir, 'orari.gestione_utenti.tsv'))
+    columnar_file = columnar_path(os.path.join(out_dump_dir, 'orari.gestione_utenti')) if columnar_enabled() else None
+
+    # CSV headers as requested
+    csv_headers = ['id', 'old_id', 'nome', 'username', 'VecchiaPasswd', 'NuovaPasswd', 'ruolo', 'negozio', 'AbilitaInsOrari']
+
+    users = [user_values(r) for r in rows]
+    # omonimi nel blocco e username gia' presenti in gestione_utenti (letti da nuovi.utenti.py)
+    existing_usernames = load_usernames(os.path.join(base_dir, 'csv', 'nuovi.utenti.usernames.csv'))
+    users = resolve_usernames(users, existing_usernames, metrics)
+    # con PASSWORD_HASH ogni utente ha una password iniziale propria e il suo hash (vedi passwords.py):
+    # nei file esportati va solo l'hash, le password in chiaro solo nel file di consegna
+    handout_file = passwords.handout_path(base_dir) if passwords.hash_enabled() else None
+    if handout_file:
+        handout = passwords.load_handout(handout_file)
+        credentials = passwords.assign_credentials([u[0] for u in users], handout, metrics=metrics)
+        exported = [(None, digest) for _, digest in credentials]
+    else:
+        credentials = exported = [(passwords.DEFAULT_PASSWORD, None)] * len(users)
+    write_start = time.perf_counter()
+    # file scritti in temporaneo e pubblicati insieme; quelli invariati restano intatti (atomic_output.py)
+    with OutputSet(base_dir, 'orario.gestione_utenti') as outputs:
+        with open_text(outputs.path(csv_path, rows=len(users)), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(csv_headers)
+            csv_row = CODEC.csv_row
+            # stesse colonne di csv_headers; i None diventano campi vuoti
+            writer.writerows(
+                csv_row((None, old_id, nome, username, password, digest, 'Dipendente', negozio, None))
+                for (old_id, nome, username, negozio), (password, digest) in zip(users, exported)
+            )
+
+        with open_text(outputs.path(sql_path, rows=len(users)), 'w', encoding='utf-8') as f:
             f.write('-- Dump generato da orario.gestione_utenti.py\n')
-            for r in rows:
-                old_id = getattr(r, 'old_id') if 'old_id' in colnames else r[0]
-                nome = getattr(r, 'nome') if 'nome' in colnames else ''
-                username = getattr(r, 'username') if 'username' in colnames else ''
-                negozio = getattr(r, 'negozio') if 'negozio' in colnames else None
-
-                def sql_quote(val):
-                    if val is None:
-                        return 'NULL'
-                    s = str(val)
-                    s = s.replace("'", "''")
-                    return f"'{s}'"
-
-                id_val = 'NULL'
-                old_id_sql = sql_quote(old_id)
-                nome_sql = sql_quote(nome)
-                username_sql = sql_quote(username)
-                vecchia_sql = sql_quote('AAA123')
-                nuova_sql = 'NULL'
-                ruolo_sql = sql_quote('Dipendente')
-                negozio_sql = sql_quote(negozio) if negozio not in (None, '') else 'NULL'
-                abil_sql = 'NULL'
-
-                line = (
-                    'INSERT INTO orari.gestione_utenti '
-                    '(id, old_id, nome, username, VecchiaPasswd, NuovaPasswd, ruolo, negozio, AbilitaInsOrari) VALUES '
-                    f'({id_val}, {old_id_sql}, {nome_sql}, {username_sql}, {vecchia_sql}, {nuova_sql}, {ruolo_sql}, {negozio_sql}, {abil_sql});\n'
-                )
-                f.write(line)
+            # con MYSQL_LOAD i nuovi utenti vengono anche aggiunti direttamente alla tabella MySQL
+            remote = (
+                RemoteTableLoader('orari.gestione_utenti', LOAD_COLUMNS, sql_quote, metrics=metrics, codec=LOAD_CODEC)
+                if load_enabled() else nullcontext()
+            )
+            columnar = (
+                ColumnarWriter(outputs.path(columnar_file, rows=len(users)), COLUMNAR_FIELDS)
+                if columnar_file else nullcontext()
+            )
+            with SqlDumpWriter(f, 'orari.gestione_utenti', SQL_COLUMNS, sql_quote,
+                               tsv_path=outputs.path(tsv_path, rows=len(users)), codec=CODEC) as dump, \
+                    remote as loader, columnar as columnar_writer:
+                for (old_id, nome, username, negozio), (password, digest) in zip(users, exported):
+                    values = [
+                        None, old_id, nome, username, password, digest, 'Dipendente',
+                        negozio if negozio not in (None, '') else None, None,
+                    ]
+                    dump.write_row(values)
+                    if loader is not None:
+                        loader.write_row(values[1:])
+                    if columnar_writer is not None:
+                        columnar_writer.write_row(values)
+        if handout_file:
+            # gli utenti delle esecuzioni precedenti restano nel file finche' non vengono consegnati
+            handout = passwords.merge_handout(handout, users, credentials)
+            passwords.write_handout(outputs.path(handout_file, rows=len(handout)), handout)
+    metrics.add_time('write', time.perf_counter() - write_start)
+    metrics.count('outputs_unchanged', sum(1 for changed in outputs.changed.values() if not changed))
 
-        cur.close()
-        conn.close()
+    metrics.add_output(csv_path)
+    metrics.add_output(sql_path)
+    if dump.fmt == 'load':
+        metrics.add_output(tsv_path)
+    if columnar_file:
+        metrics.add_output(columnar_file)
+    if handout_file:
+        metrics.add_output(handout_file)
+    if stats is not None:
+        stats.save()
 
+def main():
+    try:
+        run()
         print('$$$')
     except Exception:
+        traceback.print_exc()
         print('XXX')
         sys.exit(1)
 
@@ -0,0 +1,200 @@
+"""Codec dei file esportati in dump/ e csv/.
+
+OUTPUT_COMPRESSION (none | gzip | zstd, default none): i dump .sql, i CSV e il .tsv del formato
+load vengono scritti compressi in streaming, con suffisso .gz / .zst. zstd richiede il pacchetto
+`zstandard`. Lo statement LOAD DATA nel dump cita il .tsv senza suffisso: i due file vanno
+decompressi insieme prima dell'import.
+
+OUTPUT_COLUMNAR (none | parquet | arrow, default none): oltre ai formati testuali viene scritto
+un file colonnare tipizzato accanto al dump (`.parquet`, compresso zstd, oppure `.arrow`, Arrow IPC
+non compresso e leggibile via mmap), con date vere e ore come decimali. Richiede `pyarrow`.
+
+Chi legge i file prodotti (dump_reader, orario.gestione_utenti.py, check_names.py) passa da
+`resolve_path` e `open_text`, quindi li trova qualunque sia la compressione scelta.
+"""
+import gzip
+import io
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+COLUMNAR_FORMATS = {'none': '', 'parquet': '.parquet', 'arrow': '.arrow'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# righe accumulate prima di scrivere un record batch nel file colonnare
+COLUMNAR_BATCH_ROWS = 10000
+
+_SUFFIXES = tuple(s for s in COMPRESSIONS.values() if s)
+
+
+def compression():
+    method = (os.getenv('OUTPUT_COMPRESSION') or 'none').strip().lower()
+    if method not in COMPRESSIONS:
+        raise ValueError(f"OUTPUT_COMPRESSION non valido: {method!r} (ammessi: {', '.join(COMPRESSIONS)})")
+    return method
+
+
+def columnar_format():
+    fmt = (os.getenv('OUTPUT_COLUMNAR') or 'none').strip().lower()
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"OUTPUT_COLUMNAR non valido: {fmt!r} (ammessi: {', '.join(COLUMNAR_FORMATS)})")
+    return fmt
+
+
+def columnar_enabled():
+    return columnar_format() != 'none'
+
+
+def compressed_path(path, method=None):
+    """Percorso effettivo di un file esportato, con il suffisso della compressione scelta."""
+    return path + COMPRESSIONS[method or compression()]
+
+
+def strip_compression(path):
+    for suffix in _SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def resolve_path(path):
+    """Trova il file `path` scritto con qualunque compressione; se ce n'e' piu' d'uno, il piu' recente."""
+    found = [p for p in (path + s for s in COMPRESSIONS.values()) if os.path.exists(p)]
+    if not found:
+        return path
+    return max(found, key=os.path.getmtime)
+
+
+def is_compressed(path):
+    return path.endswith(_SUFFIXES)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('OUTPUT_COMPRESSION=zstd richiede il pacchetto zstandard (pip install zstandard)') from None
+    return zstandard
+
+
+def open_binary(path, mode='rb'):
+    """Apre un file binario, comprimendo o decomprimendo in base al suffisso (.gz / .zst)."""
+    if path.endswith('.gz'):
+        # mtime=0: a parita' di contenuto il file compresso e' identico byte per byte (atomic_output)
+        return gzip.GzipFile(path, mode, compresslevel=GZIP_LEVEL, mtime=0)
+    if path.endswith('.zst'):
+        zstd = _zstandard()
+        if 'w' in mode:
+            return zstd.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'))
+        return io.BufferedReader(zstd.ZstdDecompressor().stream_reader(open(path, 'rb')))
+    return open(path, mode)
+
+
+def open_text(path, mode='r', encoding='utf-8', newline=None):
+    """Come `open` per i file di testo, ma con compressione in streaming se il suffisso la prevede."""
+    if not is_compressed(path):
+        return open(path, mode, encoding=encoding, newline=newline)
+    return io.TextIOWrapper(open_binary(path, mode + 'b'), encoding=encoding, newline=newline)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError('OUTPUT_COLUMNAR richiede il pacchetto pyarrow (pip install pyarrow)') from None
+    return pyarrow
+
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+def _to_int(value):
+    return None if value is None or value == '' else int(value)
+
+
+_CENTS = Decimal('0.01')
+
+
+def _to_decimal(value):
+    if value is None or value == '':
+        return None
+    return Decimal(str(value)).quantize(_CENTS)
+
+
+def _to_date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# tipo logico delle colonne -> (tipo Arrow, conversione del valore letto dal cursore)
+_KINDS = {
+    'string': (lambda pa: pa.string(), _to_str),
+    'int': (lambda pa: pa.int64(), _to_int),
+    'decimal': (lambda pa: pa.decimal128(9, 2), _to_decimal),
+    'date': (lambda pa: pa.date32(), _to_date),
+}
+
+
+class ColumnarWriter:
+    """Scrive le righe in un file Parquet o Arrow IPC tipizzato, a blocchi di COLUMNAR_BATCH_ROWS righe.
+
+    `fields` e' una lista di (colonna, tipo) con tipo tra string, int, decimal, date.
+    """
+
+    def __init__(self, path, fields, fmt=None, batch_rows=COLUMNAR_BATCH_ROWS):
+        pa = self._pa = _pyarrow()
+        self.fmt = fmt or columnar_format()
+        self.path = path
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self._types = [_KINDS[kind][0](pa) for _, kind in fields]
+        self._convert = [_KINDS[kind][1] for _, kind in fields]
+        self.schema = pa.schema([(name, t) for (name, _), t in zip(fields, self._types)])
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        elif self.fmt == 'arrow':
+            self._writer = pa.ipc.new_file(path, self.schema)
+        else:
+            raise ValueError(f"formato colonnare non valido: {self.fmt!r}")
+        self._columns = [[] for _ in fields]
+
+    def write_row(self, values):
+        for column, convert, value in zip(self._columns, self._convert, values):
+            column.append(convert(value))
+        self.rows += 1
+        if len(self._columns[0]) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns[0]:
+            return
+        pa = self._pa
+        arrays = [pa.array(column, type=t) for column, t in zip(self._columns, self._types)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._columns = [[] for _ in self._columns]
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._flush()
+        self._writer.close()
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def columnar_path(path_without_suffix, fmt=None):
+    return path_without_suffix + COLUMNAR_FORMATS[fmt or columnar_format()]
@@ -0,0 +1,212 @@
+"""Password iniziali dei nuovi utenti e loro hash, calcolati in blocco su un pool di processi.
+
+PASSWORD_HASH (none | scrypt | bcrypt, default none):
+- none: come prima, tutti i nuovi utenti hanno `VecchiaPasswd` 'AAA123' e `NuovaPasswd` NULL
+- scrypt / bcrypt: ogni utente riceve una password iniziale casuale; nei file esportati e nel
+  caricamento MySQL va solo il suo hash con sale (`NuovaPasswd`, `VecchiaPasswd` resta NULL),
+  cosi' l'applicazione web non deve calcolarlo al primo accesso. bcrypt richiede il pacchetto
+  `bcrypt`.
+
+Le password in chiaro, da comunicare agli utenti, finiscono solo nel file di consegna
+`credenziali/orari.gestione_utenti.csv` (old_id, nome, username, password, hash; permessi 0600),
+che non va importato. All'esecuzione successiva un utente gia' presente nel file di consegna
+mantiene password e hash (se l'hash usa ancora algoritmo e costo correnti): le uscite restano
+identiche e non risultano cambiate nel manifest. Il file accumula gli utenti di tutte le
+esecuzioni: chi non e' piu' tra i nuovi utenti resta nel file con le sue credenziali, finche' la
+password non e' stata consegnata e la riga tolta a mano.
+
+Gli hash sono lenti per costruzione: vengono calcolati su PASSWORD_WORKERS processi (default:
+numero di CPU). PASSWORD_COST regola il costo: log2 di N per scrypt (default 15, 32 MB per
+hash), rounds per bcrypt (default 12).
+
+Formati:
+- scrypt: `$scrypt$ln=15,r=8,p=1$<sale>$<hash>`, esattamente il formato di `passlib.hash.scrypt`
+  (sale di 16 byte e hash di 32 byte in base64 standard senza padding, come b64s_encode di
+  passlib): lo verifica un'applicazione web che usa passlib. password_verify di PHP non legge
+  scrypt: per un'applicazione PHP serve un verificatore dedicato
+- bcrypt: `$2b$12$...`, verificabile con password_verify di PHP e con passlib: e' l'algoritmo
+  consigliato se l'applicazione web non usa passlib
+"""
+import base64
+import csv
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ALGORITHMS = ('none', 'scrypt', 'bcrypt')
+HANDOUT_DIR = 'credenziali'
+HANDOUT_COLUMNS = ['old_id', 'nome', 'username', 'password', 'hash']
+DEFAULT_PASSWORD = 'AAA123'
+PASSWORD_LENGTH = 10
+# senza i caratteri che si confondono (0/O, 1/l/I)
+ALPHABET = 'abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+DEFAULT_COST = {'scrypt': 15, 'bcrypt': 12}
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def hash_algorithm():
+    algorithm = (os.getenv('PASSWORD_HASH') or 'none').strip().lower()
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"PASSWORD_HASH non valido: {algorithm!r} (ammessi: {', '.join(ALGORITHMS)})")
+    return algorithm
+
+
+def hash_enabled():
+    return hash_algorithm() != 'none'
+
+
+def hash_cost(algorithm):
+    return int(os.getenv('PASSWORD_COST') or DEFAULT_COST[algorithm])
+
+
+def hash_workers():
+    return int(os.getenv('PASSWORD_WORKERS') or 0) or os.cpu_count() or 1
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(ALPHABET) for _ in range(length))
+
+
+def _b64(data):
+    # b64s_encode di passlib: alfabeto standard, senza padding
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password, salt, ln):
+    n = 1 << ln
+    # memoria richiesta: 128 * r * N byte, piu' margine
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P,
+                          maxmem=256 * SCRYPT_R * n, dklen=KEY_BYTES)
+
+
+def _bcrypt():
+    try:
+        import bcrypt
+    except ImportError:
+        raise RuntimeError('PASSWORD_HASH=bcrypt richiede il pacchetto bcrypt (pip install bcrypt)') from None
+    return bcrypt
+
+
+def hash_password(password, algorithm, cost):
+    """Hash con sale casuale di `password` nel formato dell'algoritmo."""
+    if algorithm == 'scrypt':
+        salt = secrets.token_bytes(SALT_BYTES)
+        return f"$scrypt$ln={cost},r={SCRYPT_R},p={SCRYPT_P}${_b64(salt)}${_b64(_scrypt(password, salt, cost))}"
+    if algorithm == 'bcrypt':
+        bcrypt = _bcrypt()
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=cost)).decode('ascii')
+    raise ValueError(f"algoritmo di hash non valido: {algorithm!r}")
+
+
+def digest_matches(digest, algorithm, cost):
+    """True se `digest` e' stato calcolato con `algorithm` e `cost`."""
+    if algorithm == 'scrypt':
+        return digest.startswith(f"$scrypt$ln={cost},r={SCRYPT_R},p={SCRYPT_P}$")
+    if algorithm == 'bcrypt':
+        return digest.startswith(f"$2b${cost:02d}$")
+    return False
+
+
+def verify_password(password, digest):
+    if digest.startswith('$scrypt$'):
+        _, _, params, salt, key = digest.split('$')
+        ln = int(dict(p.split('=') for p in params.split(','))['ln'])
+        return hmac.compare_digest(_scrypt(password, _unb64(salt), ln), _unb64(key))
+    return _bcrypt().checkpw(password.encode('utf-8'), digest.encode('ascii'))
+
+
+def _hash_chunk(passwords, algorithm, cost):
+    return [hash_password(p, algorithm, cost) for p in passwords]
+
+
+def hash_passwords(passwords, algorithm=None, workers=None, metrics=None):
+    """Hash di tutte le `passwords`, nello stesso ordine, su `workers` processi.
+
+    Con `metrics` registra il tempo (`hash`), il numero di hash e gli hash al secondo.
+    """
+    algorithm = algorithm or hash_algorithm()
+    cost = hash_cost(algorithm)
+    workers = min(workers or hash_workers(), max(len(passwords), 1))
+    start = time.perf_counter()
+    if workers > 1:
+        # blocchi piccoli: ogni hash costa decine di millisecondi, il carico resta bilanciato
+        size = max(1, len(passwords) // (workers * 8))
+        chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            digests = [d for part in pool.map(_hash_chunk, chunks, [algorithm] * len(chunks), [cost] * len(chunks))
+                       for d in part]
+    else:
+        digests = _hash_chunk(passwords, algorithm, cost)
+    elapsed = time.perf_counter() - start
+    if metrics is not None:
+        metrics.add_time('hash', elapsed)
+        metrics.count('password_hashes', len(digests))
+        if digests and elapsed > 0:
+            metrics.set_counter('hashes_per_s', round(len(digests) / elapsed, 1))
+    return digests
+
+
+def handout_path(base_dir):
+    return os.path.join(base_dir, HANDOUT_DIR, 'orari.gestione_utenti.csv')
+
+
+def load_handout(path):
+    """{old_id: riga (dict con HANDOUT_COLUMNS)} dal file di consegna precedente (vuoto se manca)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='', encoding='utf-8') as f:
+        return {row['old_id']: row for row in csv.DictReader(f)}
+
+
+def merge_handout(previous, users, credentials):
+    """Righe del nuovo file di consegna: quelle di `previous`, aggiornate e completate con `users`."""
+    rows = dict(previous)
+    for (old_id, nome, username, _), (password, digest) in zip(users, credentials):
+        rows[str(old_id)] = dict(zip(HANDOUT_COLUMNS, (str(old_id), nome, username, password, digest)))
+    return list(rows.values())
+
+
+def write_handout(path, rows):
+    """Scrive il file di consegna con le righe di `merge_handout`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # solo il proprietario puo' leggere le password in chiaro
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, HANDOUT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def assign_credentials(old_ids, previous, algorithm=None, workers=None, metrics=None):
+    """(password, hash) per ogni codice: ripresi da `previous` se validi, altrimenti nuovi.
+
+    `previous` e' il risultato di `load_handout`; solo le password nuove vengono calcolate
+    (con `hash_passwords`). Con `metrics` conta anche le password riprese.
+    """
+    algorithm = algorithm or hash_algorithm()
+    cost = hash_cost(algorithm)
+    credentials = []
+    missing = []
+    for old_id in old_ids:
+        kept = previous.get(str(old_id))
+        if kept and kept['password'] and digest_matches(kept['hash'], algorithm, cost):
+            credentials.append((kept['password'], kept['hash']))
+        else:
+            missing.append(len(credentials))
+            credentials.append(None)
+    initial = [generate_password() for _ in missing]
+    for i, password, digest in zip(missing, initial, hash_passwords(initial, algorithm, workers, metrics)):
+        credentials[i] = (password, digest)
+    if metrics is not None:
+        metrics.count('passwords_reused', len(credentials) - len(missing))
+    return credentials
@@ -0,0 +1,252 @@
+"""Modalita' diagnostica delle query di estrazione (QUERY_STATS=1).
+
+Ogni query misurata viene eseguita con `SET STATISTICS IO, TIME ON` e `SET STATISTICS XML ON`:
+- i messaggi informativi del server (letture per tabella, CPU e tempo trascorso lato server)
+  vengono letti da `cursor.messages` dopo l'execute e dopo ogni `nextset`
+- il piano di esecuzione effettivo arriva come result set aggiuntivo dopo le righe e viene salvato
+  in `report/plans/<fase>/<query>.sqlplan` (si apre con SSMS o Azure Data Studio)
+- accanto ai numeri del server vengono registrati i tempi lato client (execute e lettura delle
+  righe): la differenza tra il totale client e l'elapsed del server e' il tempo speso sulla rete e
+  in Python. Con la lettura a blocchi l'elapsed del server comprende anche le attese sul client
+  (ASYNC_NETWORK_IO), quindi va confrontato soprattutto con la CPU.
+
+Il riepilogo va in `report/query_stats.<fase>.json`, nella cartella del report di main.py.
+Prima di sovrascriverlo viene confrontato con quello dell'esecuzione precedente: le metriche
+cresciute oltre QUERY_STATS_THRESHOLD (default 0.5 = +50%) e oltre una soglia assoluta minima
+sono elencate in `regressions`, segnalate su stderr e contate in `query_regressions`.
+
+Con AUTO_BACKEND=local le statistiche del server non esistono: si registrano i tempi client e il
+piano di SQLite (EXPLAIN QUERY PLAN, in `.txt`).
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import backends
+from metrics import report_path
+
+# metriche confrontate tra esecuzioni -> aumento assoluto minimo per considerarle una regressione
+REGRESSION_MIN_DELTA = {
+    'server_cpu_ms': 50,
+    'server_elapsed_ms': 50,
+    'logical_reads': 1000,
+    'physical_reads': 100,
+    'client_total_s': 0.05,
+}
+
+_PREFIX_RE = re.compile(r"^(\[[^\]]*\])+")
+_IO_RE = re.compile(r"Table '([^']+)'\.\s*(.*)", re.S)
+_TIME_RE = re.compile(
+    r"(parse and compile time|Execution Times).*?CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", re.S | re.I)
+# le tabelle temporanee compaiono come #nome____...000000000012
+_TEMP_SUFFIX_RE = re.compile(r"_{3,}[0-9A-F]*$")
+_UNSAFE_RE = re.compile(r"[^\w.-]+")
+
+
+def stats_enabled():
+    return os.getenv('QUERY_STATS', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def regression_threshold():
+    return float(os.getenv('QUERY_STATS_THRESHOLD') or 0.5)
+
+
+def parse_messages(messages):
+    """Dai messaggi di STATISTICS IO/TIME: ({tabella: {contatore: valore}}, compile, execution).
+
+    compile ed execution sono (cpu_ms, elapsed_ms) sommati su tutti i messaggi.
+    """
+    tables = {}
+    compile_ms = [0, 0]
+    exec_ms = [0, 0]
+    for message in messages:
+        text = message[1] if isinstance(message, (tuple, list)) else str(message)
+        text = _PREFIX_RE.sub('', text).strip()
+        io = _IO_RE.match(text)
+        if io:
+            table = _TEMP_SUFFIX_RE.sub('', io.group(1))
+            counters = tables.setdefault(table, {})
+            for part in io.group(2).rstrip('.').split(','):
+                name, _, value = part.strip().rpartition(' ')
+                if name and value.isdigit():
+                    key = name.lower().replace(' ', '_').replace('-', '_')
+                    counters[key] = counters.get(key, 0) + int(value)
+            continue
+        for kind, cpu, elapsed in _TIME_RE.findall(text):
+            target = exec_ms if kind.lower().startswith('execution') else compile_ms
+            target[0] += int(cpu)
+            target[1] += int(elapsed)
+    return tables, tuple(compile_ms), tuple(exec_ms)
+
+
+def _messages(cur):
+    # cursor.messages (pyodbc >= 4.0.31) contiene i messaggi dell'ultima execute/nextset
+    return list(getattr(cur, 'messages', None) or [])
+
+
+class QueryCapture:
+    """Una query misurata: creata da `QueryStats.execute`, chiusa con `finish` dopo aver letto le righe."""
+
+    def __init__(self, stats, cur, label, sql, params):
+        self.stats = stats
+        self.cur = cur
+        self.label = label
+        self.local = backends.is_local()
+        self.messages = []
+        self.plans = []
+        if self.local:
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, *params)
+            self.plans.append('\n'.join(' '.join(str(v) for v in row) for row in cur.fetchall()))
+        else:
+            cur.execute('SET STATISTICS IO, TIME ON')
+            cur.execute('SET STATISTICS XML ON')
+        self._start = time.perf_counter()
+        cur.execute(sql, *params)
+        self._executed = time.perf_counter()
+        self.messages += _messages(cur)
+
+    def finish(self, rows=None):
+        """Chiude la misura dopo l'ultima riga: legge i result set rimasti (il piano) e i messaggi."""
+        fetched = time.perf_counter()
+        cur = self.cur
+        if not self.local:
+            while cur.nextset():
+                self.messages += _messages(cur)
+                if cur.description and 'showplan' in str(cur.description[0][0]).lower():
+                    self.plans += [r[0] for r in cur.fetchall()]
+                elif cur.description:
+                    cur.fetchall()
+            cur.execute('SET STATISTICS XML OFF')
+            cur.execute('SET STATISTICS IO, TIME OFF')
+        tables, compile_ms, exec_ms = parse_messages(self.messages)
+        entry = {
+            'query': self.label,
+            'rows': rows,
+            'client_execute_s': self._executed - self._start,
+            'client_fetch_s': fetched - self._executed,
+            'client_total_s': fetched - self._start,
+            'tables': tables,
+            'logical_reads': sum(t.get('logical_reads', 0) for t in tables.values()),
+            'physical_reads': sum(t.get('physical_reads', 0) for t in tables.values()),
+            'plan_files': [],
+        }
+        if not self.local:
+            entry.update({
+                'server_compile_cpu_ms': compile_ms[0],
+                'server_compile_elapsed_ms': compile_ms[1],
+                'server_cpu_ms': exec_ms[0],
+                'server_elapsed_ms': exec_ms[1],
+                # rete + Python: quello che resta del tempo client tolto il tempo del server
+                'client_minus_server_s': entry['client_total_s'] - (compile_ms[1] + exec_ms[1]) / 1000,
+                'messages': [_PREFIX_RE.sub('', m[1] if isinstance(m, (tuple, list)) else str(m)).strip()
+                             for m in self.messages],
+            })
+        self.stats.add(entry, self.plans)
+        return entry
+
+
+class QueryStats:
+    """Raccoglie le query misurate di una fase e le salva con `save` a fine estrazione."""
+
+    def __init__(self, stage, metrics=None):
+        self.stage = stage
+        self.metrics = metrics
+        self.queries = []
+        self._plans = {}
+        # le partizioni di orario.dipendenti chiudono le proprie misure da thread diversi
+        self._lock = threading.Lock()
+
+    def execute(self, cur, label, sql, *params):
+        return QueryCapture(self, cur, label, sql, params)
+
+    def add(self, entry, plans):
+        with self._lock:
+            self.queries.append(entry)
+            self._plans[entry['query']] = plans
+            if self.metrics is not None and 'server_elapsed_ms' in entry:
+                self.metrics.add_time('server_cpu', entry['server_cpu_ms'] / 1000)
+                self.metrics.add_time('server_elapsed', entry['server_elapsed_ms'] / 1000)
+
+    def save(self, report_dir=None):
+        """Scrive riepilogo e piani, confronta con l'esecuzione precedente; restituisce le regressioni."""
+        report_dir = report_dir or os.path.dirname(report_path())
+        path = os.path.join(report_dir, f'query_stats.{self.stage}.json')
+        previous = _load(path)
+        plans_dir = os.path.join(report_dir, 'plans', self.stage)
+        os.makedirs(plans_dir, exist_ok=True)
+        queries = sorted(self.queries, key=lambda q: q['query'])
+        for entry in queries:
+            suffix = '.txt' if backends.is_local() else '.sqlplan'
+            for i, plan in enumerate(self._plans.get(entry['query']) or []):
+                name = _UNSAFE_RE.sub('_', entry['query']) + (f'.{i + 1}' if i else '') + suffix
+                _write_text(os.path.join(plans_dir, name), plan)
+                entry['plan_files'].append(os.path.join('plans', self.stage, name))
+        regressions = find_regressions(previous, queries, regression_threshold())
+        report = {
+            'stage': self.stage,
+            'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'backend': backends.backend_name(),
+            'queries': queries,
+            'previous_generated_at': (previous or {}).get('generated_at'),
+            'regressions': regressions,
+        }
+        _write_text(path, json.dumps(report, indent=2))
+        for r in regressions:
+            print(f"ATTENZIONE {self.stage}: query {r['query']!r}, {r['metric']} da {r['previous']} "
+                  f"a {r['current']} (x{r['ratio']})", file=sys.stderr)
+        if self.metrics is not None:
+            self.metrics.count('query_regressions', len(regressions))
+        return regressions
+
+
+def find_regressions(previous, queries, threshold):
+    """Metriche cresciute di oltre `threshold` (relativo) e REGRESSION_MIN_DELTA (assoluto) per query."""
+    if not previous:
+        return []
+    before = {q['query']: q for q in previous.get('queries', [])}
+    regressions = []
+    for entry in queries:
+        old = before.get(entry['query'])
+        if old is None:
+            continue
+        for metric, min_delta in REGRESSION_MIN_DELTA.items():
+            prev, cur = old.get(metric), entry.get(metric)
+            if prev is None or cur is None or cur - prev < min_delta:
+                continue
+            if prev == 0 or cur > prev * (1 + threshold):
+                regressions.append({
+                    'query': entry['query'],
+                    'metric': metric,
+                    'previous': prev,
+                    'current': cur,
+                    'ratio': round(cur / prev, 2) if prev else None,
+                })
+    return regressions
+
+
+def _load(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_text(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def execute_query(cur, sql, *params, stats=None, label=None):
+    """`cur.execute(sql, *params)`; con `stats` la query viene misurata e si restituisce la cattura
+    da chiudere con `finish` dopo aver letto le righe, altrimenti None."""
+    if stats is None:
+        cur.execute(sql, *params)
+        return None
+    return stats.execute(cur, label, sql, *params)
@@ -0,0 +1,57 @@
+"""Sonde leggere sulle sorgenti: dicono se i dati sono cambiati senza leggerli.
+
+- MSSQL: per Tk_TabDipendenti, tk_Tab_DettDip e Tk_Tab_LivContDip il numero di righe da
+  sys.dm_db_partition_stats e l'ultima scrittura (INSERT/UPDATE/DELETE) da
+  sys.dm_db_index_usage_stats. Sono metadati: nessuna tabella viene letta. Richiede i permessi
+  VIEW DATABASE STATE e VIEW SERVER STATE. L'ultima scrittura si azzera al riavvio del server:
+  la firma cambia e si esegue una volta in piu', senza perdere modifiche.
+  Con AUTO_BACKEND=local: numero di righe e rowid massimo.
+- MySQL remoto: numero di righe e id massimo di gestione_utenti, via SSH
+
+Usate dal demone (daemon.py) per decidere se rieseguire la pipeline e dalla cache delle fasi
+(stage_cache.py) come impronta delle sorgenti.
+"""
+import backends
+import mssql
+from ssh_session import mysql_command
+
+PROBE_TABLES = ('Tk_TabDipendenti', 'tk_Tab_DettDip', 'Tk_Tab_LivContDip')
+# una sola query sui metadati per tutte le tabelle; last_user_update vede anche gli UPDATE
+LIVE_PROBE = """
+SELECT
+    o.name,
+    (SELECT SUM(ps.row_count) FROM sys.dm_db_partition_stats AS ps
+      WHERE ps.object_id = o.object_id AND ps.index_id IN (0, 1)),
+    (SELECT MAX(us.last_user_update) FROM sys.dm_db_index_usage_stats AS us
+      WHERE us.database_id = DB_ID() AND us.object_id = o.object_id)
+FROM sys.objects AS o
+WHERE o.type = 'U' AND o.name IN ({tables})
+"""
+LOCAL_PROBE = "SELECT COUNT(*), MAX(rowid) FROM {table}"
+MYSQL_PROBE = "SELECT COUNT(*), MAX(id) FROM gestione_utenti;"
+
+
+def probe_mssql():
+    """{tabella: [righe, ultima modifica]} delle tabelle sorgente MSSQL."""
+    signature = {}
+    with mssql.connection() as conn:
+        cur = conn.cursor()
+        if backends.is_local():
+            for table in PROBE_TABLES:
+                cur.execute(LOCAL_PROBE.format(table=table))
+                signature[table] = [str(v) for v in cur.fetchone()]
+        else:
+            cur.execute(LIVE_PROBE.format(tables=', '.join('?' * len(PROBE_TABLES))), *PROBE_TABLES)
+            # chiavi nell'ordine di PROBE_TABLES, qualunque sia la collation dei nomi
+            found = {name.lower(): [str(rows), str(updated)] for name, rows, updated in cur.fetchall()}
+            signature = {table: found.get(table.lower()) for table in PROBE_TABLES}
+        cur.close()
+    return signature
+
+
+def probe_mysql(ssh, cfg):
+    """Righe e id massimo di gestione_utenti (testo separato da tab).
+
+    `ssh` e' una sessione aperta, `cfg` i parametri di mysql_load.settings().
+    """
+    return ssh.run(mysql_command(cfg['db_user'], cfg['db_password'], MYSQL_PROBE, cfg['db_name'])).strip()
@@ -0,0 +1,117 @@
+"""Snapshot di Tk_TabDipendenti condiviso dalle due fasi MSSQL, per leggere la tabella una volta sola.
+
+La query di orario.dipendenti.py porta anche Nome e Cognome: le colonne che servono a
+orario.gestione_utenti.py (Codice, Nome, Cognome, RifCommPref) vengono raccolte durante
+l'estrazione in una `SourceSnapshot`, una lista per colonna con l'indice Codice -> posizione.
+
+orario.gestione_utenti.py usa le righe nell'ordine di `ORDER BY Codice` sul server (gli username
+degli omonimi dipendono dall'ordine), che segue la collation della colonna e non l'ordinamento
+delle stringhe Python (maiuscole/minuscole, accenti, codici numerici di lunghezza diversa). Per
+questo la query porta anche la posizione di ogni Codice in `ORDER BY Codice` calcolata dal server
+sull'intera tabella, e `rows` ordina per quella.
+
+Lo snapshot e' legato al dump dei dipendenti da cui deriva:
+- `publish` lo rende disponibile in memoria alla fase successiva dello stesso processo (main.py)
+- `save` lo scrive accanto al dump in `<dump>.source` (TSV con la stessa intestazione
+  dell'indice dei codici, posizione in ultima colonna), per chi esegue gli script separatamente
+
+`load(dump)` lo restituisce solo se corrisponde ancora al dump (e ha le posizioni), altrimenti
+None e orario.gestione_utenti.py interroga il server come prima.
+"""
+import os
+
+from code_index import dump_stamp, stamp_header, stamp_matches
+from dump_reader import tsv_unescape
+from column_codecs import tsv_value
+
+SUFFIX = '.source'
+COLUMNS = ('Codice', 'Nome', 'Cognome', 'RifCommPref')
+
+# snapshot pubblicati nel processo: percorso del dump -> (impronta del dump, snapshot)
+_published = {}
+
+
+class SourceSnapshot:
+    """Righe (Codice, Nome, Cognome, RifCommPref) in colonne, con l'indice per Codice.
+
+    `order` contiene, per ogni riga, la posizione del Codice in `ORDER BY Codice` sul server.
+    """
+
+    def __init__(self):
+        self.columns = tuple([] for _ in COLUMNS)
+        self.order = []
+        self.index = {}
+
+    def add(self, values, position):
+        """Aggiunge (o sostituisce, a parita' di Codice) una riga nell'ordine di COLUMNS."""
+        code = str(values[0])
+        pos = self.index.get(code)
+        if pos is None:
+            self.index[code] = len(self.columns[0])
+            for column, value in zip(self.columns, values):
+                column.append(value)
+            self.order.append(int(position))
+        else:
+            for column, value in zip(self.columns, values):
+                column[pos] = value
+            self.order[pos] = int(position)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, code):
+        return str(code) in self.index
+
+    def positions(self, exclude=()):
+        """Posizioni delle righe nell'ordine di `ORDER BY Codice`, tranne quelle con il codice in `exclude`."""
+        order = self.order
+        return sorted((pos for code, pos in self.index.items() if code not in exclude), key=order.__getitem__)
+
+    def rows(self, exclude=()):
+        """Righe nell'ordine di `ORDER BY Codice` sul server, tranne quelle con il codice in `exclude`."""
+        columns = self.columns
+        return [tuple(column[pos] for column in columns) for pos in self.positions(exclude)]
+
+
+def snapshot_path(dump_path):
+    return dump_path + SUFFIX
+
+
+def save(dump_path, snapshot, path=None, stamp=None):
+    """Scrive lo snapshot per il dump (gia' pubblicato) `dump_path`; `path` come in `write_index`."""
+    stamp = stamp or dump_stamp(dump_path)
+    path = path or snapshot_path(dump_path)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        f.write(stamp_header(stamp))
+        columns = snapshot.columns
+        for pos in snapshot.positions():
+            f.write('\t'.join(tsv_value(column[pos]) for column in columns) + f"\t{snapshot.order[pos]}\n")
+    os.replace(tmp, path)
+    return path
+
+
+def publish(dump_path, snapshot, stamp=None):
+    """Rende lo snapshot disponibile alle fasi successive dello stesso processo."""
+    _published[os.path.abspath(dump_path)] = (stamp_header(stamp or dump_stamp(dump_path)), snapshot)
+
+
+def load(dump_path):
+    """Snapshot corrispondente al dump `dump_path`: dalla memoria, oppure dal file accanto al dump."""
+    published = _published.get(os.path.abspath(dump_path))
+    if published is not None and stamp_matches(published[0], dump_path):
+        return published[1]
+    path = snapshot_path(dump_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        if not stamp_matches(f.readline(), dump_path):
+            return None
+        snapshot = SourceSnapshot()
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != len(COLUMNS) + 1:
+                # file scritto prima delle posizioni: l'ordine del server non e' noto
+                return None
+            snapshot.add([tsv_unescape(v) for v in fields[:-1]], fields[-1])
+    return snapshot
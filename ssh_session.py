@@ -0,0 +1,212 @@
+"""Sessione SSH riutilizzabile per i comandi remoti (mysql) degli script.
+
+`SshSession` apre una sola connessione master (ControlMaster di OpenSSH) e fa passare tutti i
+comandi successivi sullo stesso socket, senza ripetere l'handshake. Su Windows, dove OpenSSH
+non supporta ControlMaster, ogni comando apre una propria connessione con le stesse opzioni.
+
+Nello stesso processo tutte le sessioni verso lo stesso user@host:porta condividono un solo
+master (stesso ControlPath), con un conteggio delle sessioni aperte protetto da un lock: le fasi
+che girano in parallelo (nuovi.utenti.py e il caricamento MYSQL_LOAD di orario.dipendenti.py) non
+avviano due master e il master viene chiuso solo quando si chiude l'ultima sessione che lo usa.
+Se il master e' di un altro processo (ad esempio il demone di main.py) viene riusato senza
+chiuderlo all'uscita.
+
+    with SshSession(host, port, user) as ssh:
+        with ssh.stream(mysql_command(...)) as lines:
+            for line in lines:
+                ...
+"""
+import hashlib
+import io
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+CONNECT_TIMEOUT = 15
+CONTROL_PERSIST = '60'
+
+# ControlPath -> [sessioni aperte che lo usano, True se il master e' stato avviato da questo processo]
+_masters = {}
+_masters_lock = threading.Lock()
+
+
+def mysql_command(db_user, db_password, query=None, database=None, local_infile=False):
+    """Comando `mysql -B -N` (output tab-separated, senza intestazioni) da eseguire sul server remoto.
+
+    Senza `query` mysql esegue lo script che riceve sullo stdin (vedi `SshSession.pipe`).
+    """
+    cmd = 'mysql --local-infile=1' if local_infile else 'mysql'
+    cmd += f" -u{shlex.quote(db_user)} -p{shlex.quote(db_password or '')}"
+    if database:
+        cmd += f" -D {shlex.quote(database)}"
+    cmd += " -B -N"
+    if query is not None:
+        cmd += f" -e {shlex.quote(query)}"
+    return cmd
+
+
+class SshSession:
+
+    def __init__(self, host, port, user, connect_timeout=CONNECT_TIMEOUT, persist=CONTROL_PERSIST):
+        self.host = host
+        self.port = str(port or '22')
+        self.user = user
+        self.connect_timeout = connect_timeout
+        # secondi di inattivita' dopo cui il master si chiude da solo ('yes' = mai, lo chiude close())
+        self.persist = str(persist)
+        self.multiplex = os.name != 'nt'
+        key = hashlib.sha1(f"{user}@{host}:{self.port}".encode('utf-8')).hexdigest()[:12]
+        # i socket unix hanno un limite di ~100 caratteri: percorso corto nella tmp di sistema
+        self.control_path = os.path.join(tempfile.gettempdir(), f"auto-ssh-{key}")
+        self._attached = False
+
+    def _options(self, master=False):
+        opts = [
+            '-o', 'BatchMode=yes',
+            '-o', f'ConnectTimeout={self.connect_timeout}',
+            '-p', self.port,
+        ]
+        if self.multiplex:
+            opts += ['-o', f'ControlPath={self.control_path}']
+            if master:
+                opts += ['-o', 'ControlMaster=yes', '-o', f'ControlPersist={self.persist}']
+            else:
+                # se il master non c'e' (o e' scaduto) ssh si connette direttamente
+                opts += ['-o', 'ControlMaster=no']
+        return opts
+
+    def command(self, remote_cmd):
+        return ['ssh', *self._options(), f"{self.user}@{self.host}", remote_cmd]
+
+    def is_alive(self):
+        """True se sul ControlPath risponde un master (di questa sessione o di un altro processo)."""
+        if not self.multiplex:
+            return False
+        return subprocess.run(
+            ['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'check', f"{self.user}@{self.host}"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ).returncode == 0
+
+    def open(self):
+        """Avvia il master in background; i comandi successivi passano dal suo socket.
+
+        Se un master e' gia' attivo lo riusa; se e' caduto lo riavvia. Il lock impedisce che due
+        sessioni aperte insieme avviino ognuna il proprio master sullo stesso ControlPath.
+        """
+        if not self.multiplex:
+            return self
+        with _masters_lock:
+            master = _masters.setdefault(self.control_path, [0, False])
+            if not self._attached:
+                master[0] += 1
+                self._attached = True
+            if self.is_alive():
+                return self
+            try:
+                subprocess.run(
+                    ['ssh', *self._options(master=True), '-N', '-f', f"{self.user}@{self.host}"],
+                    check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                )
+            except BaseException:
+                self._detach(master)
+                raise
+            master[1] = True
+        return self
+
+    def _detach(self, master):
+        """Toglie la sessione dal conteggio; True se era l'ultima (da chiamare con il lock)."""
+        self._attached = False
+        master[0] -= 1
+        if master[0]:
+            return False
+        del _masters[self.control_path]
+        return True
+
+    def close(self):
+        """Chiude la sessione; il master avviato da questo processo si chiude con l'ultima."""
+        if not self._attached:
+            return
+        with _masters_lock:
+            master = _masters[self.control_path]
+            if not self._detach(master) or not master[1]:
+                return
+            subprocess.run(
+                ['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'exit', f"{self.user}@{self.host}"],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def run(self, remote_cmd):
+        """Esegue il comando e restituisce lo stdout completo (per risultati piccoli)."""
+        proc = subprocess.run(
+            self.command(remote_cmd), check=True, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        return proc.stdout
+
+    @contextmanager
+    def stream(self, remote_cmd):
+        """Restituisce un iteratore sulle righe dello stdout remoto, lette man mano che arrivano.
+
+        All'uscita dal blocco, se il comando e' fallito solleva CalledProcessError con lo stderr.
+        """
+        cmd = self.command(remote_cmd)
+        with tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=err,
+                text=True, encoding='utf-8',
+            )
+            try:
+                yield proc.stdout
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.stdout.close()
+                rc = proc.wait()
+            if rc != 0:
+                err.seek(0)
+                stderr = err.read().decode('utf-8', errors='replace')
+                raise subprocess.CalledProcessError(rc, cmd, stderr=stderr)
+
+    @contextmanager
+    def pipe(self, remote_cmd):
+        """Restituisce un file di testo collegato allo stdin del comando remoto.
+
+        All'uscita dal blocco lo stdin viene chiuso e si attende la fine del comando
+        (CalledProcessError con lo stderr se fallisce). Se il blocco termina con un'eccezione
+        il processo viene terminato: il comando remoto riceve la fine dello stdin a meta'.
+        """
+        cmd = self.command(remote_cmd)
+        with tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+            stdin = io.TextIOWrapper(proc.stdin, encoding='utf-8', newline='\n')
+            broken = False
+            try:
+                yield stdin
+                stdin.close()
+            except BrokenPipeError:
+                # il comando remoto e' terminato prima di leggere tutto: conta il suo errore
+                broken = True
+            except BaseException:
+                proc.kill()
+                try:
+                    stdin.close()
+                except OSError:
+                    pass
+                proc.wait()
+                raise
+            rc = proc.wait()
+            if rc != 0 or broken:
+                err.seek(0)
+                stderr = err.read().decode('utf-8', errors='replace')
+                raise subprocess.CalledProcessError(rc or 1, cmd, stderr=stderr)
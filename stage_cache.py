@@ -0,0 +1,180 @@
+"""Cache dei risultati delle fasi di main.py, per riprendere un'esecuzione con `--resume`.
+
+Dopo ogni fase riuscita main.py registra in `report/stage_cache.json` (o STAGE_CACHE) l'impronta
+dei suoi ingressi e lo sha256 dei file prodotti. Gli ingressi di una fase sono:
+- le variabili d'ambiente che influenzano l'estrazione (prefissi in ENV_PREFIXES)
+- il codice: gli script .py della cartella (la fase e i moduli condivisi)
+- le sorgenti che legge, con le sonde di source_probe.py (metadati delle tabelle MSSQL,
+  gestione_utenti sul MySQL remoto), interrogate una volta all'inizio di ogni esecuzione
+- lo sha256 dei file prodotti dalle fasi da cui dipende
+
+Con `python main.py --resume` una fase non viene rieseguita se ha un risultato in cache con gli
+stessi ingressi, registrato da meno di STAGE_CACHE_TTL secondi (default 3600; 0 = nessuna
+scadenza) e con i file prodotti ancora presenti e invariati: dopo un errore di
+orario.gestione_utenti.py la ripresa salta il fetch via SSH e l'estrazione dei dipendenti.
+Senza --resume tutte le fasi vengono eseguite e la cache viene solo aggiornata, sempre con la
+firma delle sorgenti: una ripresa dopo un errore riusa una fase solo se le sue sorgenti non sono
+cambiate nel frattempo. Se una sorgente non risponde alla sonda la fase viene eseguita e non
+entra in cache.
+
+La sessione SSH della sonda MySQL resta aperta fino a `close()`: la sessione di nuovi.utenti.py
+usa lo stesso master (vedi ssh_session.py), senza un secondo handshake.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+import mysql_load
+from atomic_output import published_sha256
+from backends import ssh_session
+from source_probe import probe_mssql, probe_mysql
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TTL = 3600
+# variabili che cambiano cosa viene letto o come vengono scritti i file
+ENV_PREFIXES = (
+    'MSSQL_', 'SSH_', 'DB_', 'AUTO_', 'DIPENDENTI_', 'DUMP_', 'OUTPUT_', 'MYSQL_LOAD', 'PASSWORD_',
+)
+
+log = logging.getLogger('stage_cache')
+
+
+def output_dir():
+    return os.getenv('AUTO_OUTPUT_DIR') or BASE_DIR
+
+
+def cache_path():
+    return os.getenv('STAGE_CACHE') or os.path.join(output_dir(), 'report', 'stage_cache.json')
+
+
+def cache_ttl():
+    return float(os.getenv('STAGE_CACHE_TTL') or DEFAULT_TTL)
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def env_digest():
+    return _digest({k: v for k, v in os.environ.items() if k.startswith(ENV_PREFIXES)})
+
+
+def code_digest():
+    h = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, '*.py'))):
+        h.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class StageCache:
+    """Ingressi e file prodotti dell'ultima esecuzione riuscita di ogni fase.
+
+    `sources` e' {script: nomi delle sorgenti ('mssql', 'mysql')}; le fasi girano su thread diversi.
+    """
+
+    def __init__(self, sources, path=None, ttl=None):
+        self.sources = sources
+        self.path = path or cache_path()
+        self.ttl = cache_ttl() if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._probes = {}
+        self._code = None
+        self._ssh = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('stages', {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _probe(self, name):
+        # una sonda per sorgente e per esecuzione, presa prima che le fasi leggano i dati
+        with self._lock:
+            if name not in self._probes:
+                try:
+                    self._probes[name] = self._probe_mysql() if name == 'mysql' else probe_mssql()
+                except Exception as e:
+                    log.warning('Sonda %s non riuscita (%s): le fasi che la leggono non usano la cache', name, e)
+                    self._probes[name] = None
+            return self._probes[name]
+
+    def _probe_mysql(self):
+        cfg = mysql_load.settings()
+        # la sessione resta aperta per le fasi che seguono (vedi close)
+        self._ssh = ssh_session(cfg['ssh_host'], cfg['ssh_port'], cfg['ssh_user']).open()
+        return probe_mysql(self._ssh, cfg)
+
+    def close(self):
+        """Chiude la sessione SSH aperta dalla sonda MySQL."""
+        if self._ssh is not None:
+            self._ssh.close()
+            self._ssh = None
+
+    def probe_all(self):
+        """Interroga subito tutte le sorgenti, prima che una fase inizi a leggerle."""
+        for names in self.sources.values():
+            for name in names:
+                self._probe(name)
+
+    def inputs(self, script, requires=()):
+        """Ingressi della fase `script`, oppure None se non si possono determinare."""
+        with self._lock:
+            if self._code is None:
+                self._code = code_digest()
+        sources = {}
+        for name in self.sources.get(script, ()):
+            sources[name] = self._probe(name)
+            if sources[name] is None:
+                return None
+        upstream = {}
+        for dep in requires:
+            entry = self.entries.get(dep)
+            if entry is None:
+                return None
+            upstream[dep] = entry['outputs']
+        inputs = {'env': env_digest(), 'code': self._code, 'sources': sources, 'upstream': upstream}
+        inputs['key'] = _digest(inputs)
+        return inputs
+
+    def lookup(self, script, inputs):
+        """Voce in cache della fase se ancora valida per questi ingressi, altrimenti None."""
+        entry = self.entries.get(script)
+        if entry is None or entry.get('inputs', {}).get('key') != inputs['key']:
+            return None
+        if self.ttl:
+            completed = datetime.fromisoformat(entry['completed_at'])
+            if (datetime.now(timezone.utc) - completed).total_seconds() > self.ttl:
+                return None
+        outputs = entry['outputs']
+        if published_sha256(output_dir(), list(outputs)) != outputs:
+            # file cancellati o modificati dopo l'esecuzione registrata
+            return None
+        return entry
+
+    def store(self, script, inputs, paths):
+        """Registra la fase riuscita con i suoi file prodotti (`paths`)."""
+        entry = {
+            'inputs': inputs,
+            'outputs': published_sha256(output_dir(), paths),
+            'completed_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            self.entries[script] = entry
+            self._save()
+
+    def drop(self, script):
+        with self._lock:
+            if self.entries.pop(script, None) is not None:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
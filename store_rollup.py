@@ -0,0 +1,203 @@
+"""Riepilogo per negozio delle ore settimanali, calcolato con NumPy sulle righe estratte.
+
+Con DIPENDENTI_ROLLUP=1 orario.dipendenti.py passa ogni riga (gia' normalizzata) a un
+`StoreRollup`; le colonne vengono convertite in array e aggregate con operazioni vettoriali
+(bincount sugli indici dei negozi), senza calcoli Python per riga:
+- per ogni `Neg`: numero di dipendenti, totale di Ore_Sett e di ogni giorno (Lunedi..Domenica)
+- per ogni `Neg` e `Livello`: numero di dipendenti e totale di Ore_Sett
+- le righe in cui la somma dei giorni differisce da Ore_Sett di piu' di MISMATCH_TOLERANCE
+
+Risultato in `csv/orari.dipendenti.negozi.csv` (una riga per negozio) e
+`csv/orari.dipendenti.negozi.json` (tutto, con l'elenco delle righe incoerenti).
+I valori vuoti o non numerici contano come 0 nei totali e sono conteggiati in `invalid_values`.
+
+Le righe non vengono conservate: `write_row` le tiene solo finche' non sono CHUNK_ROWS, poi il
+blocco viene fattorizzato in una sola passata: ogni riga diventa il numero della sua combinazione
+(Neg, Livello, Ore_Sett, giorni), in un array. Le combinazioni distinte sono poche: le loro ore
+vengono convertite in float una volta sola e le righe incoerenti si trovano con operazioni
+vettoriali sugli array (di quelle si tengono codice e nome). `compute` conta le righe di ogni
+combinazione con bincount e aggrega per negozio e livello con bincount pesati.
+Richiede `numpy`.
+"""
+import csv
+import json
+import os
+from itertools import islice
+from operator import itemgetter
+
+DAYS = ['Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica']
+MISMATCH_TOLERANCE = 0.01
+# righe convertite in array per volta
+CHUNK_ROWS = 65536
+
+
+def rollup_enabled():
+    return (os.getenv('DIPENDENTI_ROLLUP') or '').strip().lower() in ('1', 'true', 'yes', 'si')
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('DIPENDENTI_ROLLUP richiede il pacchetto numpy (pip install numpy)') from None
+    return numpy
+
+
+class _Codes(dict):
+    """Valore -> numero progressivo, assegnato alla prima occorrenza."""
+
+    def __missing__(self, value):
+        self[value] = code = len(self)
+        return code
+
+
+def to_float(value):
+    """Ore come float; NaN per i valori vuoti o non numerici."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def factorize(np, values):
+    """(valori distinti ordinati come stringhe, array della posizione di ogni valore in quell'elenco)."""
+    codes = _Codes()
+    ids = np.fromiter(map(codes.__getitem__, values), dtype=np.intp, count=len(values))
+    keys = ['' if k is None else str(k) for k in codes]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    rank = np.empty(len(keys), dtype=np.intp)
+    rank[order] = np.arange(len(keys))
+    return [keys[i] for i in order], rank[ids]
+
+
+class StoreRollup:
+    """Fattorizza le righe di orario.dipendenti.py in array e ne calcola il riepilogo per negozio.
+
+    `columns` e' l'elenco delle colonne delle righe passate a `write_row`.
+    """
+
+    def __init__(self, columns):
+        self.np = _numpy()
+        index = {name: i for i, name in enumerate(columns)}
+        # combinazione di una riga: (Neg, Livello, Ore_Sett, Lunedi..Domenica)
+        self._key = itemgetter(*[index[name] for name in ('Neg', 'Livello', 'Ore_Sett', *DAYS)])
+        self._ident = itemgetter(index['CODICEPERSONALE'], index['NOME'])
+        self._pending = []
+        self._keys = _Codes()
+        # Ore_Sett e giorni come float, una riga per combinazione nell'ordine dei numeri
+        self._hours = []
+        # numeri delle combinazioni, un array per blocco di righe
+        self._chunks = []
+        self._mismatch_rows = []
+
+    def write_row(self, values):
+        self._pending.append(values)
+        if len(self._pending) >= CHUNK_ROWS:
+            self._flush()
+
+    def _key_hours(self):
+        """Ore delle combinazioni (matrice float), con quelle nuove convertite."""
+        for key in islice(self._keys, len(self._hours), None):
+            self._hours.append([to_float(v) for v in key[2:]])
+        return self.np.array(self._hours, dtype=self.np.float64).reshape(-1, 1 + len(DAYS))
+
+    def _mismatched(self, hours):
+        """Combinazioni in cui la somma dei giorni differisce da Ore_Sett (mancante: non incoerente)."""
+        np = self.np
+        ore, days_total = hours[:, 0], np.nansum(hours[:, 1:], axis=1)
+        with np.errstate(invalid='ignore'):
+            return np.abs(days_total - ore) > MISMATCH_TOLERANCE, ore, days_total
+
+    def _flush(self):
+        """Fattorizza le righe in attesa e registra quelle incoerenti."""
+        np = self.np
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        codes = np.fromiter(map(self._keys.__getitem__, map(self._key, rows)), dtype=np.intp, count=len(rows))
+        mismatch, ore, days_total = self._mismatched(self._key_hours())
+        for i in np.flatnonzero(mismatch[codes]):
+            code = codes[i]
+            self._mismatch_rows.append(
+                (self._key(rows[i])[0], *self._ident(rows[i]), float(ore[code]), float(days_total[code])))
+        self._chunks.append(codes)
+
+    def compute(self):
+        """Riepilogo (dict) di tutte le righe raccolte."""
+        np = self.np
+        self._flush()
+        keys = list(self._keys)
+        hours = self._key_hours()
+        codes = np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=np.intp)
+        weights = np.bincount(codes, minlength=len(keys)).astype(np.float64)
+        invalid = int((np.isnan(hours).sum(axis=1) * weights).sum())
+        clean = np.nan_to_num(hours)
+        ore_clean, days_clean = clean[:, 0], clean[:, 1:]
+        mismatch = self._mismatched(hours)[0]
+
+        stores, store_idx = factorize(np, [k[0] for k in keys])
+        levels, level_idx = factorize(np, [k[1] for k in keys])
+        n_stores = len(stores)
+        headcount = np.bincount(store_idx, weights=weights, minlength=n_stores)
+        ore_totals = np.bincount(store_idx, weights=weights * ore_clean, minlength=n_stores)
+        day_totals = np.stack(
+            [np.bincount(store_idx, weights=weights * days_clean[:, d], minlength=n_stores) for d in range(len(DAYS))],
+            axis=1,
+        )
+
+        pair = store_idx * len(levels) + level_idx
+        size = n_stores * len(levels)
+        level_heads = np.bincount(pair, weights=weights, minlength=size).reshape(n_stores, len(levels))
+        level_hours = np.bincount(pair, weights=weights * ore_clean, minlength=size).reshape(n_stores, len(levels))
+        mismatch_per_store = np.bincount(store_idx, weights=weights * mismatch, minlength=n_stores)
+
+        return {
+            'rows': len(codes),
+            'invalid_values': invalid,
+            'mismatch_tolerance': MISMATCH_TOLERANCE,
+            'stores': [
+                {
+                    'Neg': stores[s],
+                    'headcount': int(headcount[s]),
+                    'Ore_Sett': round(float(ore_totals[s]), 2),
+                    'days': {d: round(float(day_totals[s, i]), 2) for i, d in enumerate(DAYS)},
+                    'levels': {
+                        levels[j]: {'headcount': int(level_heads[s, j]), 'Ore_Sett': round(float(level_hours[s, j]), 2)}
+                        for j in np.flatnonzero(level_heads[s])
+                    },
+                    'mismatches': int(mismatch_per_store[s]),
+                }
+                for s in range(n_stores)
+            ],
+            'mismatches': [
+                {
+                    'Neg': '' if neg is None else str(neg),
+                    'CODICEPERSONALE': codice,
+                    'NOME': nome,
+                    'Ore_Sett': ore,
+                    'days_total': round(days_total, 2),
+                }
+                for neg, codice, nome, ore, days_total in self._mismatch_rows
+            ],
+        }
+
+    def write(self, csv_path, json_path):
+        """Calcola il riepilogo e lo scrive nei due file; restituisce il riepilogo."""
+        summary = self.compute()
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Neg', 'headcount', 'Ore_Sett', *DAYS, 'mismatches'])
+            for store in summary['stores']:
+                writer.writerow([
+                    store['Neg'], store['headcount'], f"{store['Ore_Sett']:.2f}",
+                    *(f"{store['days'][d]:.2f}" for d in DAYS), store['mismatches'],
+                ])
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""Validatore dei file esportati da orario.dipendenti.py (sostituisce il vecchio check_names.py).
+
+Legge `dump/orari.dipendenti.sql` (formati single, multi e load) e `csv/orari.dipendenti.csv`,
+anche compressi, dividendoli in blocchi controllati in parallelo su piu' processi:
+- i file non compressi vengono divisi in intervalli di byte allineati a fine riga, e ogni
+  processo legge da solo il proprio intervallo
+- i file compressi vengono decompressi dal processo principale e inviati a blocchi di righe
+- nel CSV un blocco finisce solo a fine record: un a capo dentro un campo tra virgolette non
+  divide (il numero di virgolette dall'inizio del blocco deve essere pari)
+I blocchi del dump e del CSV girano insieme sullo stesso pool: mentre il processo principale
+raccoglie i risultati del dump, un thread continua a inviare i blocchi del CSV.
+
+Controlli su ogni riga, sia del dump sia del CSV:
+- CODICEPERSONALE presente e unico, Neg e NOME presenti, NOME normalizzato (names.py)
+- Ore_Sett e ore dei singoli giorni numeriche, Livello intero, date in formato YYYY-MM-DD
+- somma delle ore dei giorni uguale a Ore_Sett
+Controlli incrociati: stesso insieme di codici nel dump e nel CSV e stessi valori per ogni codice.
+
+Il riepilogo va in `report/validation.json`, tutti i problemi (senza limite) in
+`report/validation.issues.jsonl`, uno per riga. Uscita 0 se non ci sono problemi, 1 altrimenti.
+
+Uso: python validator.py [--dir CARTELLA] [--workers N] [--report PERCORSO]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from dump_reader import _HEADER_RE, _LOAD_RE, _columns, _table_matches, parse_tuples, tsv_unescape
+from names import normalize_name
+from output_codecs import is_compressed, open_text, resolve_path
+
+TABLE = 'dipendenti'
+KEY = 'CODICEPERSONALE'
+DAYS = ('Lunedi', 'Martedi', 'Mercoledi', 'Giovedi', 'Venerdi', 'Sabato', 'Domenica')
+HOURS = ('Ore_Sett',) + DAYS
+DATES = ('DATA_ASSUNZIONE', 'DATA_FINE_CONTRATTO')
+REQUIRED = (KEY, 'Neg', 'NOME')
+HOURS_TOLERANCE = Decimal('0.01')
+CHUNK_BYTES = 8 * 1024 * 1024
+CHUNK_LINES = 50000
+EXAMPLES_PER_CHECK = 5
+
+
+def _text(value):
+    """Valore come stringa confrontabile tra dump e CSV: NULL e cella vuota diventano ''."""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def _decimal(value):
+    try:
+        return Decimal(value)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def check_record(record):
+    """Problemi di una riga {colonna: testo}: lista di (controllo, colonna, valore)."""
+    issues = []
+    for col in REQUIRED:
+        if not record.get(col):
+            issues.append(('missing_value', col, record.get(col)))
+    nome = record.get('NOME')
+    if nome and nome != normalize_name(nome):
+        issues.append(('name_not_normalized', 'NOME', nome))
+    hours = {}
+    for col in HOURS:
+        value = record.get(col, '')
+        if value == '':
+            continue
+        number = _decimal(value)
+        if number is None:
+            issues.append(('invalid_number', col, value))
+        else:
+            hours[col] = number
+    livello = record.get('Livello', '')
+    if livello != '' and not livello.lstrip('-').isdigit():
+        issues.append(('invalid_int', 'Livello', livello))
+    for col in DATES:
+        value = record.get(col, '')
+        if value == '':
+            continue
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            issues.append(('invalid_date', col, value))
+    if 'Ore_Sett' in hours and all(d in hours or record.get(d, '') == '' for d in DAYS):
+        total = sum(hours.get(d, Decimal(0)) for d in DAYS)
+        if abs(total - hours['Ore_Sett']) > HOURS_TOLERANCE:
+            issues.append(('hours_mismatch', 'Ore_Sett', f"{hours['Ore_Sett']} != {total}"))
+    return issues
+
+
+def _digest(record, columns):
+    data = '\x1f'.join(record.get(c, '') for c in columns).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def _iter_sql_records(lines, columns):
+    """(indice riga, record) delle tuple in `lines`; le righe che non sono INSERT vengono saltate."""
+    header_cols = columns
+    for i, line in enumerate(lines):
+        if line.startswith('('):
+            rows, _ = parse_tuples(line)
+        else:
+            m = _HEADER_RE.match(line)
+            if m is None:
+                continue
+            if not _table_matches(m.group(1), TABLE):
+                continue
+            header_cols = _columns(m.group(2))
+            rows, _ = parse_tuples(line, m.end())
+        for values in rows:
+            yield i, header_cols, values
+
+
+def _records(kind, lines, columns):
+    if kind == 'sql':
+        for i, cols, values in _iter_sql_records(lines, columns):
+            yield i, cols, [_text(v) for v in values]
+    elif kind == 'tsv':
+        for i, line in enumerate(lines):
+            if line:
+                yield i, columns, [_text(tsv_unescape(v)) for v in line.split('\t')]
+    else:
+        # un record puo' occupare piu' righe: l'indice e' quello della sua prima riga
+        reader = csv.reader(lines)
+        first = 0
+        for values in reader:
+            if values:
+                yield first, columns, values
+            first = reader.line_num
+
+
+def _read_range(path, start, end, keepends=False):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.decode('utf-8-sig' if start == 0 else 'utf-8').split('\n')
+    if keepends:
+        # CSV: csv.reader deve vedere gli a capo dentro i campi tra virgolette
+        return [line + '\n' for line in lines[:-1]] + lines[-1:]
+    return lines
+
+
+def check_chunk(task):
+    """Controlla un blocco di righe; restituisce righe lette, problemi e impronta dei valori per codice."""
+    kind, path, start, end, lines, columns, skip = task
+    if lines is None:
+        lines = _read_range(path, start, end, keepends=kind == 'csv')
+        if lines and lines[-1] == '':
+            lines.pop()
+    result = {'lines': len(lines), 'rows': 0, 'issues': [], 'digests': []}
+    for i, cols, values in _records(kind, lines[skip:], columns):
+        line = i + skip
+        result['rows'] += 1
+        if len(values) != len(cols):
+            result['issues'].append({'line': line, 'check': 'column_count', 'column': None,
+                                     'value': f"{len(values)} valori per {len(cols)} colonne"})
+            continue
+        record = dict(zip(cols, values))
+        key = record.get(KEY, '')
+        for check, column, value in check_record(record):
+            result['issues'].append({'line': line, 'key': key, 'check': check, 'column': column, 'value': value})
+        if key:
+            result['digests'].append((key, line, _digest(record, columns)))
+    return result
+
+
+def _byte_ranges(path, chunk_bytes):
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _csv_ranges(path, chunk_bytes):
+    """Come _byte_ranges, ma ogni intervallo finisce a fine record CSV.
+
+    Ogni intervallo inizia a inizio record, quindi un a capo e' fuori dalle virgolette se le
+    virgolette lette dall'inizio dell'intervallo sono in numero pari (quelle raddoppiate di un
+    campo contano due).
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(start)
+            data = f.read(chunk_bytes)
+            quotes = data.count(b'"')
+            end = start + len(data)
+            while end < size and (quotes % 2 or not data.endswith(b'\n')):
+                data = f.readline()
+                quotes += data.count(b'"')
+                end += len(data)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _tasks(kind, path, columns, skip_first, chunk_bytes, chunk_lines):
+    """Blocchi di un file: intervalli di byte se non e' compresso, altrimenti righe gia' lette."""
+    if not is_compressed(path):
+        ranges = _csv_ranges(path, chunk_bytes) if kind == 'csv' else _byte_ranges(path, chunk_bytes)
+        for n, (start, end) in enumerate(ranges):
+            yield (kind, path, start, end, None, columns, skip_first if n == 0 else 0)
+        return
+    encoding = 'utf-8-sig' if kind == 'csv' else 'utf-8'
+    with open_text(path, 'r', encoding=encoding, newline='') as f:
+        batch = []
+        skip = skip_first
+        quotes = 0
+        for line in f:
+            if kind == 'csv':
+                # a capo compresi e blocco chiuso solo a fine record (vedi _csv_ranges)
+                batch.append(line)
+                quotes += line.count('"')
+            else:
+                batch.append(line.rstrip('\r\n'))
+            if len(batch) >= chunk_lines and not quotes % 2:
+                yield (kind, path, 0, 0, batch, columns, skip)
+                batch, skip, quotes = [], 0, 0
+        if batch:
+            yield (kind, path, 0, 0, batch, columns, skip)
+
+
+def _map_ordered(pool, func, tasks, window):
+    """Come pool.map ma con al massimo `window` blocchi in corso (i blocchi compressi stanno in memoria)."""
+    if pool is None:
+        yield from map(func, tasks)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(func, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _prefetch(results, size):
+    """Consuma `results` su un thread, con al massimo `size` risultati in attesa; restituisce un iteratore.
+
+    Il thread parte subito: i blocchi vengono inviati al pool mentre il chiamante fa altro.
+    """
+    pending = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for result in results:
+                pending.put((result, None))
+            pending.put((done, None))
+        except BaseException as e:
+            pending.put((done, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    def consume():
+        while True:
+            result, error = pending.get()
+            if result is done:
+                if error is not None:
+                    raise error
+                return
+            yield result
+
+    return consume()
+
+
+def _dump_source(sql_path, default_columns):
+    """Origine delle righe del dump: ('sql', percorso, colonne) o ('tsv', percorso, colonne) per il formato load."""
+    with open_text(sql_path, 'r', encoding='utf-8') as f:
+        for n, line in enumerate(f):
+            load = _LOAD_RE.match(line)
+            if load and _table_matches(load.group(2), TABLE):
+                tsv = resolve_path(os.path.join(os.path.dirname(os.path.abspath(sql_path)), load.group(1)))
+                return 'tsv', tsv, _columns(load.group(3))
+            if _HEADER_RE.match(line) or n > 100:
+                break
+    return 'sql', sql_path, default_columns
+
+
+def _csv_columns(csv_path):
+    with open_text(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+class Validation:
+    """Raccoglie i risultati dei blocchi e scrive il report."""
+
+    def __init__(self, issues_path):
+        self.issues_path = issues_path
+        self.counts = Counter()
+        self.examples = {}
+        self.rows = {}
+        os.makedirs(os.path.dirname(issues_path) or '.', exist_ok=True)
+        self._issues = open(issues_path + '.tmp', 'w', encoding='utf-8')
+
+    def issue(self, source, **issue):
+        issue = {'file': source, **issue}
+        self.counts[issue['check']] += 1
+        examples = self.examples.setdefault(issue['check'], [])
+        if len(examples) < EXAMPLES_PER_CHECK:
+            examples.append(issue)
+        self._issues.write(json.dumps(issue, ensure_ascii=False) + '\n')
+
+    def collect(self, source, results):
+        """Unisce i risultati (in ordine) di un file; restituisce {codice: (riga, impronta)}."""
+        digests = {}
+        offset = 0
+        rows = 0
+        for result in results:
+            rows += result['rows']
+            for issue in result['issues']:
+                issue['line'] += offset + 1
+                self.issue(source, **issue)
+            for key, line, digest in result['digests']:
+                if key in digests:
+                    self.issue(source, line=line + offset + 1, key=key, check='duplicate_key', column=KEY,
+                               value=f"gia' presente alla riga {digests[key][0]}")
+                    continue
+                digests[key] = (line + offset + 1, digest)
+            offset += result['lines']
+        self.rows[source] = rows
+        return digests
+
+    def cross_check(self, sql_source, sql, csv_source, csv_digests):
+        for key, (line, digest) in sql.items():
+            other = csv_digests.get(key)
+            if other is None:
+                self.issue(sql_source, line=line, key=key, check='missing_in_csv', column=KEY, value=key)
+            elif other[1] != digest:
+                self.issue(sql_source, line=line, key=key, check='value_mismatch', column=None,
+                           value=f"riga {other[0]} di {os.path.basename(csv_source)}")
+        for key, (line, _) in csv_digests.items():
+            if key not in sql:
+                self.issue(csv_source, line=line, key=key, check='missing_in_sql', column=KEY, value=key)
+
+    def close(self):
+        self._issues.close()
+        os.replace(self.issues_path + '.tmp', self.issues_path)
+
+
+def validate(base_dir, workers=None, report_path=None, chunk_bytes=CHUNK_BYTES, chunk_lines=CHUNK_LINES):
+    """Valida dump e CSV dei dipendenti in `base_dir`; restituisce il report (dict)."""
+    started = time.perf_counter()
+    sql_path = resolve_path(os.path.join(base_dir, 'dump', 'orari.dipendenti.sql'))
+    csv_path = resolve_path(os.path.join(base_dir, 'csv', 'orari.dipendenti.csv'))
+    report_path = report_path or os.path.join(base_dir, 'report', 'validation.json')
+    issues_path = os.path.splitext(report_path)[0] + '.issues.jsonl'
+    workers = workers or os.cpu_count() or 1
+
+    validation = Validation(issues_path)
+    missing = [p for p in (sql_path, csv_path) if not os.path.exists(p)]
+    for path in missing:
+        validation.issue(path, line=None, key=None, check='missing_file', column=None, value=path)
+    columns = _csv_columns(csv_path) if csv_path not in missing else []
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        sql_digests = csv_digests = csv_results = None
+        if csv_path not in missing:
+            tasks = _tasks('csv', csv_path, columns, 1, chunk_bytes, chunk_lines)
+            csv_results = _map_ordered(pool, check_chunk, tasks, workers * 2)
+            if pool is not None:
+                # il CSV viene controllato dai processi mentre si raccolgono i risultati del dump
+                csv_results = _prefetch(csv_results, workers * 2)
+        if sql_path not in missing:
+            kind, source, source_cols = _dump_source(sql_path, columns)
+            tasks = _tasks(kind, source, source_cols, 0, chunk_bytes, chunk_lines)
+            sql_digests = validation.collect(source, _map_ordered(pool, check_chunk, tasks, workers * 2))
+            sql_source = source
+        if csv_results is not None:
+            csv_digests = validation.collect(csv_path, csv_results)
+        if sql_digests is not None and csv_digests is not None:
+            validation.cross_check(sql_source, sql_digests, csv_path, csv_digests)
+    finally:
+        if pool is not None:
+            # dopo un errore i blocchi ancora in coda non servono
+            pool.shutdown(cancel_futures=sys.exc_info()[0] is not None)
+        validation.close()
+
+    total = sum(validation.counts.values())
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'ok': total == 0,
+        'files': {'sql': sql_path, 'csv': csv_path},
+        'rows': validation.rows,
+        'issues_total': total,
+        'issues_by_check': dict(sorted(validation.counts.items())),
+        'examples': validation.examples,
+        'issues_file': issues_path,
+        'workers': workers,
+        'duration_s': time.perf_counter() - started,
+    }
+    tmp = report_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, report_path)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Valida dump SQL e CSV dei dipendenti')
+    parser.add_argument('--dir', default=os.getenv('AUTO_OUTPUT_DIR') or os.path.dirname(os.path.abspath(__file__)),
+                        help='cartella che contiene dump/ e csv/')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('VALIDATE_WORKERS', '0') or 0) or None,
+                        help='processi paralleli (default: numero di CPU)')
+    parser.add_argument('--report', help='percorso del report JSON (default: <dir>/report/validation.json)')
+    args = parser.parse_args(argv)
+
+    report = validate(args.dir, workers=args.workers, report_path=args.report)
+    rows = ', '.join(f"{os.path.basename(k)}: {v}" for k, v in report['rows'].items())
+    if report['ok']:
+        print(f"OK: nessun problema trovato ({rows}).")
+        return 0
+    print(f"Trovati {report['issues_total']} problemi ({rows}):")
+    for check, count in report['issues_by_check'].items():
+        print(f"  {check}: {count}")
+    print(f"Dettagli in {report['issues_file']}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())